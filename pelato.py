@@ -6,6 +6,7 @@ import os
 
 import src
 import src.utils as ut
+import src.tracing as tracing
 from src.colors import Colors
 
 def print_banner():
@@ -34,7 +35,7 @@ def validate_directory(directory):
 
 def suggest_command(invalid_command):
     """Suggest similar commands when user types invalid command"""
-    commands = ["gen", "build", "deploy", "remove", "brush"]
+    commands = ["gen", "build", "deploy", "remove", "brush", "cache", "metrics", "bench", "serve", "watch"]
     suggestions = []
     for cmd in commands:
         # Simple similarity check
@@ -52,6 +53,11 @@ def suggest_command(invalid_command):
     print(f"   {Colors.GREEN}deploy{Colors.RESET}  - Deploy WASM components")
     print(f"   {Colors.GREEN}remove{Colors.RESET}  - Remove deployed WASM components")
     print(f"   {Colors.GREEN}brush{Colors.RESET}   - Full pipeline: gen → build → deploy")
+    print(f"   {Colors.GREEN}cache{Colors.RESET}   - Inspect or prune the build caches")
+    print(f"   {Colors.GREEN}metrics{Colors.RESET} - Show, import or export the stored runs metrics")
+    print(f"   {Colors.GREEN}bench{Colors.RESET}   - Benchmark synthetic projects of N components")
+    print(f"   {Colors.GREEN}serve{Colors.RESET}   - Run the jobs posted to a local HTTP API")
+    print(f"   {Colors.GREEN}watch{Colors.RESET}   - Rebuild and redeploy the components affected by each edit")
     # print available templates
     available_templates = ut.get_available_templates()
     if available_templates:
@@ -77,6 +83,11 @@ def main():
   {Colors.GREEN}deploy{Colors.RESET}  Deploy WASM components to wasmCloud
   {Colors.GREEN}remove{Colors.RESET}  Remove deployed WASM components
   {Colors.GREEN}brush{Colors.RESET}   Run complete pipeline: generate → build → deploy
+  {Colors.GREEN}cache{Colors.RESET}   Inspect (info) or prune the Go/TinyGo build caches
+  {Colors.GREEN}metrics{Colors.RESET} Show (info), import yaml runs or export the metrics store
+  {Colors.GREEN}bench{Colors.RESET}   Benchmark gen/build/deploy on synthetic projects (fake or docker backend)
+  {Colors.GREEN}serve{Colors.RESET}   Keep PELATO loaded and run gen/build/deploy/remove/brush jobs from a local HTTP API
+  {Colors.GREEN}watch{Colors.RESET}   Regenerate, rebuild and redeploy only the components affected by each edit
 
 {Colors.CYAN}Usage:{Colors.RESET}
   {Colors.YELLOW}python3 pelato.py <command> <project_directory>{Colors.RESET}
@@ -86,16 +97,27 @@ def main():
   {Colors.GREEN}python3 pelato.py build project/{Colors.RESET}      Build WASM components  
   {Colors.GREEN}python3 pelato.py deploy project/{Colors.RESET}     Deploy components
   {Colors.GREEN}python3 pelato.py brush project/{Colors.RESET}      Run full pipeline
+  {Colors.GREEN}python3 pelato.py watch project/{Colors.RESET}      Update the components on every edit
+  {Colors.GREEN}python3 pelato.py cache prune --max-size 5g{Colors.RESET}  Trim build caches to 5 GiB
+  {Colors.GREEN}python3 pelato.py metrics import project/ res/metrics/*.yaml{Colors.RESET}  Import old runs
+  {Colors.GREEN}python3 pelato.py bench bench/ --sizes 1,10,100 --repetitions 5{Colors.RESET}  Scaling curve on the fake backend
+  {Colors.GREEN}python3 pelato.py serve --port 8765{Colors.RESET}  Serve on http://127.0.0.1:8765
 
 {Colors.CYAN}Environment Variables:{Colors.RESET}
   REGISTRY_URL, REGISTRY_USER, REGISTRY_PASSWORD
-  NATS_HOST, NATS_PORT, PARALLEL_BUILD, ENABLE_METRICS
+  NATS_HOST, NATS_PORT, PARALLEL_BUILD, ENABLE_METRICS, ENABLE_TRACING, TRACE_FILE
+  DEPLOY_BACKEND, WADM_LATTICE
+  CONTAINER_BACKEND, FAKE_LATENCY, MAX_CONCURRENCY, DEPLOY_CONCURRENCY, CONTAINER_CPUS, CONTAINER_MEMORY, FAIL_FAST
+  BUILD_CACHE, BUILD_CACHE_DIR, BUILD_CACHE_MAX_SIZE
+  BUILD_WORKERS, BUILD_WORKER_MAX_JOBS, BUILD_ENDPOINTS, PREWARM_DEPS, BATCH_BUILD, PIPELINE
+  ARTIFACT_STORE, ARTIFACT_STORE_DIR
+  INCREMENTAL_GEN, INCREMENTAL_BUILD, INCREMENTAL_DEPLOY
+  TEMPLATE_CACHE_DIR, GEN_MATERIALIZE
+
+{Colors.CYAN}Templates:{Colors.RESET}
+  One folder per template in src/code_generator/templates, selected by the `type` of each task
 """
-            available_templates = ut.get_available_templates()
-            if available_templates:
-                help_text += f"\n{Colors.BLUE}Available templates:{Colors.RESET}\n"
-                for template in available_templates:
-                    help_text += f"   {Colors.CYAN}• {template}{Colors.RESET}\n"
+            # Not listed here: help and usage are printed without touching the templates
             return help_text
 
     parser = argparse.ArgumentParser(
@@ -114,6 +136,31 @@ def main():
     parser_remove.add_argument("dir", type=str, nargs='?')
     parser_all = subparsers.add_parser("brush", add_help=False)
     parser_all.add_argument("dir", type=str, nargs='?')
+    parser_cache = subparsers.add_parser("cache", add_help=False)
+    parser_cache.add_argument("action", type=str, nargs='?', choices=["info", "prune"], default="info")
+    parser_cache.add_argument("--max-size", type=str)
+    parser_metrics = subparsers.add_parser("metrics", add_help=False)
+    parser_metrics.add_argument("action", type=str, choices=["info", "import", "export"])
+    parser_metrics.add_argument("dir", type=str, nargs='?')
+    parser_metrics.add_argument("paths", type=str, nargs='*')
+    parser_bench = subparsers.add_parser("bench", add_help=False)
+    parser_bench.add_argument("dir", type=str, nargs='?', default="bench")
+    parser_bench.add_argument("--sizes", type=str, default="1,10,100")
+    parser_bench.add_argument("--repetitions", type=int, default=5)
+    parser_bench.add_argument("--stages", type=str, default="gen,build,deploy")
+    parser_bench.add_argument("--backend", type=str, choices=["fake", "docker"], default="fake")
+    parser_bench.add_argument("--latency", type=float, default=0.0)
+    parser_bench.add_argument("--deploy-latency", type=float)
+    parser_bench.add_argument("--failure-rate", type=float, default=0.0)
+    parser_bench.add_argument("--types", type=str)
+    parser_bench.add_argument("--verbose", action='store_true')
+    parser_watch = subparsers.add_parser("watch", add_help=False)
+    parser_watch.add_argument("dir", type=str, nargs='?')
+    parser_watch.add_argument("--interval", type=float, default=0.5)
+    parser_watch.add_argument("--debounce", type=float, default=1.0)
+    parser_serve = subparsers.add_parser("serve", add_help=False)
+    parser_serve.add_argument("--host", type=str, default="127.0.0.1")
+    parser_serve.add_argument("--port", type=int, default=8765)
 
     # --- Parse args & validate ---
     args = parser.parse_args()
@@ -124,12 +171,13 @@ def main():
         parser.print_help()
         print(f"\n{Colors.RED}❌ Error: No command specified{Colors.RESET}")
         sys.exit(1)
-    if not args.dir:
-        parser.print_help()
-        print(f"\n{Colors.RED}❌ Error: Project directory is required{Colors.RESET}")
-        sys.exit(1)
-    if not validate_directory(args.dir):
-        sys.exit(1)
+    if args.command not in ("cache", "bench", "serve"):
+        if not args.dir:
+            parser.print_help()
+            print(f"\n{Colors.RED}❌ Error: Project directory is required{Colors.RESET}")
+            sys.exit(1)
+        if not validate_directory(args.dir):
+            sys.exit(1)
 
     # --- Setup Pelato ---
     print(f"{Colors.BLUE}🔧 Initializing PELATO...{Colors.RESET}")
@@ -138,21 +186,41 @@ def main():
         print(f"{Colors.CYAN}📊 Metrics collection enabled{Colors.RESET}")
         pelato.metrics = {}
         start_time = time.time()
+    if pelato.tracing_enabled and args.command not in ("cache", "metrics", "bench", "serve", "watch"):
+        trace_file = pelato.trace_file or f"{args.dir}/traces.jsonl"
+        print(f"{Colors.CYAN}🔎 Tracing enabled, spans exported to {trace_file}{Colors.RESET}")
+        tracer = tracing.configure(trace_file, {'pelato.command': args.command, 'pelato.project': args.dir})
+        tracer.start_root(f"pelato {args.command}")
 
     # --- Execute command ---
     print(f"{Colors.MAGENTA}🚀 Executing command: {args.command}{Colors.RESET}")
-    print(f"{Colors.BLUE}📁 Project directory: {args.dir}{Colors.RESET}\n")
+    if args.command not in ("cache", "serve"):
+        print(f"{Colors.BLUE}📁 Project directory: {args.dir}{Colors.RESET}\n")
+    # Stage commands return False when they fail, the exit code reports it after the metrics are saved
+    ok = True
     try:
         if args.command == "gen":
-            pelato.generate(args.dir)
+            ok = pelato.generate(args.dir)
         elif args.command == "build":
-            pelato.build(args.dir)
+            ok = pelato.build(args.dir)
         elif args.command == "deploy":
-            pelato.deploy(args.dir)
+            ok = pelato.deploy(args.dir)
         elif args.command == "remove":
-            pelato.remove(args.dir)
+            ok = pelato.remove(args.dir)
         elif args.command == "brush":
-            pelato.all(args.dir)
+            ok = pelato.all(args.dir)
+        elif args.command == "cache":
+            pelato.cache(args.action, args.max_size)
+        elif args.command == "metrics":
+            pelato.runs(args.action, args.dir, args.paths)
+        elif args.command == "bench":
+            ok = pelato.bench(args.dir, [int(n) for n in args.sizes.split(',')], args.repetitions, args.stages.split(','),
+                         args.backend, args.latency, args.deploy_latency, args.failure_rate,
+                         args.types.split(',') if args.types else None, args.verbose)
+        elif args.command == "watch":
+            pelato.watch(args.dir, args.interval, args.debounce)
+        elif args.command == "serve":
+            pelato.serve(args.host, args.port)
         else:
             print(f"{Colors.RED}❌ Unknown command: '{args.command}'{Colors.RESET}")
             suggest_command(args.command)
@@ -162,18 +230,25 @@ def main():
         sys.exit(130)
     except Exception as e:
         print(f"\n{Colors.RED}❌ Unexpected error: {e}{Colors.RESET}")
+        if tracing.current_span() is not None:
+            tracing.current_span().set_error(e)
         sys.exit(1)
+    finally:
+        pelato.close()
+        tracing.get_tracer().export()
 
     # --- Metrics save ---
     if pelato.metrics_enabled:
         end_time = time.time()
         pelato.metrics['time_total'] = '%.3f' % (end_time - start_time)
         print(f"\n{Colors.CYAN}📊 Saving metrics...{Colors.RESET}")
-        full_metrics = ut.load_metrics(args.dir)
-        full_metrics['runs'].append(pelato.metrics)
-        ut.dump_metrics(full_metrics, args.dir)
+        pelato.save_metrics(args.dir, args.command, start_time)
         print(f"{Colors.GREEN}✅ Metrics saved successfully{Colors.RESET}")
 
+    if not ok:
+        print(f"\n{Colors.RED}❌ PELATO {args.command} failed{Colors.RESET}")
+        sys.exit(1)
+
     print(f"\n{Colors.GREEN}🎉 PELATO execution completed successfully!{Colors.RESET}")
 
 
@@ -1,12 +1,13 @@
 import os
-from dotenv import load_dotenv
-import src.code_generator.generator as code_generator
-import src.wasm_builder.build as wasm_builder
-import src.component_deploy.deploy as deployer
-import src.component_deploy.remove as remover
 import time
+import src.tracing as tracing
+from src.wasm_builder.cache import BuildCache
+from .scheduler import ContainerScheduler, parse_size
 from .colors import Colors
 
+# The stage modules (and docker, jinja2, nats, sqlite) are imported by the methods
+# using them, so every command loads only what it needs
+
 class Pelato:
     def __init__(self):
         
@@ -14,29 +15,203 @@ class Pelato:
         
     def setup_vars(self):
         
-        load_dotenv(override=True)
+        # PELATO_DOTENV points to another .env (e.g. an empty one for a clean environment)
+        from dotenv import load_dotenv
+        load_dotenv(os.getenv('PELATO_DOTENV'), override=True)
         
         self.registry_url = os.getenv('REGISTRY_URL')
         self.reg_user = os.getenv('REGISTRY_USER')
         self.reg_pass = os.getenv('REGISTRY_PASSWORD')
         self.detached = os.getenv('PARALLEL_BUILD')
+        self.scheduler = ContainerScheduler.from_env(self.detached)
+        self.build_cache = BuildCache.from_env()
+        self.container_backend = os.getenv('CONTAINER_BACKEND', 'docker')
+        self.fake_latency = float(os.getenv('FAKE_LATENCY') or 0)
+        self.backend = None
+        self.build_workers = int(os.getenv('BUILD_WORKERS') or 0)
+        self.build_worker_max_jobs = int(os.getenv('BUILD_WORKER_MAX_JOBS') or 50)
+        self.worker_pool = None
+        self.prewarm_deps = os.getenv('PREWARM_DEPS') == 'True'
+        self.batch_build = os.getenv('BATCH_BUILD') == 'True'
+        self.artifact_store = os.getenv('ARTIFACT_STORE') == 'True'
+        self.artifact_store_dir = os.getenv('ARTIFACT_STORE_DIR')
+        self.artifacts = None
+        self.build_endpoints = os.getenv('BUILD_ENDPOINTS')
+        self.build_dispatcher = None
         self.nats_host = os.getenv('NATS_HOST')
         self.nats_port = os.getenv('NATS_PORT')
+        self.deploy_backend = os.getenv('DEPLOY_BACKEND', 'container')
+        self.wadm_lattice = os.getenv('WADM_LATTICE')
+        self.wadm_session = None
         self.metrics_enabled = os.getenv('ENABLE_METRICS') == 'True'
+        self.tracing_enabled = os.getenv('ENABLE_TRACING') == 'True'
+        self.trace_file = os.getenv('TRACE_FILE')
+        self.incremental_gen = os.getenv('INCREMENTAL_GEN') == 'True'
+        self.incremental_build = os.getenv('INCREMENTAL_BUILD') == 'True'
+        self.incremental_deploy = os.getenv('INCREMENTAL_DEPLOY') == 'True'
+        self.template_cache_dir = os.getenv('TEMPLATE_CACHE_DIR')
+        self.gen_materialize = os.getenv('GEN_MATERIALIZE') or 'auto'
+        self.pipeline = os.getenv('PIPELINE') == 'True'
         self.metrics = {}
         
-    def generate(self, project_dir):
-        code_generator.generate(project_dir, self.registry_url, self.metrics, self.metrics_enabled)
+    def generate(self, project_dir, only=None):
+        from .code_generator import generator as code_generator, template_registry
+        with tracing.span('generate', project=project_dir):
+            templates = template_registry.get_registry(self.template_cache_dir)
+            return code_generator.generate(project_dir, self.registry_url, self.metrics, self.metrics_enabled, self.incremental_gen, templates, self.gen_materialize, only=only)
+        
+    def get_backend(self):
+        
+        # One container backend for every stage: docker client and connection pool, image lookups, workers
+        if self.backend is None:
+            from .container_backend import DockerBackend, FakeBackend, CONTAINER_BACKENDS
+            if self.container_backend not in CONTAINER_BACKENDS:
+                print(f"{Colors.YELLOW}Unknown container backend {self.container_backend}, using docker{Colors.RESET}")
+                self.container_backend = 'docker'
+            
+            if self.container_backend == 'fake':
+                self.backend = FakeBackend(latency=self.fake_latency)
+            else:
+                self.backend = DockerBackend(max_pool_size=max(10, max(self.scheduler.max_concurrency, self.scheduler.deploy_concurrency) + self.build_workers + 4))
+        return self.backend
+        
+    def get_worker_pool(self):
+        
+        # Long-lived build workers, only when BUILD_WORKERS is set
+        if self.build_workers > 0 and self.worker_pool is None:
+            from .wasm_builder.worker_pool import WorkerPool
+            volumes, environment = self.build_cache.mounts()
+            self.worker_pool = WorkerPool(
+                self.get_backend(),
+                self.build_workers,
+                max_jobs=self.build_worker_max_jobs,
+                volumes=volumes,
+                environment=environment,
+                limits=self.scheduler.limits(),
+                state_file=os.path.join(self.build_cache.cache_dir, "workers.json")
+            )
+        return self.worker_pool
+        
+    def get_build_dispatcher(self):
+        
+        # Builds spread over the BUILD_ENDPOINTS daemons, None to build on the local one
+        if self.build_endpoints and self.build_dispatcher is None:
+            from .wasm_builder.dispatcher import BuildDispatcher
+            self.build_dispatcher = BuildDispatcher.from_endpoints(self.build_endpoints, self.scheduler, self.get_backend(), self.fake_latency)
+        return self.build_dispatcher
+        
+    def get_artifacts(self):
         
-    def build(self, project_dir):
-        wasm_builder.build_project(project_dir, self.reg_user, self.reg_pass, self.detached, self.metrics, self.metrics_enabled)
+        # Built modules by source, next to the build caches unless ARTIFACT_STORE_DIR is set
+        if self.artifact_store and self.artifacts is None:
+            from .wasm_builder.artifacts import ArtifactStore
+            self.artifacts = ArtifactStore(self.artifact_store_dir or os.path.join(self.build_cache.cache_dir, "artifacts"),
+                                           registry_check=self.container_backend != 'fake')
+        return self.artifacts
         
-    def deploy(self, project_dir):
-        deployer.deploy_components(project_dir, self.nats_host, self.nats_port, self.detached, self.metrics, self.metrics_enabled)
+    def get_wadm_session(self):
+        
+        # Shared connection to wadm, only when DEPLOY_BACKEND=wadm. None means deploy containers
+        from .component_deploy.wadm_client import WadmSession, DEPLOY_BACKENDS
+        if self.deploy_backend not in DEPLOY_BACKENDS:
+            print(f"{Colors.YELLOW}Unknown deploy backend {self.deploy_backend}, using deploy containers{Colors.RESET}")
+            self.deploy_backend = 'container'
+        
+        if self.deploy_backend == 'wadm' and self.wadm_session is None:
+            try:
+                self.wadm_session = WadmSession(self.nats_host, self.nats_port, self.wadm_lattice).start()
+            except Exception as e:
+                print(f"{Colors.YELLOW}Could not connect to wadm ({e}), falling back to deploy containers{Colors.RESET}")
+                self.deploy_backend = 'container'
+        return self.wadm_session
+        
+    def build(self, project_dir, only=None):
+        from .wasm_builder import build as wasm_builder
+        with tracing.span('build', project=project_dir):
+            return wasm_builder.build_project(project_dir, self.reg_user, self.reg_pass, self.scheduler, self.metrics, self.metrics_enabled, self.incremental_build, self.build_cache, self.get_worker_pool(), self.prewarm_deps, self.batch_build, only, self.get_backend(), self.get_artifacts(), self.get_build_dispatcher())
+        
+    def deploy(self, project_dir, only=None, redeploy=None):
+        from .component_deploy import deploy as deployer
+        with tracing.span('deploy', project=project_dir):
+            return deployer.deploy_components(project_dir, self.nats_host, self.nats_port, self.scheduler, self.metrics, self.metrics_enabled, self.get_wadm_session(), self.incremental_deploy, only, self.get_backend(), redeploy)
         
     def remove(self, project_dir):
+        from .component_deploy import remove as remover
+        self.metrics_enabled = False
+        with tracing.span('remove', project=project_dir):
+            return remover.remove_components(project_dir, self.nats_host, self.nats_port, self.scheduler, self.get_wadm_session(), self.get_backend())
+
+    def cache(self, action, max_size=None):
+        
+        self.metrics_enabled = False
+        client = self.get_backend().client
+        
+        if action == 'info':
+            self.build_cache.info(client)
+            if self.get_artifacts() is not None:
+                self.artifacts.info()
+        elif action == 'prune':
+            if max_size:
+                self.build_cache.limit(client, parse_size(max_size))
+            else:
+                self.build_cache.prune(client)
+                if self.get_artifacts() is not None:
+                    self.artifacts.prune()
+
+    def save_metrics(self, project_dir, command, start_time):
+
+        # One atomic append to the run store, the history is never rewritten
+        from . import metrics_store
+        store = metrics_store.MetricsStore.for_project(project_dir)
+        try:
+            store.append(self.metrics, command, project_dir, start_time)
+        finally:
+            store.close()
+        print(f"{Colors.BLUE}📊 Metrics saved in {store.path}{Colors.RESET}")
+
+    def runs(self, action, project_dir, paths):
+
+        from . import metrics_store
+        self.metrics_enabled = False
+        store = metrics_store.MetricsStore.for_project(project_dir)
+        try:
+            if action == 'import':
+                for path in paths:
+                    imported = store.import_yaml(path)
+                    print(f"{Colors.GREEN} - Imported {imported} runs from {path}{Colors.RESET}")
+            elif action == 'export':
+                path = paths[0] if paths else f"{project_dir}/metrics.yaml"
+                store.export_yaml(path)
+                print(f"{Colors.GREEN} - Exported {store.count()} runs to {path}{Colors.RESET}")
+            metrics_store.show(store)
+        finally:
+            store.close()
+
+    def bench(self, bench_dir, sizes, repetitions, stages, backend, latency, deploy_latency=None, failure_rate=0.0, types=None, verbose=False):
+        
+        # Every repetition runs on a new Pelato, configured from the same environment
+        from . import bench
         self.metrics_enabled = False
-        remover.remove_components(project_dir, self.nats_host, self.nats_port, self.detached)
+        os.makedirs(bench_dir, exist_ok=True)
+        results = bench.run(Pelato, bench_dir, sizes, repetitions, stages, backend, latency, deploy_latency, failure_rate, types, verbose)
+        return results is not None
+
+    def serve(self, host, port):
+        
+        # Jobs reuse this Pelato: env, docker client, templates, workers and wadm stay loaded
+        from .server import PelatoServer
+        PelatoServer(self, host, port).serve_forever()
+
+    def watch(self, project_dir, interval, debounce):
+        
+        from .watcher import ProjectWatcher
+        ProjectWatcher(self, project_dir, interval, debounce).run()
+
+    def close(self):
+        
+        if self.wadm_session is not None:
+            self.wadm_session.close()
+            self.wadm_session = None
 
     def all(self, project_dir):
         
@@ -44,16 +219,33 @@ class Pelato:
         print(f"{Colors.MAGENTA}🚀 Starting PELATO full pipeline for project {project_dir}{Colors.RESET}")
         print(f'{Colors.CYAN}═══════════════════════════════════════════════════════════════{Colors.RESET}')
         
+        if self.pipeline:
+            # Build and deploy every component as soon as the previous stage is done with it
+            print(f"\n{Colors.BLUE}📋 Generating, building and deploying components as a pipeline{Colors.RESET}")
+            from . import pipeline
+            with tracing.span('pipeline', project=project_dir):
+                failed = pipeline.run_pipeline(self, project_dir)
+            if failed:
+                print(f"\n{Colors.RED}PELATO pipeline completed with {len(failed)} failed components{Colors.RESET}")
+            else:
+                print(f"\n{Colors.GREEN}🎉 PELATO pipeline completed successfully!{Colors.RESET}")
+            print(f'{Colors.CYAN}═══════════════════════════════════════════════════════════════{Colors.RESET}')
+            return not failed
+        
         print(f"\n{Colors.BLUE}📋 Step 1/3: Code Generation{Colors.RESET}")
-        self.generate(project_dir)
+        ok = self.generate(project_dir)
         time.sleep(1)
         
         print(f"\n{Colors.BLUE}🔨 Step 2/3: Building Components{Colors.RESET}")
-        self.build(project_dir)
+        ok = self.build(project_dir) and ok
         time.sleep(1)
         
         print(f"\n{Colors.BLUE}🚀 Step 3/3: Deploying Components{Colors.RESET}")
-        self.deploy(project_dir)
+        ok = self.deploy(project_dir) and ok
         
-        print(f"\n{Colors.GREEN}🎉 PELATO pipeline completed successfully!{Colors.RESET}")
-        print(f'{Colors.CYAN}═══════════════════════════════════════════════════════════════{Colors.RESET}')
\ No newline at end of file
+        if ok:
+            print(f"\n{Colors.GREEN}🎉 PELATO pipeline completed successfully!{Colors.RESET}")
+        else:
+            print(f"\n{Colors.RED}PELATO pipeline completed with failures{Colors.RESET}")
+        print(f'{Colors.CYAN}═══════════════════════════════════════════════════════════════{Colors.RESET}')
+        return ok
\ No newline at end of file
@@ -0,0 +1,217 @@
+import os
+import io
+import time
+import shutil
+import statistics
+import contextlib
+import yaml
+import src.metrics_store as metrics_store
+from .container_backend import FakeBackend
+from .component_deploy.wadm_client import WadmSession, FakeNats
+from .colors import Colors
+
+# Synthetic projects of N components, built and deployed `repetitions` times per size.
+# With the fake backend (latency 0) only the Python orchestration is measured
+
+BENCH_STAGES = ['gen', 'build', 'deploy', 'remove']
+DEFAULT_SIZES = [1, 10, 100]
+DEFAULT_STAGES = ['gen', 'build', 'deploy']
+
+# Task type -> extra fields of its tasks, one entry per template type
+TASK_TYPES = {
+    'processor_nats': {},
+    'http_producer_nats': {},
+    'nats_to_nats-kv': {'bucket': 'bench'},
+}
+
+TASK_CODE = """package main
+
+import (
+	"encoding/json"
+)
+
+type Request struct {
+    Data int
+    Name string
+}
+
+func exec_task(arg string) string{
+
+    req := Request{}
+
+	json.Unmarshal([]byte(arg), &req)
+
+	// double the data field
+	req.Data = req.Data * 2
+
+	// return the json string
+	json, _ := json.Marshal(req)
+	return string(json)
+}"""
+
+def synthetic_workflow(n, types=None):
+
+    # Tasks spread round-robin over the template types, every one with its own output topic
+    types = types or list(TASK_TYPES)
+    tasks = []
+    for i in range(n):
+        task_type = types[i % len(types)]
+        tasks.append({
+            'name': f"Bench task {i}",
+            'type': task_type,
+            'code': 'bench.go',
+            'targets': ['cloud'],
+            'source_topic': f"bench.source.{i % 10}",
+            'dest_topic': f"bench.dest.{i}",
+            'component_name': f"bench_{i:04d}",
+            'version': '1.0.0',
+            **TASK_TYPES.get(task_type, {})
+        })
+    return {'project_name': f"Bench {n}", 'tasks': tasks}
+
+def write_project(project_dir, n, types=None):
+
+    # Fresh project every repetition: no generated code, no incremental state
+    for path in ['gen', '.pelato']:
+        shutil.rmtree(os.path.join(project_dir, path), ignore_errors=True)
+    os.makedirs(os.path.join(project_dir, 'tasks'), exist_ok=True)
+
+    with open(os.path.join(project_dir, 'workflow.yaml'), 'w') as file:
+        yaml.safe_dump(synthetic_workflow(n, types), file, sort_keys=False)
+    with open(os.path.join(project_dir, 'tasks', 'bench.go'), 'w') as file:
+        file.write(TASK_CODE)
+
+def percentile(values, p):
+
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+def summarize(n, totals, stage_times, failed=0):
+
+    # Only the successful repetitions are timed, the failed ones are counted apart
+    result = {'n_task': n, 'repetitions': len(totals), 'failed': failed}
+    if not totals:
+        return {**result, 'median': None, 'p95': None, 'throughput': None, 'stages': {}}
+    median = statistics.median(totals)
+    return {
+        **result,
+        'median': '%.3f' % median,
+        'p95': '%.3f' % percentile(totals, 95),
+        'throughput': '%.1f' % (n / median * 60 if median > 0 else 0),
+        'stages': {stage: {'median': '%.3f' % statistics.median(times), 'p95': '%.3f' % percentile(times, 95)}
+                   for stage, times in stage_times.items() if times}
+    }
+
+def print_report(results):
+
+    print(f"\n{Colors.BLUE}{'N':>6} {'reps':>5} {'failed':>7} {'median (s)':>11} {'p95 (s)':>9} {'components/min':>15}{Colors.RESET}")
+    for result in results:
+        print(f"{result['n_task']:>6} {result['repetitions']:>5} {result['failed']:>7} {result['median'] or '-':>11} "
+              f"{result['p95'] or '-':>9} {result['throughput'] or '-':>15}")
+        for stage, times in result['stages'].items():
+            print(f"{Colors.CYAN}{'':>6} {'':>5} {stage:>7} {times['median']:>11} {times['p95']:>9}{Colors.RESET}")
+
+def __stage(pelato, stage, project_dir):
+
+    if stage == 'gen':
+        return pelato.generate(project_dir)
+    elif stage == 'build':
+        return pelato.build(project_dir)
+    elif stage == 'deploy':
+        return pelato.deploy(project_dir)
+    elif stage == 'remove':
+        return pelato.remove(project_dir)
+    return False
+
+def __repetition(pelato_class, project_dir, stages, backend, deploy_latency, verbose):
+
+    pelato = pelato_class()
+    pelato.metrics_enabled = True
+    pelato.metrics = {}
+
+    # The fake backend is shared by the repetitions like a Docker daemon, wadm is faked as well
+    fake = backend is not None
+    if fake:
+        pelato.backend = backend
+        pelato.container_backend = 'fake'
+        if pelato.deploy_backend == 'wadm':
+            pelato.wadm_session = WadmSession(None, None, pelato.wadm_lattice, connection=FakeNats(deploy_latency)).start()
+
+    # Modules built in earlier repetitions don't count, the store is wiped with the project
+    pelato.artifact_store_dir = os.path.join(project_dir, '.pelato', 'artifacts')
+
+    # The first stage that fails ends the repetition, the later ones would have nothing to work on
+    times = {}
+    failed_stage = None
+    output = None if verbose else io.StringIO()
+    start_time = time.time()
+    try:
+        with contextlib.redirect_stdout(output) if output is not None else contextlib.nullcontext():
+            for stage in stages:
+                stage_start = time.time()
+                ok = __stage(pelato, stage, project_dir)
+                times[stage] = time.time() - stage_start
+                if not ok:
+                    failed_stage = stage
+                    break
+    finally:
+        if pelato.worker_pool is not None and fake:
+            pelato.worker_pool.shutdown()
+        pelato.close()
+
+    pelato.metrics['time_total'] = '%.3f' % (time.time() - start_time)
+    return pelato.metrics, times, failed_stage
+
+def run(pelato_class, bench_dir, sizes=None, repetitions=5, stages=None, backend='fake', latency=0.0,
+        deploy_latency=None, failure_rate=0.0, types=None, verbose=False):
+
+    sizes = sizes or DEFAULT_SIZES
+    stages = [stage for stage in stages or DEFAULT_STAGES if stage in BENCH_STAGES] or DEFAULT_STAGES
+    if stages[0] != 'gen':
+        # Every repetition starts from a fresh project, without gen there is nothing to build or deploy
+        print(f"{Colors.RED}Benchmark stages must start with gen, got {', '.join(stages)}{Colors.RESET}")
+        return None
+    fake_backend = FakeBackend(latency=latency, deploy_latency=deploy_latency, failure_rate=failure_rate, seed=0) if backend == 'fake' else None
+
+    print(f"{Colors.BLUE}Benchmarking {', '.join(stages)} on {backend} backend, "
+          f"{repetitions} repetitions for {', '.join(str(n) for n in sizes)} components{Colors.RESET}")
+
+    store = metrics_store.MetricsStore.for_project(bench_dir)
+    results = []
+    try:
+        for n in sizes:
+            project_dir = os.path.join(bench_dir, f"bench-{n}")
+            totals = []
+            stage_times = {stage: [] for stage in stages}
+            failed = 0
+
+            for i in range(repetitions):
+                write_project(project_dir, n, types)
+                started_at = time.time()
+                run_metrics, times, failed_stage = __repetition(pelato_class, project_dir, stages, fake_backend,
+                                                                latency if deploy_latency is None else deploy_latency, verbose)
+                run_metrics.update({'n_task': n, 'bench': {'backend': backend, 'repetition': i, 'latency': latency,
+                                                           'failed_stage': failed_stage}})
+                store.append(run_metrics, 'bench', project_dir, started_at)
+
+                if failed_stage is not None:
+                    failed += 1
+                    print(f"{Colors.RED} - {n} components, repetition {i + 1}/{repetitions}: {failed_stage} failed{Colors.RESET}")
+                    continue
+                totals.append(sum(times.values()))
+                for stage, seconds in times.items():
+                    stage_times[stage].append(seconds)
+                print(f"{Colors.CYAN} - {n} components, repetition {i + 1}/{repetitions}: {totals[-1]:.3f}s{Colors.RESET}")
+
+            results.append(summarize(n, totals, stage_times, failed))
+    finally:
+        store.close()
+
+    print_report(results)
+
+    with open(os.path.join(bench_dir, 'bench.yaml'), 'w') as file:
+        yaml.safe_dump({'backend': backend, 'latency': latency, 'stages': stages, 'results': results}, file, sort_keys=False)
+    print(f"\n{Colors.GREEN}Results saved in {bench_dir}/bench.yaml, runs in {store.path}{Colors.RESET}")
+    return results
\ No newline at end of file
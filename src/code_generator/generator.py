@@ -2,14 +2,22 @@ import yaml
 import shutil
 import logging
 import os
+import json
 import src.code_generator.template_compiler as template_compiler
+import src.code_generator.template_registry as template_registry
+import src.utils as ut
+import src.topic_graph as topic_graph
+import src.project_plan as project_plan
+import src.tracing as tracing
 import time
 from ..colors import Colors
 
+GEN_MANIFEST = "gen_manifest.json"
+
 def __parse_yaml(yaml_file):
     with open(yaml_file, 'r') as stream:
         try:
-            return yaml.safe_load(stream)
+            return ut.load_yaml(stream)
         except yaml.YAMLError as exc:
             print(exc)
             return None
@@ -20,22 +28,46 @@ def __remove_dir_if_exists(dir_path):
         if os.path.isdir(dir_path):
             shutil.rmtree(dir_path)
 
-def generate(project_dir, registry_url, metrics, metrics_enabled):
+def __task_fingerprint(task, project_dir, registry_url, templates):
+    
+    # Fingerprint of everything a generated component depends on
+    template = templates.get(task.get('type'))
+    
+    code_path = f"{project_dir}/tasks/{task['code']}"
+    code_hash = ut.hash_file(code_path) if os.path.isfile(code_path) else ''
+    
+    return ut.hash_bytes(
+        json.dumps(task, sort_keys=True, default=str),
+        code_hash,
+        template.digest if template else '',
+        registry_url or ''
+    )
+
+def __remove_stale_files(component_dir, old_files, new_files):
+    
+    # Remove the files generated in a previous run that are not generated anymore
+    for rel_path in set(old_files) - set(new_files):
+        path = os.path.join(component_dir, rel_path)
+        if os.path.isfile(path):
+            os.remove(path)
+
+def generate(project_dir, registry_url, metrics, metrics_enabled, incremental=False, templates=None, materialize='copy', on_generated=None, only=None):
     
+    # Returns False if the project could not be generated or a task failed
     gen_metrics = {}
     start_time = 0
     
     # Check if the project directory is valid
     if not os.path.exists(f"{project_dir}/workflow.yaml") or not os.path.exists(f"{project_dir}/tasks"):
         logging.error(f"{Colors.RED}Project directory is not valid{Colors.RESET}")
-        return
+        return False
     
     # Parsing del file di configurazione
     config = __parse_yaml(f"{project_dir}/workflow.yaml")
     
     if config is None:
         logging.error(f"{Colors.RED}Error parsing workflow.yaml{Colors.RESET}")
-        return
+        return False
     
     print(f"{Colors.BLUE}Generating code for project {config['project_name']}{Colors.RESET}")
     
@@ -43,32 +75,106 @@ def generate(project_dir, registry_url, metrics, metrics_enabled):
         metrics['n_task'] = len(config['tasks'])
         start_time = time.time()
     
-    # Rimozione della cartella di output
     output_dir = f"{project_dir}/gen"
-    __remove_dir_if_exists(output_dir)
+    
+    # Generating only some components keeps the others as they are
+    if incremental or only is not None:
+        previous = ut.load_state(project_dir, GEN_MANIFEST, {}).get('components', {})
+    else:
+        # Rimozione della cartella di output
+        __remove_dir_if_exists(output_dir)
+        previous = {}
     
     # Creazione della cartella di output
     os.makedirs(output_dir, exist_ok=True)
     
+    if templates is None:
+        templates = template_registry.get_registry()
+    
+    if materialize not in ut.MATERIALIZE_MODES:
+        logging.error(f"{Colors.YELLOW}Unknown materialization mode {materialize}, copying files{Colors.RESET}")
+        materialize = 'copy'
+    
+    components = {}
+    n_unchanged = 0
+    failed = []
+    
     # for each task in the workflow
     for task in config['tasks']:
         
-        try:
-            task['registry_url'] = registry_url
-            template_compiler.handle_task(task, output_dir)
+        with tracing.span('generate.component', component=task.get('component_name'), template=task.get('type')) as span:
+            try:
+                fingerprint = __task_fingerprint(task, project_dir, registry_url, templates)
+                component_dir = f"{output_dir}/{task['component_name']}"
+                old = previous.get(task['component_name'], {})
+                
+                # Not asked for, still generated if it was never generated before
+                if only is not None and task['component_name'] not in only and old and os.path.isdir(component_dir):
+                    components[task['component_name']] = old
+                    continue
+                
+                # Skip the components whose inputs didn't change since the last run
+                if old.get('fingerprint') == fingerprint and os.path.isdir(component_dir):
+                    components[task['component_name']] = old
+                    n_unchanged += 1
+                    span.set_attribute('unchanged', True)
+                    print(f"{Colors.CYAN} - Task {task['component_name']} unchanged{Colors.RESET}")
+                    if on_generated:
+                        on_generated(task['component_name'])
+                    continue
+                
+                task['registry_url'] = registry_url
+                files = template_compiler.handle_task(task, output_dir, templates, materialize)
+                if files is None:
+                    failed.append(task['component_name'])
+                    continue
 
-            # Copy the code file to the output folder
-            shutil.copy2(f"{project_dir}/tasks/{task['code']}", f"{output_dir}/{task['component_name']}/{task['code']}")
-            
-            print(f"{Colors.GREEN} - Task {task['component_name']} generated{Colors.RESET}")
-            
-        except Exception as e:
-            logging.error(f"{Colors.RED}Error generating task {task['component_name']}: {e}{Colors.RESET}")
-            continue
+                # Copy the code file to the output folder
+                ut.copy_if_changed(f"{project_dir}/tasks/{task['code']}", f"{component_dir}/{task['code']}")
+                files.append(task['code'])
+                
+                __remove_stale_files(component_dir, old.get('files', []), files)
+                components[task['component_name']] = {
+                    'fingerprint': fingerprint,
+                    'files': sorted(files)
+                }
+                
+                print(f"{Colors.GREEN} - Task {task['component_name']} generated{Colors.RESET}")
+                
+                # Let the caller start working on the component right away
+                if on_generated:
+                    on_generated(task['component_name'])
+                
+            except Exception as e:
+                span.set_error(e)
+                logging.error(f"{Colors.RED}Error generating task {task['component_name']}: {e}{Colors.RESET}")
+                failed.append(task.get('component_name'))
+                continue
+    
+    # Remove the components that are not in the workflow anymore
+    task_names = {t.get('component_name') for t in config['tasks']}
+    for name in os.listdir(output_dir):
+        if name not in task_names:
+            __remove_dir_if_exists(f"{output_dir}/{name}")
+            print(f"{Colors.YELLOW} - Removed orphaned component {name}{Colors.RESET}")
+    
+    ut.dump_state(project_dir, GEN_MANIFEST, {'components': components})
+    
+    # Manifests, images and topics of the components, read by the next stages
+    with tracing.span('generate.plan'):
+        project_plan.write_plan(project_dir, config['tasks'], components)
+    
+    # Store the topic wiring, deploy and remove follow its order
+    ut.dump_state(project_dir, topic_graph.TOPIC_GRAPH, topic_graph.build_graph(config['tasks']))
         
     if metrics_enabled:
         end_time = time.time()
         gen_metrics['gen_time'] = '%.3f'%(end_time - start_time)
+        gen_metrics['unchanged_components'] = n_unchanged
         metrics['code_gen'] = gen_metrics
         
-    print(f"{Colors.GREEN}Code generation completed{Colors.RESET}")
\ No newline at end of file
+    if failed:
+        print(f"{Colors.RED}{len(failed)} tasks failed to generate{Colors.RESET}")
+        return False
+    print(f"{Colors.GREEN}Code generation completed{Colors.RESET}")
+    return True
\ No newline at end of file
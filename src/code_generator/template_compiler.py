@@ -1,109 +1,53 @@
 import logging
-from jinja2 import FileSystemLoader, Environment
 import os
-import shutil
+import src.utils as ut
+import src.tracing as tracing
 
-def handle_task(task, output_dir):
-    
+def handle_task(task, output_dir, registry, materialize='copy'):
+
+    # Returns the list of files (relative to the component dir) written for the task
     try:
-    
-        match task['type']:
-            case 'http_producer_nats':
-                __generate_producer(task, output_dir)
-            case 'processor_nats':
-                __generate_processor(task, output_dir)
-            case 'dbsync_nats':
-                __generate_dbsync(task, output_dir)
-            case 'nats_to_nats-kv':
-                __generate_nats_kv_sync(task, output_dir)
-            case _:
-                logging.error(f"Task type {task['type']} not supported")
-                pass
+
+        template = registry.get(task['type'])
+        if template is None:
+            logging.error(f"Task type {task['type']} not supported")
+            return None
+
+        return __generate_component(template, task, f"{output_dir}/{task['component_name']}", materialize)
+
     except KeyError as e:
         logging.error(f"Error parsing task: {e}")
-        pass
-    
-def __generate_producer(task, output_dir):
-    
-    # Copy the template folder to the output folder
-    __copytree("src/code_generator/templates/producer_nats", f"{output_dir}/{task['component_name']}")
-    
-    # Replace each file of the output dir with the template
-    for filename in os.listdir(f"{output_dir}/{task['component_name']}"):
-        
-        # Skip the following files
-        if filename in ['Dockerfile', 'go.mod', 'go.sum', 'tools.go']:
-            continue
-        
-        # Skip if it's a directory
-        if os.path.isdir(f"{output_dir}/{task['component_name']}/{filename}"):
-            continue
-        
-        __replace_file_with_template(filename, f"{output_dir}/{task['component_name']}", task)
-    
+        return None
 
-def __generate_processor(task, output_dir):
-    # Copy the template folder to the output folder
-        __copytree("src/code_generator/templates/processor_nats", f"{output_dir}/{task['component_name']}")
-        
-        # Replace each file of the output dir with the template
-        for filename in os.listdir(f"{output_dir}/{task['component_name']}"):
-            
-            # Skip the following files
-            if filename in ['Dockerfile', 'go.mod', 'go.sum', 'tools.go', 'bindings.wadge.go']:
-                continue
-            
-            # Skip if it's a directory
-            if os.path.isdir(f"{output_dir}/{task['component_name']}/{filename}"):
-                continue
-            
-            __replace_file_with_template(filename, f"{output_dir}/{task['component_name']}", task)
+def __generate_component(template, task, component_dir, materialize):
 
-def __generate_nats_kv_sync(task, output_dir):
-    
-    __copytree("src/code_generator/templates/nats_to_nats-kv", f"{output_dir}/{task['component_name']}")
+    # Copy (or link) the files that are not templated, leaving untouched the ones already up to date
+    with tracing.span('copy', component=task['component_name'], template=template.name, files=len(template.static_files)):
+        for rel_path in template.static_files:
+            mode = 'copy' if rel_path in template.copied else materialize
+            ut.materialize_file(os.path.join(template.path, rel_path), os.path.join(component_dir, rel_path), mode)
 
-    # Replace each file of the output dir with the template
-    for filename in os.listdir(f"{output_dir}/{task['component_name']}"):
+    # Render the templated files straight from the compiled templates, writing none of
+    # them if one fails: the component is left out of the gen manifest and generated again
+    with tracing.span('render', component=task['component_name'], template=template.name, files=len(template.templated)):
+        rendered = __render_templates(template, task)
+        if rendered is None:
+            return None
+        for filename, content in rendered.items():
+            ut.write_if_changed(os.path.join(component_dir, filename), content)
 
-        # Skip the following files
-        if filename in ['Dockerfile', 'go.sum', 'tools.go']:
-            continue
+    return template.static_files + list(template.templated)
 
-        # Skip if it's a directory
-        if os.path.isdir(f"{output_dir}/{task['component_name']}/{filename}"):
-            continue
+def __render_templates(template, template_vars):
 
-        __replace_file_with_template(filename, f"{output_dir}/{task['component_name']}", task)
+    # None if a template can't be rendered
+    rendered = {}
 
+    for filename, compiled in template.templated.items():
+        try:
+            rendered[filename] = compiled.render(template_vars)
+        except Exception as e:
+            logging.error(f"Error rendering template {filename}: {e}")
+            return None
 
-def __copytree(src, dst, symlinks=False, ignore=None):
-    
-    # Create the destination directory
-    os.makedirs(dst, exist_ok=True)
-    
-    # Copy the files
-    for item in os.listdir(src):
-        s = os.path.join(src, item)
-        d = os.path.join(dst, item)
-        if os.path.isdir(s):
-            shutil.copytree(s, d, symlinks, ignore)
-        else:
-            shutil.copy2(s, d)
-            
-def __replace_file_with_template(filename, output_dir, template_vars):
-    
-    try: 
-        templateLoader = FileSystemLoader(searchpath=output_dir)
-        templateEnv = Environment(loader=templateLoader)
-        template = templateEnv.get_template(filename)
-        
-        outputText = template.render(template_vars)
-        
-        # Replace the file with the rendered template
-        with open(f"{output_dir}/{filename}", 'w') as f:
-            f.write(outputText)
-        
-    except Exception as e:
-        logging.error(f"Error rendering template {filename}: {e}")
-        return
\ No newline at end of file
+    return rendered
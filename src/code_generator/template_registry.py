@@ -0,0 +1,76 @@
+import os
+from jinja2 import FileSystemLoader, FileSystemBytecodeCache, Environment
+import src.utils as ut
+
+TEMPLATES_DIR = "src/code_generator/templates"
+TEMPLATE_MANIFEST = "template.yaml"
+
+class Template:
+
+    def __init__(self, name, path, manifest, env):
+
+        self.name = name
+        self.path = path
+        self.types = manifest.get('types', [name])
+        self.digest = ut.hash_directory(path)
+
+        # Compile the templated files once
+        self.templated = {
+            filename: env.get_template(f"{name}/{filename}")
+            for filename in manifest.get('templated', [])
+        }
+
+        # Files rewritten by the build (e.g. go mod tidy), never shared with the template
+        self.copied = set(manifest.get('copy', []))
+
+        # Every other file is copied as it is
+        self.static_files = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                rel_path = os.path.relpath(os.path.join(root, filename), path)
+                if rel_path not in self.templated and rel_path != TEMPLATE_MANIFEST:
+                    self.static_files.append(rel_path)
+
+
+class TemplateRegistry:
+
+    def __init__(self, templates_dir=TEMPLATES_DIR, cache_dir=None):
+
+        bytecode_cache = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+        self.env = Environment(loader=FileSystemLoader(templates_dir), bytecode_cache=bytecode_cache)
+        self.templates = {}
+        self.task_types = {}
+
+        # Load each template directory once
+        for name in sorted(os.listdir(templates_dir)):
+            path = os.path.join(templates_dir, name)
+            manifest_file = os.path.join(path, TEMPLATE_MANIFEST)
+            if not os.path.isfile(manifest_file):
+                continue
+
+            with open(manifest_file, 'r') as file:
+                manifest = ut.load_yaml(file) or {}
+
+            template = Template(name, path, manifest, self.env)
+            self.templates[name] = template
+            for task_type in template.types:
+                self.task_types[task_type] = template
+
+    def get(self, task_type):
+        return self.task_types.get(task_type)
+
+
+__registries = {}
+
+def get_registry(cache_dir=None, templates_dir=TEMPLATES_DIR):
+
+    # Registries are shared for the whole process
+    key = (templates_dir, cache_dir)
+    if key not in __registries:
+        __registries[key] = TemplateRegistry(templates_dir, cache_dir)
+    return __registries[key]
@@ -1,117 +1,158 @@
-import docker
 import os
 import logging
-import yaml
 import time
+import src.utils as ut
+import src.topic_graph as topic_graph
+import src.tracing as tracing
+from . import manifests as mf
+from . import remove as remover
+from ..container_backend import DockerBackend
 from ..colors import Colors
 
-def deploy_components(project_dir, nats_host, nats_port, detached, metrics, metrics_enabled):
+def deploy_components(project_dir, nats_host, nats_port, scheduler, metrics, metrics_enabled, session=None, incremental=True, only=None, backend=None, redeploy=None):
 
+    # Returns False if the project could not be deployed or an application failed.
+    # The applications of the tasks in redeploy are removed and deployed again
     deploy_metrics = {}
     
     # Check if the project directory is valid
     if not os.path.exists(f"{project_dir}/gen"):
         logging.error(f"{Colors.RED}Project directory is not valid{Colors.RESET}")
-        return
+        return False
     
     print(f'{Colors.BLUE}Deploying WASM components{Colors.RESET}')
     
-    # Docker client
-    client = docker.from_env()
-    
     if metrics_enabled:
         start_time = time.time()
     
-    # Build the images for the project if they don't exist
+    backend = backend or DockerBackend()
+    
+    undeployed = set()
     try:
-        client.images.get("wash-deploy-image:latest")
-    except:
+        # Compare the generated manifests with the ones applied by the previous runs
+        state = ut.load_state(project_dir, mf.DEPLOY_STATE, {})
+        plan = mf.plan_deploy(project_dir, state, incremental, only)
         
-        print(f'{Colors.YELLOW} - Building wash-deploy-image from Dockerfile...{Colors.RESET}')
-        client.images.build(
-            path="src/component_deploy/docker",
-            dockerfile="deploy.Dockerfile",
-            tag="wash-deploy-image:latest"
-        )
-        if metrics_enabled:
-            deploy_metrics['image_build_time'] = '%.3f'%(time.time() - start_time)
+        # Rebuilt modules are pushed under the same image tag: with the same manifest applied
+        # again the old module would keep running, so their applications are removed first
+        restarted = [e for e in plan if e['task'] in (redeploy or ()) and e['action'] in ('update', 'unchanged') and e['name'] in state]
+        for entry in restarted:
+            entry['action'] = 'update'
+        mf.print_plan(plan)
         
-    try:
-        wait_list = []
+        if restarted:
+            print(f"{Colors.YELLOW} - Removing {len(restarted)} rebuilt applications before deploying them again{Colors.RESET}")
+            undeployed = remover.remove_entries(project_dir, [{**e, 'manifest': state[e['name']]['manifest']} for e in restarted], nats_host, nats_port, scheduler, session, backend)
         
-        for task in os.listdir(f"{project_dir}/gen"):
-            __deploy_wadm(f"{project_dir}/gen/{task}", client, nats_host, nats_port, detached, wait_list)
-            
-        if detached == 'True':
-            
-            print(f'{Colors.BLUE}Waiting for deployment...{Colors.RESET}')
-            for container_name in wait_list:
-                try:
-                    container = client.containers.get(container_name)
-                    result = container.wait()
-                    exit_code = result['StatusCode']
-                    
-                    if exit_code == 0:
-                        print(f"{Colors.GREEN} - Deployment successful for {container_name}, removing container{Colors.RESET}")
-                        container.remove()
-                    else:
-                        print(f"{Colors.RED} - Deployment failed for {container_name} (exit code: {exit_code}), keeping container for debugging{Colors.RESET}")
-                        
-                except Exception as e:
-                    print(f"{Colors.YELLOW} - Error waiting for container {container_name}: {e}{Colors.RESET}")
-                    continue
+        # An application that could not be removed would not pick up the new module
+        stuck = {e['name'] for e in restarted} - undeployed
+        deployed = deploy_entries(project_dir, [e for e in plan if e['action'] in ('add', 'update') and e['name'] not in stuck], nats_host, nats_port, scheduler, session, deploy_metrics, backend)
+        removed = remover.remove_entries(project_dir, [e for e in plan if e['action'] == 'delete'], nats_host, nats_port, scheduler, session, backend)
         
     except Exception as e:
         logging.error(f"{Colors.RED}Error deploying project: {e}{Colors.RESET}")
-        return
+        return False
+    
+    failed = []
+    for entry in plan:
+        if entry['name'] in deployed:
+            mf.record_deploy(state, entry)
+        elif entry['name'] in removed:
+            mf.forget_deploy(project_dir, state, entry['name'])
+        elif entry['action'] in ('add', 'update', 'delete'):
+            failed.append(entry['name'])
+            if entry['name'] in undeployed:
+                mf.forget_deploy(project_dir, state, entry['name'])
+    ut.dump_state(project_dir, mf.DEPLOY_STATE, state)
     
     if metrics_enabled:
+        deploy_metrics['backend'] = 'wadm' if session is not None else 'container'
         deploy_metrics['components_deploy_time'] = '%.3f'%(time.time() - start_time)
+        deploy_metrics['plan'] = mf.plan_summary(plan)
         metrics['deploy'] = deploy_metrics
-        
+    
+    if failed:
+        print(f"{Colors.RED}{len(failed)} applications failed to deploy{Colors.RESET}")
+        return False
     print(f"{Colors.GREEN}Project deployed successfully{Colors.RESET}")
+    return True
     
-def __deploy_wadm(task_dir, client, nats_host, nats_port, detached, wait_list):
+def deploy_entries(project_dir, entries, nats_host, nats_port, scheduler, session=None, deploy_metrics=None, backend=None):
     
-    wadm = __parse_yaml(f"{task_dir}/wadm.yaml")
+    # Apply the manifests of the planned entries level by level, consumers first.
+    # Returns the names of the deployed applications
+    graph = ut.load_state(project_dir, topic_graph.TOPIC_GRAPH)
+    groups = topic_graph.group_entries(entries, topic_graph.deploy_order(graph) if graph else [])
     
-    path = os.path.abspath(task_dir)
+    if deploy_metrics is not None and len(groups) > 1:
+        deploy_metrics['levels'] = [[entry['name'] for entry in group] for group in groups]
     
-    name = wadm['spec']['components'][0]['name'] + '-deploy'
+    backend = backend or DockerBackend()
+    deployed = set()
+    for i, group in enumerate(groups):
+        if len(groups) > 1:
+            print(f"{Colors.BLUE} - Deploying level {i + 1}/{len(groups)}: {len(group)} components{Colors.RESET}")
+        level = __deploy_level(project_dir, group, nats_host, nats_port, scheduler, session, deploy_metrics, backend)
+        deployed |= level
+        
+        # The next levels publish to the ones that failed, with fail-fast they are not deployed
+        if scheduler.fail_fast and len(level) < len(group) and i + 1 < len(groups):
+            print(f"{Colors.RED} - Level {i + 1} failed, skipping the remaining {len(groups) - i - 1} levels{Colors.RESET}")
+            break
+    return deployed
     
-    # Check if container with the same name already exists and remove it
-    try:
-        existing_container = client.containers.get(name)
-        print(f"{Colors.YELLOW} - Removing existing container {name}{Colors.RESET}")
-        existing_container.remove(force=True)
-    except docker.errors.NotFound:
-        # Container doesn't exist, continue
-        pass
-    except Exception as e:
-        print(f"{Colors.RED} - Warning: Could not remove existing container {name}: {e}{Colors.RESET}")
-    
-    # Build the wasm module
-    print(f"{Colors.BLUE} - Deploying WASM module {name}{Colors.RESET}")
-    container = client.containers.run(
-        "wash-deploy-image:latest",
-        environment=[f'WASMCLOUD_CTL_HOST={nats_host}',
-                     f'WASMCLOUD_CTL_PORT={nats_port}'],
-        volumes={path: {'bind': '/app', 'mode': 'rw'}},
-        remove=False,
-        detach=True,
-        name=name
-    )
-    
-    if detached == 'False':
-        container.wait()
-    else:
-        wait_list.append(name)
+def __deploy_level(project_dir, entries, nats_host, nats_port, scheduler, session, deploy_metrics, backend):
+    
+    # Submit the manifests straight to wadm over the shared NATS connection
+    if session is not None:
+        results = session.apply_all([entry['manifest'] for entry in entries])
+        mf.report(results, 'Deployment')
+        
+        if deploy_metrics is not None:
+            applications = deploy_metrics.setdefault('applications', {})
+            applications.update({name: {'status': r['status'], 'time': r['time']} for name, r in results.items()})
+        return {name for name, r in results.items() if r['status'] == 'deployed'}
     
+    prepare_deploy_image(backend, deploy_metrics if deploy_metrics is not None else {})
+    
+    jobs = {}
+    for entry in entries:
+        job = deploy_job(f"{project_dir}/gen/{entry['task']}", nats_host, nats_port)
+        jobs[job['name']] = (job, entry['name'])
+    
+    exit_codes = scheduler.run(backend.client, [job for job, _ in jobs.values()], 'Deployment', scheduler.deploy_concurrency)
+    return {name for job_name, (_, name) in jobs.items() if exit_codes.get(job_name) == 0}
+    
+def prepare_deploy_image(backend, deploy_metrics):
+    
+    start_time = time.time()
+    
+    # Build the images for the project if they don't exist
+    if backend.image("wash-deploy-image:latest") is None:
+        
+        print(f'{Colors.YELLOW} - Building wash-deploy-image from Dockerfile...{Colors.RESET}')
+        with tracing.span('image.build', image="wash-deploy-image:latest"):
+            backend.build_image(
+                "wash-deploy-image:latest",
+                path="src/component_deploy/docker",
+                dockerfile="deploy.Dockerfile"
+            )
+        deploy_metrics['image_build_time'] = '%.3f'%(time.time() - start_time)
 
-def __parse_yaml(yaml_file):
-    with open(yaml_file, 'r') as stream:
-        try:
-            return yaml.safe_load(stream)
-        except yaml.YAMLError as exc:
-            print(exc)
-            return None
\ No newline at end of file
+def deploy_job(task_dir, nats_host, nats_port):
+    
+    wadm = mf.load_manifest(task_dir)
+    
+    path = os.path.abspath(task_dir)
+    
+    name = wadm['spec']['components'][0]['name'] + '-deploy'
+    
+    return {
+        'name': name,
+        'image': "wash-deploy-image:latest",
+        'environment': [f'WASMCLOUD_CTL_HOST={nats_host}',
+                        f'WASMCLOUD_CTL_PORT={nats_port}'],
+        'volumes': {path: {'bind': '/app', 'mode': 'rw'}},
+        'component': wadm['metadata']['name'],
+        'message': f"Deploying WASM module {name}"
+    }
\ No newline at end of file
@@ -0,0 +1,107 @@
+import os
+import json
+import shutil
+import yaml
+import src.utils as ut
+import src.project_plan as project_plan
+from ..scheduler import log
+from ..colors import Colors
+
+# Last applied manifest of every application, {name: {digest, task, manifest}}
+DEPLOY_STATE = "deployed.json"
+PLAN_ACTIONS = ['add', 'update', 'unchanged', 'delete']
+
+def load_manifest(task_dir):
+    
+    # Compiled by gen while wadm.yaml is unchanged, parsed otherwise
+    manifest = project_plan.manifest(task_dir)
+    if manifest is not None:
+        return manifest
+    with open(f"{task_dir}/wadm.yaml", 'r') as stream:
+        try:
+            return ut.load_yaml(stream)
+        except yaml.YAMLError as exc:
+            print(exc)
+            return None
+
+def normalize_manifest(manifest):
+
+    # Same application, same string: key order and formatting of the yaml do not matter
+    return json.dumps(manifest, sort_keys=True, separators=(',', ':'))
+
+def manifest_digest(manifest):
+    return ut.hash_bytes(normalize_manifest(manifest))
+
+def plan_entry(task_dir, state, incremental=True):
+
+    # Compare the generated manifest of a component with the last applied one
+    manifest = load_manifest(task_dir)
+    name = manifest['metadata']['name']
+    digest = manifest_digest(manifest)
+    previous = state.get(name)
+
+    if previous is None:
+        action = 'add'
+    elif previous['digest'] != digest or not incremental:
+        action = 'update'
+    else:
+        action = 'unchanged'
+
+    return {'name': name, 'action': action, 'task': os.path.basename(task_dir), 'manifest': manifest, 'digest': digest}
+
+def deleted_entries(state, names):
+
+    # Applications deployed by a previous run whose component is not generated anymore
+    return [{'name': name, 'action': 'delete', 'task': state[name].get('task'),
+             'manifest': state[name]['manifest'], 'digest': state[name]['digest']}
+            for name in sorted(set(state) - set(names))]
+
+def plan_deploy(project_dir, state, incremental=True, only=None):
+
+    tasks = sorted(os.listdir(f"{project_dir}/gen"))
+    plan = [plan_entry(f"{project_dir}/gen/{task}", state, incremental) for task in tasks if only is None or task in only]
+
+    # The applications of the components left out stay as they are
+    kept = [name for name, entry in state.items() if entry.get('task') in tasks and (only is None or entry.get('task') not in only)]
+    return plan + deleted_entries(state, [entry['name'] for entry in plan] + kept)
+
+def plan_summary(plan):
+    return {action: [entry['name'] for entry in plan if entry['action'] == action] for action in PLAN_ACTIONS}
+
+def print_plan(plan):
+
+    summary = plan_summary(plan)
+    log(f"{Colors.BLUE}Deploy plan: {len(summary['add'])} to add, {len(summary['update'])} to update, "
+        f"{len(summary['unchanged'])} unchanged, {len(summary['delete'])} to delete{Colors.RESET}")
+
+    for action, color, symbol in [('add', Colors.GREEN, '+'), ('update', Colors.YELLOW, '~'), ('delete', Colors.RED, '-')]:
+        for name in summary[action]:
+            log(f"   {color}{symbol} {name}{Colors.RESET}")
+
+def record_deploy(state, entry):
+    state[entry['name']] = {'digest': entry['digest'], 'task': entry['task'], 'manifest': entry['manifest']}
+
+def forget_deploy(project_dir, state, name):
+    state.pop(name, None)
+    shutil.rmtree(ut.state_path(project_dir, os.path.join("removed", name)), ignore_errors=True)
+
+def removed_dir(project_dir, entry):
+
+    # The gen/ folder of a deleted component is gone, write its last applied manifest
+    # where the remove container can mount it
+    path = ut.state_path(project_dir, os.path.join("removed", entry['name']))
+    os.makedirs(path, exist_ok=True)
+    ut.write_if_changed(f"{path}/wadm.yaml", yaml.safe_dump(entry['manifest'], sort_keys=False))
+    return path
+
+def report(results, action):
+
+    # Print the outcome of every application, returns the number of failures
+    failed = 0
+    for name, result in sorted(results.items()):
+        if result['status'] == 'failed':
+            failed += 1
+            log(f"{Colors.RED} - {action} failed for {name}: {result['message']}{Colors.RESET}")
+        else:
+            log(f"{Colors.GREEN} - {action} successful for {name} ({result['time']}s){Colors.RESET}")
+    return failed
\ No newline at end of file
@@ -1,106 +1,111 @@
-import docker
 import os
 import logging
-import yaml
+import src.utils as ut
+import src.topic_graph as topic_graph
+import src.tracing as tracing
+from . import manifests as mf
+from ..container_backend import DockerBackend
 from ..colors import Colors
 
-def remove_components(project_dir, nats_host, nats_port, detached):
+def remove_components(project_dir, nats_host, nats_port, scheduler, session=None, backend=None):
 
+    # Returns False if an application could not be removed
+    
     # Check if the project directory is valid
     if not os.path.exists(f"{project_dir}/gen"):
         logging.error(f"{Colors.RED}Project directory is not valid{Colors.RESET}")
-        return
+        return False
     
     print(f'{Colors.BLUE}Removing WASM components{Colors.RESET}')
     
-    # Docker client
-    client = docker.from_env()
-    
-    # Build the images for the project if they don't exist
-    try:
-        client.images.get("wash-remove-image:latest")
-    except docker.errors.ImageNotFound:
-        
-        print(f'{Colors.YELLOW} - Building wash-remove-image from Dockerfile...{Colors.RESET}')
-        client.images.build(
-            path="src/component_deploy/docker",
-            dockerfile="remove.Dockerfile",
-            tag="wash-remove-image:latest"
-        )
-        
     try:
-        wait_list = []
+        # Every generated application, plus the ones deployed by previous runs and not generated anymore
+        state = ut.load_state(project_dir, mf.DEPLOY_STATE, {})
+        entries = [mf.plan_entry(f"{project_dir}/gen/{task}", state) for task in sorted(os.listdir(f"{project_dir}/gen"))]
+        entries += mf.deleted_entries(state, [entry['name'] for entry in entries])
         
-        for task in os.listdir(f"{project_dir}/gen"):
-            __remove_wadm(f"{project_dir}/gen/{task}", client, nats_host, nats_port, detached, wait_list)
-            
-        if detached == 'True':
-            
-            print(f'{Colors.BLUE}Waiting for component remove...{Colors.RESET}')
-            for container_name in wait_list:
-                try:
-                    container = client.containers.get(container_name)
-                    result = container.wait()
-                    exit_code = result['StatusCode']
-                    
-                    if exit_code == 0:
-                        print(f"{Colors.GREEN} - Remove successful for {container_name}, removing container{Colors.RESET}")
-                        container.remove()
-                    else:
-                        print(f"{Colors.RED} - Remove failed for {container_name} (exit code: {exit_code}), keeping container for debugging{Colors.RESET}")
-                        
-                except Exception as e:
-                    print(f"{Colors.YELLOW} - Error waiting for container {container_name}: {e}{Colors.RESET}")
-                    continue
+        removed = remove_entries(project_dir, entries, nats_host, nats_port, scheduler, session, backend)
         
     except Exception as e:
         logging.error(f"{Colors.RED}Error removing components: {e}{Colors.RESET}")
-        return
+        return False
+    
+    for name in removed:
+        mf.forget_deploy(project_dir, state, name)
+    ut.dump_state(project_dir, mf.DEPLOY_STATE, state)
     
+    failed = {entry['name'] for entry in entries} - removed
+    if failed:
+        print(f"{Colors.RED}{len(failed)} applications could not be removed{Colors.RESET}")
+        return False
     print(f"{Colors.GREEN}Components removed successfully{Colors.RESET}")
+    return True
+    
+def remove_entries(project_dir, entries, nats_host, nats_port, scheduler, session=None, backend=None):
+    
+    # Delete the applications of the entries level by level, producers first.
+    # Returns the names of the removed ones
+    graph = ut.load_state(project_dir, topic_graph.TOPIC_GRAPH)
+    groups = topic_graph.group_entries(entries, topic_graph.remove_order(graph) if graph else [])
+    
+    backend = backend or DockerBackend()
+    removed = set()
+    for i, group in enumerate(groups):
+        if len(groups) > 1:
+            print(f"{Colors.BLUE} - Removing level {i + 1}/{len(groups)}: {len(group)} components{Colors.RESET}")
+        removed |= __remove_level(project_dir, group, nats_host, nats_port, scheduler, session, backend)
+    return removed
+    
+def __remove_level(project_dir, entries, nats_host, nats_port, scheduler, session, backend):
     
+    # Delete the applications straight from wadm over the shared NATS connection
+    if session is not None:
+        results = session.remove_all([entry['manifest'] for entry in entries])
+        mf.report(results, 'Remove')
+        return {name for name, r in results.items() if r['status'] == 'removed'}
     
-def __remove_wadm(task_dir, client, nats_host, nats_port, detached, wait_list):
+    prepare_remove_image(backend)
     
-    wadm = __parse_yaml(f"{task_dir}/wadm.yaml")
+    jobs = {}
+    for entry in entries:
+        # Components left workflow.yaml have no gen/ folder anymore, use their last applied manifest
+        if entry['action'] == 'delete':
+            task_dir = mf.removed_dir(project_dir, entry)
+        else:
+            task_dir = f"{project_dir}/gen/{entry['task']}"
+        job = remove_job(task_dir, nats_host, nats_port)
+        jobs[job['name']] = (job, entry['name'])
+    
+    exit_codes = scheduler.run(backend.client, [job for job, _ in jobs.values()], 'Remove', scheduler.deploy_concurrency)
+    return {name for job_name, (_, name) in jobs.items() if exit_codes.get(job_name) == 0}
+    
+def prepare_remove_image(backend):
+    
+    # Build the images for the project if they don't exist
+    if backend.image("wash-remove-image:latest") is None:
+        
+        print(f'{Colors.YELLOW} - Building wash-remove-image from Dockerfile...{Colors.RESET}')
+        with tracing.span('image.build', image="wash-remove-image:latest"):
+            backend.build_image(
+                "wash-remove-image:latest",
+                path="src/component_deploy/docker",
+                dockerfile="remove.Dockerfile"
+            )
+    
+def remove_job(task_dir, nats_host, nats_port):
+    
+    wadm = mf.load_manifest(task_dir)
     
     path = os.path.abspath(task_dir)
     
     name = wadm['spec']['components'][0]['name'] + '-remove'
     
-    # Check if container with the same name already exists and remove it
-    try:
-        existing_container = client.containers.get(name)
-        print(f"{Colors.YELLOW} - Removing existing container {name}{Colors.RESET}")
-        existing_container.remove(force=True)
-    except docker.errors.NotFound:
-        # Container doesn't exist, continue
-        pass
-    except Exception as e:
-        print(f"{Colors.RED} - Warning: Could not remove existing container {name}: {e}{Colors.RESET}")
-    
-    # Build the wasm module
-    print(f"{Colors.BLUE} - Removing WASM module {name} from WasmCloud{Colors.RESET}")
-    container = client.containers.run(
-        "wash-remove-image:latest",
-        environment=[f'WASMCLOUD_CTL_HOST={nats_host}',
-                     f'WASMCLOUD_CTL_PORT={nats_port}'],
-        volumes={path: {'bind': '/app', 'mode': 'rw'}},
-        remove=False,
-        detach=True,
-        name=name
-    )
-    
-    if detached == 'False':
-        container.wait()
-    else:
-        wait_list.append(name)
-    
-
-def __parse_yaml(yaml_file):
-    with open(yaml_file, 'r') as stream:
-        try:
-            return yaml.safe_load(stream)
-        except yaml.YAMLError as exc:
-            print(exc)
-            return None
\ No newline at end of file
+    return {
+        'name': name,
+        'image': "wash-remove-image:latest",
+        'environment': [f'WASMCLOUD_CTL_HOST={nats_host}',
+                        f'WASMCLOUD_CTL_PORT={nats_port}'],
+        'volumes': {path: {'bind': '/app', 'mode': 'rw'}},
+        'component': wadm['metadata']['name'],
+        'message': f"Removing WASM module {name} from WasmCloud"
+    }
\ No newline at end of file
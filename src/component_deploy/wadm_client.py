@@ -0,0 +1,252 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import src.tracing as tracing
+
+# Talks to wadm directly through its NATS API, instead of running `wash app` in a container.
+# nats-py is only needed when this backend is used: pip install nats-py
+
+DEPLOY_BACKENDS = ['container', 'wadm']
+DEFAULT_LATTICE = "default"
+
+async def connect(nats_host, nats_port):
+
+    try:
+        import nats
+    except ImportError:
+        raise RuntimeError("DEPLOY_BACKEND=wadm requires nats-py (pip install nats-py)")
+
+    return await nats.connect(f"nats://{nats_host or 'localhost'}:{nats_port or 4222}", connect_timeout=5, max_reconnect_attempts=1)
+
+def manifest_name(manifest):
+    return manifest['metadata']['name']
+
+
+class WadmClient:
+
+    # Async client for the wadm API: wadm.api.<lattice>.model.<operation>[.<name>]
+
+    def __init__(self, connection, lattice=DEFAULT_LATTICE, timeout=10):
+
+        self.connection = connection
+        self.lattice = lattice
+        self.timeout = timeout
+
+    async def __request(self, operation, name=None, payload=None):
+
+        subject = f"wadm.api.{self.lattice}.model.{operation}"
+        if name is not None:
+            subject += f".{name}"
+
+        message = await self.connection.request(subject, json.dumps(payload or {}).encode(), timeout=self.timeout)
+        return json.loads(message.data or b'{}')
+
+    async def put(self, manifest):
+        return await self.__request('put', payload=manifest)
+
+    async def deploy(self, name, version=None):
+        return await self.__request('deploy', name, {'version': version} if version else {})
+
+    async def undeploy(self, name):
+        return await self.__request('undeploy', name)
+
+    async def delete(self, name):
+        return await self.__request('del', name)
+
+    async def apply(self, manifest):
+
+        # Store the manifest as a new version and deploy it, like `wash app deploy`
+        name = manifest_name(manifest)
+        start_time = time.time()
+
+        try:
+            response = await self.put(manifest)
+            if response.get('result') == 'error':
+                return self.__result(name, 'apply', 'failed', response, start_time)
+
+            response = await self.deploy(name, response.get('current_version'))
+            status = 'deployed' if response.get('result') == 'acknowledged' else 'failed'
+            return self.__result(name, 'apply', status, response, start_time)
+
+        except Exception as e:
+            return self.__result(name, 'apply', 'failed', {'message': str(e) or type(e).__name__}, start_time)
+
+    async def remove(self, manifest):
+
+        # Undeploy and delete every version of the application, like `wash app delete`
+        name = manifest_name(manifest)
+        start_time = time.time()
+
+        try:
+            response = await self.delete(name)
+            status = 'failed' if response.get('result') == 'error' else 'removed'
+            return self.__result(name, 'remove', status, response, start_time)
+
+        except Exception as e:
+            return self.__result(name, 'remove', 'failed', {'message': str(e) or type(e).__name__}, start_time)
+
+    def __result(self, name, operation, status, response, start_time):
+
+        # Spans of the event loop thread have no open parent, they hang from the run span
+        span = tracing.get_tracer().start_span(f"wadm.{operation}", start_time=start_time,
+                                               component=name, status=status, lattice=self.lattice)
+        if status == 'failed':
+            span.set_error(response.get('message', ''))
+        span.end()
+
+        return {
+            'name': name,
+            'status': status,
+            'message': response.get('message', ''),
+            'time': '%.3f' % (time.time() - start_time)
+        }
+
+
+class WadmSession:
+
+    # One NATS connection on a background event loop, shared by every caller and thread.
+    # connection can be given to use an already open connection (e.g. FakeNats)
+
+    def __init__(self, nats_host, nats_port, lattice=DEFAULT_LATTICE, timeout=10, connection=None):
+
+        self.nats_host = nats_host
+        self.nats_port = nats_port
+        self.lattice = lattice or DEFAULT_LATTICE
+        self.timeout = timeout
+        self.connection = connection
+        self.client = None
+        self.loop = None
+        self.thread = None
+
+    def __call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def start(self):
+
+        if self.loop is not None:
+            return self
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="pelato-wadm", daemon=True)
+        self.thread.start()
+
+        try:
+            if self.connection is None:
+                self.connection = self.__call(connect(self.nats_host, self.nats_port))
+        except BaseException:
+            self.close()
+            raise
+
+        self.client = WadmClient(self.connection, self.lattice, self.timeout)
+        return self
+
+    def apply(self, manifest):
+        return self.__call(self.client.apply(manifest))
+
+    def remove(self, manifest):
+        return self.__call(self.client.remove(manifest))
+
+    def apply_all(self, manifests):
+
+        # Submit every manifest at once over the shared connection, returns {name: result}
+        async def apply_all():
+            return await asyncio.gather(*[self.client.apply(manifest) for manifest in manifests])
+
+        return {result['name']: result for result in self.__call(apply_all())}
+
+    def remove_all(self, manifests):
+
+        async def remove_all():
+            return await asyncio.gather(*[self.client.remove(manifest) for manifest in manifests])
+
+        return {result['name']: result for result in self.__call(remove_all())}
+
+    def close(self):
+
+        if self.loop is None:
+            return
+
+        try:
+            if self.connection is not None:
+                self.__call(self.connection.close())
+        except Exception:
+            pass
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+        self.connection = None
+
+
+class FakeMessage:
+
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeNats:
+
+    # In-process stand-in for a NATS connection with wadm behind it, to run the deploy
+    # logic without a lattice. Applications are kept in memory as {name: {versions, deployed}}
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.models = {}
+        self.requests = 0
+        self.closed = False
+
+    async def request(self, subject, payload, timeout=None):
+
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+
+        parts = subject.split('.')
+        if parts[:2] != ['wadm', 'api'] or len(parts) < 5 or parts[3] != 'model':
+            raise TimeoutError(f"No responders for {subject}")
+
+        operation = parts[4]
+        name = '.'.join(parts[5:]) or None
+        body = json.loads(payload or b'{}')
+
+        if self.random.random() < self.failure_rate:
+            return self.__reply({'result': 'error', 'message': 'Simulated failure'})
+
+        if operation == 'put':
+            name = body['metadata']['name']
+            model = self.models.setdefault(name, {'versions': [], 'deployed': None})
+            if model['versions'] and model['versions'][-1][1] == body:
+                return self.__reply({'result': 'noop', 'name': name, 'current_version': model['versions'][-1][0]})
+            version = f"v{len(model['versions']) + 1}"
+            model['versions'].append((version, body))
+            return self.__reply({'result': 'created' if len(model['versions']) == 1 else 'newversion',
+                                 'name': name, 'current_version': version})
+
+        model = self.models.get(name)
+        if model is None:
+            return self.__reply({'result': 'notfound', 'message': f"Application {name} not found"})
+
+        if operation == 'deploy':
+            model['deployed'] = body.get('version') or model['versions'][-1][0]
+            return self.__reply({'result': 'acknowledged', 'name': name, 'version': model['deployed']})
+
+        if operation == 'undeploy':
+            model['deployed'] = None
+            return self.__reply({'result': 'acknowledged', 'name': name})
+
+        if operation == 'del':
+            del self.models[name]
+            return self.__reply({'result': 'deleted', 'name': name})
+
+        return self.__reply({'result': 'error', 'message': f"Unknown operation {operation}"})
+
+    def __reply(self, response):
+        return FakeMessage(json.dumps(response).encode())
+
+    async def close(self):
+        self.closed = True
\ No newline at end of file
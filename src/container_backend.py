@@ -0,0 +1,545 @@
+import io
+import os
+import queue
+import random
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import docker
+from datetime import datetime, timezone
+
+# Container backends shared by every stage: the Docker client (and its HTTP connection
+# pool), the image presence lookups and the long-lived workers driven with exec
+
+CONTAINER_BACKENDS = ['docker', 'fake']
+
+def tar_directory(path, arcname='.'):
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        tar.add(path, arcname=arcname)
+    return buffer.getvalue()
+
+def untar_directory(chunks, path):
+
+    # Extract an archive produced by get_archive, dropping its top-level directory
+    buffer = io.BytesIO(b''.join(chunks))
+    with tarfile.open(fileobj=buffer, mode='r') as tar:
+        for member in tar.getmembers():
+            parts = member.name.split('/', 1)
+            if len(parts) < 2 or not parts[1]:
+                continue
+            member.name = parts[1]
+            tar.extract(member, path, filter='data')
+
+
+class ContainerBackend:
+
+    def __init__(self):
+        self.images = {}
+        self.images_lock = threading.Lock()
+
+    def image(self, tag):
+
+        # Image presence is cached for the process lifetime, pelato is the one building them.
+        # None if the image does not exist
+        with self.images_lock:
+            if tag in self.images:
+                return self.images[tag]
+        try:
+            image = self.client.images.get(tag)
+        except docker.errors.ImageNotFound:
+            image = None
+        with self.images_lock:
+            self.images[tag] = image
+        return image
+
+    def build_image(self, tag, **kwargs):
+
+        image, _ = self.client.images.build(tag=tag, **kwargs)
+        with self.images_lock:
+            self.images[tag] = image
+        return image
+
+
+class DockerBackend(ContainerBackend):
+
+    def __init__(self, client=None, max_pool_size=None):
+
+        super().__init__()
+        self.__client = client
+        self.max_pool_size = max_pool_size
+
+    @property
+    def client(self):
+
+        # One client for every stage, its pool must hold a connection per running container
+        if self.__client is None:
+            pool = {'max_pool_size': self.max_pool_size} if self.max_pool_size else {}
+            self.__client = docker.from_env(**pool)
+        return self.__client
+
+    def find_worker(self, name):
+        try:
+            return self.client.containers.get(name)
+        except docker.errors.NotFound:
+            return None
+
+    def start_worker(self, name, image, volumes=None, environment=None, limits=None):
+
+        return self.client.containers.run(
+            image,
+            ["sleep", "infinity"],
+            environment=environment or [],
+            volumes=volumes or {},
+            labels={'pelato.worker': 'true'},
+            detach=True,
+            name=name,
+            **(limits or {})
+        )
+
+    def runs_image(self, worker, image):
+
+        # False if the image was rebuilt after the worker was started
+        try:
+            return worker.image.id == self.client.images.get(image).id
+        except docker.errors.ImageNotFound:
+            return False
+
+    def is_healthy(self, worker):
+
+        try:
+            worker.reload()
+            if worker.status != 'running':
+                return False
+            return worker.exec_run(["true"]).exit_code == 0
+        except Exception:
+            return False
+
+    def exec(self, worker, cmd, workdir=None, environment=None, on_output=None):
+
+        if on_output is None:
+            result = worker.exec_run(cmd, workdir=workdir, environment=environment)
+            return result.exit_code, result.output.decode(errors='replace')
+
+        # Stream the output while the command runs, the exit code is read once it ends
+        api = self.client.api
+        exec_id = api.exec_create(worker.id, cmd, workdir=workdir, environment=environment)['Id']
+        output = []
+        for chunk in api.exec_start(exec_id, stream=True):
+            output.append(chunk)
+            on_output(chunk)
+        return api.exec_inspect(exec_id)['ExitCode'], b''.join(output).decode(errors='replace')
+
+    def put_directory(self, worker, local_dir, path):
+
+        # Ship the directory as a tar archive, no bind mount needed
+        worker.exec_run(["mkdir", "-p", path])
+        worker.put_archive(path, tar_directory(local_dir))
+
+    def get_directory(self, worker, path, local_dir):
+
+        # Copy the content of path inside the worker to local_dir
+        chunks, _ = worker.get_archive(path)
+        untar_directory(chunks, local_dir)
+
+    def remove_worker(self, worker):
+        worker.remove(force=True)
+
+
+class FakeWorker:
+
+    def __init__(self, name, backend):
+        self.name = name
+        self.status = 'running'
+        self.root = tempfile.mkdtemp(prefix=f"pelato-{name}-")
+        self.backend = backend
+
+    def path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+
+class FakeBackend(ContainerBackend):
+
+    # In-memory stand-in for DockerBackend, to run and benchmark the orchestration without Docker.
+    # handler(job_dir, environment) -> (exit code, output) simulates the command run with exec,
+    # client the containers run by the scheduler and the image builds
+
+    def __init__(self, handler=None, latency=0.0, failure_rate=0.0, unhealthy_rate=0.0, seed=None, deploy_latency=None, image_latency=0.0):
+
+        super().__init__()
+        self.client = FakeDockerClient(latency, latency if deploy_latency is None else deploy_latency, image_latency,
+                                       failure_rate, jitter=0.1, seed=seed)
+        self.handler = handler or self.__default_handler
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.unhealthy_rate = unhealthy_rate
+        self.random = random.Random(seed)
+        self.workers = {}
+        self.lock = threading.Lock()
+        self.started = 0
+        self.execs = 0
+
+    def __default_handler(self, job_dir, environment):
+
+        # Pretend to build: write build/<COMPONENT_NAME>.wasm
+        env = dict(item.split('=', 1) for item in environment or [])
+        os.makedirs(os.path.join(job_dir, 'build'), exist_ok=True)
+        with open(os.path.join(job_dir, 'build', f"{env.get('COMPONENT_NAME', 'component')}.wasm"), 'wb') as file:
+            file.write(b'\0asm')
+        return 0, "All done!\n"
+
+    def find_worker(self, name):
+        return self.workers.get(name)
+
+    def start_worker(self, name, image, volumes=None, environment=None, limits=None):
+
+        with self.lock:
+            worker = FakeWorker(name, self)
+            self.workers[name] = worker
+            self.started += 1
+            return worker
+
+    def runs_image(self, worker, image):
+        return True
+
+    def is_healthy(self, worker):
+
+        with self.lock:
+            if worker.status == 'running' and self.random.random() < self.unhealthy_rate:
+                worker.status = 'exited'
+        return worker.status == 'running'
+
+    def exec(self, worker, cmd, workdir=None, environment=None, on_output=None):
+
+        with self.lock:
+            self.execs += 1
+            failed = self.random.random() < self.failure_rate
+
+        if cmd[0] == 'rm':
+            shutil.rmtree(worker.path(cmd[-1]), ignore_errors=True)
+            return 0, ""
+        if cmd[0] != 'pelato-build':
+            return 0, ""
+
+        time.sleep(self.latency)
+        if failed:
+            exit_code, output = 1, "Simulated failure\n"
+        else:
+            exit_code, output = self.handler(worker.path(workdir or '/'), environment)
+
+        if on_output is not None:
+            on_output(output)
+        return exit_code, output
+
+    def put_directory(self, worker, local_dir, path):
+        shutil.copytree(local_dir, worker.path(path), dirs_exist_ok=True)
+
+    def get_directory(self, worker, path, local_dir):
+
+        source = worker.path(path)
+        if not os.path.exists(source):
+            raise FileNotFoundError(path)
+        shutil.copytree(source, local_dir, dirs_exist_ok=True)
+
+    def remove_worker(self, worker):
+
+        with self.lock:
+            worker.status = 'removed'
+            self.workers.pop(worker.name, None)
+        shutil.rmtree(worker.root, ignore_errors=True)
+
+
+
+# Output of docker/build.sh, with the share of the build time spent before each line
+BUILD_SCRIPT = [
+    ('Setting Go flags...', 0.0),
+    ('Downloading dependencies...', 0.0),
+    ('Tidying modules...', 0.3),
+    ('Building WASM component...', 0.1),
+    ('Build completed successfully!', 0.5),
+    ('Pushing to registry: {registry}', 0.0),
+    ('Push completed!', 0.1),
+    ('Setting file permissions...', 0.0),
+    ('All done!', 0.0),
+]
+
+class FakeImage:
+
+    def __init__(self, tag, labels=None):
+        self.id = f"sha256:{tag}"
+        self.tags = [tag]
+        self.labels = labels or {}
+
+
+class FakeContainer:
+
+    def __init__(self, client, name, image, command=None, environment=None, volumes=None, labels=None):
+
+        self.client = client
+        self.id = name
+        self.name = name
+        self.image = image
+        self.command = command
+        self.environment = dict(item.split('=', 1) for item in environment or [])
+        self.volumes = volumes or {}
+        self.labels = labels or {}
+        self.status = 'created'
+        self.lines = []
+        self.exit_code = None
+        self.output = queue.Queue()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.root = None
+
+    def __bind(self, path):
+        for source, mount in self.volumes.items():
+            if mount['bind'] == path:
+                return source
+        # Directories copied in with put_archive
+        if self.root is not None and os.path.isdir(self.__path(path)):
+            return self.__path(path)
+        return None
+
+    def __path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def put_archive(self, path, data):
+
+        if self.root is None:
+            self.root = tempfile.mkdtemp(prefix=f"pelato-{self.name}-")
+        os.makedirs(self.__path(path), exist_ok=True)
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r') as tar:
+            tar.extractall(self.__path(path), filter='data')
+        return True
+
+    def get_archive(self, path):
+
+        source = self.__path(path) if self.root is not None else None
+        if source is None or not os.path.exists(source):
+            raise docker.errors.NotFound(path)
+        return [tar_directory(source, os.path.basename(path.rstrip('/')))], {}
+
+    def __run(self):
+
+        # Build containers print the build.sh lines and write the wasm to the /app mount,
+        # the others (deploy, remove) just take their time. A stopped container exits with 137
+        failed = self.client.fails()
+        latency = self.client.latency(self.image)
+        if not self.image.startswith(('wash-build', 'pelato-build')):
+            self.exit_code = 137 if self.stopping.wait(latency) else 1 if failed else 0
+            return
+
+        # Push of a module already built, under every tag
+        if self.command == ['pelato-push']:
+            for registry in self.environment.get('PELATO_PUSH', '').splitlines():
+                if self.stopping.wait(latency * 0.1):
+                    self.exit_code = 137
+                    return
+                self.lines.append((time.time(), f"Pushing to registry: {registry}"))
+                self.output.put((self.lines[-1][1] + '\n').encode())
+            self.exit_code = 1 if failed else 0
+            return
+
+        component = self.environment.get('COMPONENT_NAME', self.name)
+        for i, (line, share) in enumerate(BUILD_SCRIPT):
+            if self.stopping.wait(latency * share):
+                self.exit_code = 137
+                return
+            if failed and i == 4:
+                line = 'error: simulated build failure'
+            self.lines.append((time.time(), line.format(registry=self.environment.get('REGISTRY', ''))))
+            self.output.put((self.lines[-1][1] + '\n').encode())
+            if failed and i == 4:
+                self.exit_code = 1
+                return
+
+        app = self.__bind('/app')
+        if app is not None:
+            os.makedirs(os.path.join(app, 'build'), exist_ok=True)
+            with open(os.path.join(app, 'build', f"{component}.wasm"), 'wb') as file:
+                file.write(b'\0asm' + bytes(self.client.wasm_size))
+        self.exit_code = 0
+
+    def __main(self):
+
+        try:
+            self.__run()
+        finally:
+            self.status = 'exited'
+            self.output.put(None)
+            self.client.die(self)
+
+    def start(self):
+
+        self.status = 'running'
+        self.thread = threading.Thread(target=self.__main, name=f"fake-{self.name}", daemon=True)
+        self.thread.start()
+
+    def __stream(self):
+
+        while True:
+            chunk = self.output.get()
+            if chunk is None:
+                return
+            yield chunk
+
+    def logs(self, stream=False, follow=False, timestamps=False):
+
+        if stream:
+            return self.__stream()
+        self.thread.join()
+        stamp = lambda t: datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ ') if timestamps else ''
+        return ''.join(f"{stamp(t)}{line}\n" for t, line in self.lines).encode()
+
+    def wait(self):
+
+        self.thread.join()
+        return {'StatusCode': self.exit_code}
+
+    def stop(self, timeout=None):
+
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def remove(self, force=False):
+
+        if force and self.status == 'running':
+            self.stop()
+        if self.root is not None:
+            shutil.rmtree(self.root, ignore_errors=True)
+        self.client.containers.remove(self.name)
+
+
+class FakeImages:
+
+    def __init__(self, client):
+        self.client = client
+        self.images = {}
+
+    def get(self, tag):
+        if tag not in self.images:
+            raise docker.errors.ImageNotFound(tag)
+        return self.images[tag]
+
+    def build(self, tag=None, labels=None, **kwargs):
+        time.sleep(self.client.image_latency)
+        self.images[tag] = FakeImage(tag, labels)
+        return self.images[tag], []
+
+
+class FakeContainers:
+
+    def __init__(self, client):
+        self.client = client
+        self.containers = {}
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        with self.lock:
+            if name not in self.containers:
+                raise docker.errors.NotFound(name)
+            return self.containers[name]
+
+    def create(self, image, command=None, environment=None, volumes=None, name=None, labels=None, **kwargs):
+
+        with self.lock:
+            self.client.created += 1
+            container = FakeContainer(self.client, name, image, command, environment, volumes, labels)
+            self.containers[name] = container
+            return container
+
+    def remove(self, name):
+        with self.lock:
+            self.containers.pop(name, None)
+
+
+class FakeVolumes:
+
+    def get(self, name):
+        raise docker.errors.NotFound(name)
+
+
+class FakeEvents:
+
+    # Stream of the die events of the containers matching the label filters, like client.events()
+    def __init__(self, client, labels):
+        self.client = client
+        self.labels = labels
+        self.queue = queue.Queue()
+
+    def matches(self, container):
+        return all(container.labels.get(key) == value for key, value in self.labels.items())
+
+    def __iter__(self):
+
+        while True:
+            event = self.queue.get()
+            if event is None:
+                return
+            yield event
+
+    def close(self):
+        self.client.unsubscribe(self)
+        self.queue.put(None)
+
+
+class FakeDockerClient:
+
+    # In-memory stand-in for the docker SDK client used by the stages, to run and benchmark
+    # the orchestration without Docker. Latencies in seconds, by image prefix
+
+    def __init__(self, build_latency=0.0, deploy_latency=0.0, image_latency=0.0, failure_rate=0.0, jitter=0.0, seed=None, wasm_size=1024):
+
+        self.build_latency = build_latency
+        self.deploy_latency = deploy_latency
+        self.image_latency = image_latency
+        self.failure_rate = failure_rate
+        self.jitter = jitter
+        self.wasm_size = wasm_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.created = 0
+        self.images = FakeImages(self)
+        self.containers = FakeContainers(self)
+        self.volumes = FakeVolumes()
+        self.subscribers = []
+
+    def latency(self, image):
+
+        latency = self.build_latency if image.startswith(('wash-build', 'pelato-build')) else self.deploy_latency
+        with self.lock:
+            return max(0.0, latency * (1 + self.random.uniform(-self.jitter, self.jitter)))
+
+    def fails(self):
+        with self.lock:
+            return self.random.random() < self.failure_rate
+
+    def events(self, since=None, decode=False, filters=None):
+
+        labels = (filters or {}).get('label', [])
+        labels = dict(label.split('=', 1) for label in ([labels] if isinstance(labels, str) else labels))
+        stream = FakeEvents(self, labels)
+        with self.lock:
+            self.subscribers.append(stream)
+        return stream
+
+    def unsubscribe(self, stream):
+        with self.lock:
+            if stream in self.subscribers:
+                self.subscribers.remove(stream)
+
+    def die(self, container):
+
+        event = {'Type': 'container', 'Action': 'die', 'Actor': {'ID': container.id, 'Attributes':
+                 {'name': container.name, 'exitCode': str(container.exit_code), **container.labels}}}
+        with self.lock:
+            subscribers = [stream for stream in self.subscribers if stream.matches(container)]
+        for stream in subscribers:
+            stream.queue.put(event)
+
+    def df(self):
+        return {'Volumes': []}
\ No newline at end of file
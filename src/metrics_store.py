@@ -0,0 +1,153 @@
+import os
+import json
+import sqlite3
+import yaml
+import src.utils as ut
+from .colors import Colors
+
+# Append-only store of the runs metrics, one row per run. The numeric columns are
+# extracted from the run for querying, the full run is kept as JSON in data
+METRICS_DB = "metrics.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL,
+    command TEXT,
+    project TEXT,
+    n_task INTEGER,
+    time_total REAL,
+    gen_time REAL,
+    build_time REAL,
+    build_image_time REAL,
+    deploy_time REAL,
+    deploy_image_time REAL,
+    skipped_components INTEGER,
+    unchanged_components INTEGER,
+    source TEXT UNIQUE,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at);
+CREATE INDEX IF NOT EXISTS runs_command ON runs (command, started_at);
+CREATE INDEX IF NOT EXISTS runs_n_task ON runs (n_task, started_at);
+"""
+
+# Column -> path of the value inside a run
+COLUMNS = {
+    'n_task': ('n_task',),
+    'time_total': ('time_total',),
+    'gen_time': ('code_gen', 'gen_time'),
+    'build_time': ('build', 'components_build_time'),
+    'build_image_time': ('build', 'image_build_time'),
+    'deploy_time': ('deploy', 'components_deploy_time'),
+    'deploy_image_time': ('deploy', 'image_build_time'),
+    'skipped_components': ('build', 'skipped_components'),
+    'unchanged_components': ('code_gen', 'unchanged_components'),
+}
+INTEGER_COLUMNS = {'n_task', 'skipped_components', 'unchanged_components'}
+
+def __number(run, path, integer):
+
+    # Times are stored as '%.3f' strings in the runs
+    value = run
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    try:
+        return int(value) if integer else float(value)
+    except (TypeError, ValueError):
+        return None
+
+def run_row(run):
+    return {column: __number(run, path, column in INTEGER_COLUMNS) for column, path in COLUMNS.items()}
+
+
+class MetricsStore:
+
+    def __init__(self, path):
+
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+
+        # WAL lets concurrent runs append while others read
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    @classmethod
+    def for_project(cls, project_dir):
+        return cls(os.path.join(project_dir, METRICS_DB))
+
+    def append(self, run, command=None, project=None, started_at=None, source=None):
+
+        # One INSERT, atomic: a run is either fully stored or not at all.
+        # Runs with a source already stored (imports) are ignored
+        row = run_row(run)
+        row.update({
+            'started_at': started_at,
+            'command': command,
+            'project': project,
+            'source': source,
+            'data': json.dumps(run, default=str)
+        })
+
+        columns = ', '.join(row)
+        placeholders = ', '.join(f":{column}" for column in row)
+        cursor = self.connection.execute(f"INSERT OR IGNORE INTO runs ({columns}) VALUES ({placeholders})", row)
+        return cursor.rowcount == 1
+
+    def runs(self, command=None, n_task=None, since=None):
+
+        # Runs in insertion order, as stored by pelato
+        conditions = []
+        params = []
+        if command is not None:
+            conditions.append("command = ?")
+            params.append(command)
+        if n_task is not None:
+            conditions.append("n_task = ?")
+            params.append(n_task)
+        if since is not None:
+            conditions.append("started_at >= ?")
+            params.append(since)
+
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.connection.execute(f"SELECT data FROM runs{where} ORDER BY id", params)
+        return [json.loads(data) for (data,) in rows]
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def import_yaml(self, path):
+
+        # metrics.yaml files ({runs: [...]}), each run is imported once. Keyed on the absolute
+        # path, the metrics.yaml of two projects in folders with the same name are different files
+        with open(path, 'r') as file:
+            runs = (ut.load_yaml(file) or {}).get('runs') or []
+
+        name = os.path.abspath(path)
+        imported = 0
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            for i, run in enumerate(runs):
+                if self.append(run, source=f"{name}#{i}"):
+                    imported += 1
+        return imported
+
+    def export_yaml(self, path, **filters):
+
+        # Same format as metrics.yaml, for the plotting scripts in utils/
+        with open(path, 'w') as file:
+            yaml.dump({'runs': self.runs(**filters)}, file)
+
+    def close(self):
+        self.connection.close()
+
+def show(store):
+
+    print(f"{Colors.BLUE}Metrics store {store.path}: {store.count()} runs{Colors.RESET}")
+    for command, runs, avg_total in store.connection.execute(
+            "SELECT COALESCE(command, 'imported'), COUNT(*), AVG(time_total) FROM runs GROUP BY command ORDER BY command"):
+        average = f"{avg_total:.3f}s" if avg_total is not None else "-"
+        print(f"   {Colors.CYAN}• {command:<10}{Colors.RESET} {runs:>6} runs, average total {average}")
\ No newline at end of file
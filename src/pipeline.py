@@ -0,0 +1,239 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .code_generator import generator as code_generator
+from .code_generator import template_registry
+from .wasm_builder import build as wasm_builder
+from .component_deploy import deploy as deployer
+from .component_deploy import remove as remover
+from .component_deploy import manifests as mf
+from .scheduler import log
+import src.topic_graph as topic_graph
+import src.tracing as tracing
+import src.utils as ut
+from .colors import Colors
+
+def __span(spans):
+
+    # Wall-clock time from the first start to the last end of a stage
+    if not spans:
+        return 0.0
+    return max(end for _, end in spans) - min(start for start, _ in spans)
+
+def run_pipeline(pelato, project_dir):
+
+    # Each component is built as soon as it is generated, and deployed as soon as its
+    # build and push succeed and its consumers are deployed, with at most max_concurrency
+    # components in flight. Returns the components that failed
+    backend = pelato.get_backend()
+    client = backend.client
+    build_metrics = {}
+    deploy_metrics = {}
+
+    build_image = wasm_builder.prepare_build_image(backend, pelato.prewarm_deps, build_metrics)
+    session = pelato.get_wadm_session()
+    if session is None:
+        deployer.prepare_deploy_image(backend, deploy_metrics)
+
+    pool = pelato.get_worker_pool()
+    if pool is not None:
+        pool.image = build_image
+    dispatcher = pelato.get_build_dispatcher()
+    prepare = lambda endpoint: wasm_builder.prepare_build_image(endpoint, pelato.prewarm_deps, build_metrics)
+
+    manifest = ut.load_state(project_dir, wasm_builder.BUILD_MANIFEST, {})
+    deploy_state = ut.load_state(project_dir, mf.DEPLOY_STATE, {})
+    plan = []
+    components = {}
+    spans = {'build': [], 'deploy': []}
+    lock = threading.Lock()
+
+    # A component is deployed only after the consumers of its topics
+    with open(f"{project_dir}/workflow.yaml", 'r') as file:
+        tasks = (ut.load_yaml(file) or {}).get('tasks') or []
+    dependencies = topic_graph.deploy_dependencies(topic_graph.build_graph(tasks))
+    settled = set()
+    waiting = set()
+    outstanding = [0]
+    done = threading.Condition(lock)
+
+    def build(task):
+
+        timings = components.setdefault(task, {})
+
+        job = wasm_builder.plan_build(project_dir, task, manifest, pelato.incremental_build,
+                                      pelato.reg_user, pelato.reg_pass, pelato.build_cache, build_image)
+        if job is None:
+            timings['build'] = 'skipped'
+            return True
+
+        start = time.time()
+        if pool is not None:
+            exit_code = pool.run_one(job)
+        elif dispatcher is not None:
+            exit_code = dispatcher.run_one(job, prepare)
+        else:
+            exit_code = pelato.scheduler.run_one(client, job, 'Build')
+        end = time.time()
+
+        with lock:
+            spans['build'].append((start, end))
+        timings['build'] = '%.3f' % (end - start)
+        timings.update(job['build_log'].summary())
+
+        if exit_code != 0:
+            timings['status'] = 'build failed'
+            return False
+        wasm_builder.record_build(manifest, job)
+        return True
+
+    def deploy(task):
+
+        timings = components.setdefault(task, {})
+
+        # Only applications whose manifest changed since the last deploy are applied
+        entry = mf.plan_entry(f"{project_dir}/gen/{task}", deploy_state, pelato.incremental_deploy)
+        with lock:
+            plan.append(entry)
+
+        if entry['action'] == 'unchanged':
+            timings['deploy'] = 'skipped'
+            timings['status'] = 'deployed'
+            return
+
+        start = time.time()
+        if session is not None:
+            result = session.apply(entry['manifest'])
+            mf.report({result['name']: result}, 'Deployment')
+            exit_code = 0 if result['status'] == 'deployed' else 1
+        else:
+            exit_code = pelato.scheduler.run_one(client, deployer.deploy_job(f"{project_dir}/gen/{task}", pelato.nats_host, pelato.nats_port), 'Deployment')
+        end = time.time()
+
+        with lock:
+            spans['deploy'].append((start, end))
+            if exit_code == 0:
+                mf.record_deploy(deploy_state, entry)
+        timings['deploy'] = '%.3f' % (end - start)
+        timings['status'] = 'deployed' if exit_code == 0 else 'deploy failed'
+
+    def settle(task):
+
+        # The component is done (or failed), start the deploys that were waiting for it
+        with lock:
+            settled.add(task)
+            ready = sorted(t for t in waiting if not dependencies.get(t, set()) - settled)
+            waiting.difference_update(ready)
+        for t in ready:
+            submit(t, True)
+
+    def process(task, deploy_only):
+
+        try:
+            with tracing.span('pipeline.component', parent, component=task, deploy_only=deploy_only):
+                chain(task, deploy_only)
+
+        except Exception as e:
+            log(f"{Colors.RED} - Error in pipeline for {task}: {e}{Colors.RESET}")
+            settle(task)
+
+        finally:
+            with done:
+                outstanding[0] -= 1
+                done.notify_all()
+
+    def chain(task, deploy_only):
+
+        if not deploy_only:
+            if not build(task):
+                settle(task)
+                return
+            with lock:
+                if dependencies.get(task, set()) - settled:
+                    waiting.add(task)
+                    return
+        deploy(task)
+        settle(task)
+
+    def submit(task, deploy_only=False):
+        with lock:
+            outstanding[0] += 1
+        executor.submit(process, task, deploy_only)
+
+    start_time = time.time()
+    submitted = set()
+    parent = tracing.current_span()
+
+    with ThreadPoolExecutor(max_workers=pelato.scheduler.max_concurrency) as executor:
+
+        def on_generated(task):
+            submitted.add(task)
+            submit(task)
+
+        templates = template_registry.get_registry(pelato.template_cache_dir)
+        code_generator.generate(project_dir, pelato.registry_url, pelato.metrics, pelato.metrics_enabled,
+                                pelato.incremental_gen, templates, pelato.gen_materialize, on_generated)
+
+        # Components that failed to generate will never be deployed, don't wait for them
+        for task in dependencies:
+            if task not in submitted:
+                settle(task)
+        for task in tasks:
+            if task.get('component_name') not in submitted:
+                components[task.get('component_name')] = {'status': 'gen failed'}
+
+        log(f"{Colors.BLUE}Waiting for {len(submitted)} components to be built and deployed...{Colors.RESET}")
+        with done:
+            while outstanding[0]:
+                done.wait()
+
+    # Drop the components that are not generated anymore, and remove their applications
+    for task in list(manifest):
+        if not os.path.isdir(f"{project_dir}/gen/{task}"):
+            del manifest[task]
+    ut.dump_state(project_dir, wasm_builder.BUILD_MANIFEST, manifest)
+
+    generated = []
+    for task in os.listdir(f"{project_dir}/gen"):
+        if not os.path.isdir(f"{project_dir}/gen/{task}"):
+            continue
+        try:
+            generated.append(mf.load_manifest(f"{project_dir}/gen/{task}")['metadata']['name'])
+        except Exception as e:
+            # Not removed because its wadm.yaml can't be read
+            log(f"{Colors.YELLOW} - Could not read the manifest of {task}: {e}{Colors.RESET}")
+            generated += [name for name, entry in deploy_state.items() if entry.get('task') == task]
+    deleted = mf.deleted_entries(deploy_state, generated)
+    plan += deleted
+    mf.print_plan(plan)
+
+    removed = set()
+    try:
+        removed = remover.remove_entries(project_dir, deleted, pelato.nats_host, pelato.nats_port, pelato.scheduler, session, backend)
+        for name in removed:
+            mf.forget_deploy(project_dir, deploy_state, name)
+    except Exception as e:
+        log(f"{Colors.RED} - Error removing deleted components: {e}{Colors.RESET}")
+    ut.dump_state(project_dir, mf.DEPLOY_STATE, deploy_state)
+
+    pelato.build_cache.limit(client)
+
+    if pelato.metrics_enabled:
+        build_metrics['components_build_time'] = '%.3f' % __span(spans['build'])
+        build_metrics['skipped_components'] = sum(1 for t in components.values() if t.get('build') == 'skipped')
+        deploy_metrics['components_deploy_time'] = '%.3f' % __span(spans['deploy'])
+        deploy_metrics['backend'] = 'wadm' if session is not None else 'container'
+        deploy_metrics['plan'] = mf.plan_summary(plan)
+        pelato.metrics['build'] = build_metrics
+        pelato.metrics['deploy'] = deploy_metrics
+        pelato.metrics['pipeline'] = {
+            'pipeline_time': '%.3f' % (time.time() - start_time),
+            'components': components
+        }
+
+    failed = [task for task, t in components.items() if t.get('status') != 'deployed']
+    failed += [entry['name'] for entry in deleted if entry['name'] not in removed]
+    if failed:
+        log(f"{Colors.RED}Pipeline failed for {len(failed)} components: {', '.join(sorted(failed))}{Colors.RESET}")
+    return failed
\ No newline at end of file
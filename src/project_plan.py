@@ -0,0 +1,110 @@
+import os
+import threading
+import src.utils as ut
+
+# Plan compiled by gen in <project>/.pelato: for every generated component its wadm
+# manifest, image, template, topics and fingerprint. Build, deploy and remove read the
+# manifests from here instead of parsing every gen/*/wadm.yaml again; an entry is used
+# only while its wadm.yaml has the stamp (mtime and size, or else content hash) it was
+# compiled from
+PLAN = "plan.json"
+PLAN_VERSION = 1
+
+# Plans already read, {project dir: (plan.json mtime, plan)}
+__plans = {}
+__lock = threading.Lock()
+
+def file_stamp(path):
+
+    stat = os.stat(path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'digest': ut.hash_file(path)}
+
+def is_fresh(stamp, path):
+
+    # Same mtime and size, or touched without changing
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    if stamp.get('mtime_ns') == stat.st_mtime_ns and stamp.get('size') == stat.st_size:
+        return True
+    return stamp.get('size') == stat.st_size and stamp.get('digest') == ut.hash_file(path)
+
+def compile_component(task_dir, task, fingerprint):
+
+    wadm_path = f"{task_dir}/wadm.yaml"
+    with open(wadm_path, 'r') as file:
+        manifest = ut.load_yaml(file)
+    component = manifest['spec']['components'][0]
+    return {
+        'name': manifest['metadata']['name'],
+        'component': component['name'],
+        'image': component['properties']['image'],
+        'template': task.get('type'),
+        'source_topic': task.get('source_topic'),
+        'dest_topic': task.get('dest_topic'),
+        'fingerprint': fingerprint,
+        'wadm': file_stamp(wadm_path),
+        'manifest': manifest
+    }
+
+def write_plan(project_dir, tasks, components):
+
+    # Components is the gen manifest, {component name: {fingerprint, files}}. The entries
+    # of the components generated again are compiled again, the others reused
+    previous = load_plan(project_dir) or {}
+    previous = previous.get('components', {})
+    entries = {}
+    for task in tasks:
+        name = task['component_name']
+        if name not in components:
+            continue
+        task_dir = f"{project_dir}/gen/{name}"
+        old = previous.get(name)
+        if old and old['fingerprint'] == components[name]['fingerprint'] and is_fresh(old['wadm'], f"{task_dir}/wadm.yaml"):
+            entries[name] = old
+        else:
+            try:
+                entries[name] = compile_component(task_dir, task, components[name]['fingerprint'])
+            except (OSError, KeyError, IndexError, TypeError):
+                # Left out, the stages parse its wadm.yaml
+                continue
+
+    workflow = f"{project_dir}/workflow.yaml"
+    ut.dump_state(project_dir, PLAN, {'version': PLAN_VERSION, 'workflow': file_stamp(workflow), 'components': entries})
+
+def load_plan(project_dir):
+
+    # The plan as last written, None if there is none
+    path = ut.state_path(project_dir, PLAN)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+    key = os.path.abspath(project_dir)
+    with __lock:
+        cached = __plans.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    plan = ut.load_state(project_dir, PLAN)
+    if not plan or plan.get('version') != PLAN_VERSION:
+        plan = None
+    with __lock:
+        __plans[key] = (mtime, plan)
+    return plan
+
+def manifest(task_dir):
+
+    # Compiled manifest of gen/<task>, None when the plan doesn't hold it or it is stale
+    task_dir = os.path.abspath(task_dir)
+    gen_dir = os.path.dirname(task_dir)
+    if os.path.basename(gen_dir) != 'gen':
+        return None
+
+    plan = load_plan(os.path.dirname(gen_dir))
+    entry = (plan or {}).get('components', {}).get(os.path.basename(task_dir))
+    if entry is None or not is_fresh(entry['wadm'], f"{task_dir}/wadm.yaml"):
+        return None
+    return entry['manifest']
\ No newline at end of file
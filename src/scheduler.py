@@ -0,0 +1,316 @@
+import os
+import re
+import time
+import shutil
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import src.tracing as tracing
+from .colors import Colors
+
+# Jobs print from several threads, keep their lines whole
+__print_lock = threading.Lock()
+
+def log(message):
+    with __print_lock:
+        print(message, flush=True)
+
+# Memory reserved to each container when estimating the default concurrency
+DEFAULT_JOB_MEMORY = 2 * 1024 ** 3
+
+# Deploy and remove containers only run a wash command, they are not bound by cores and memory
+DEFAULT_DEPLOY_CONCURRENCY = 32
+
+# Label of the containers of one scheduler run, to follow only their exits
+RUN_LABEL = "pelato.run"
+
+# Seconds a running container gets to exit when a fail-fast run is stopped
+STOP_TIMEOUT = 5
+
+def parse_size(size):
+
+    # "512m", "2g", "1073741824" -> bytes
+    if size is None or size == '':
+        return None
+
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmgt]?)b?\s*', str(size).lower())
+    if not match:
+        raise ValueError(f"Invalid size: {size}")
+
+    value, unit = match.groups()
+    return int(float(value) * 1024 ** ' kmgt'.index(unit or ' '))
+
+def total_memory():
+
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def default_concurrency(job_memory=None):
+
+    # One container per core, as long as every container fits in memory
+    cpus = os.cpu_count() or 1
+    memory = total_memory()
+    if memory is None:
+        return cpus
+
+    return max(1, min(cpus, memory // (job_memory or DEFAULT_JOB_MEMORY)))
+
+
+class ExitEvents:
+
+    # Exit codes of the containers of a run, from one Docker events stream instead of
+    # one wait() request held open per running container
+    def __init__(self, client, run_id):
+
+        self.codes = {}
+        self.closed = False
+        self.condition = threading.Condition()
+        self.stream = client.events(since=int(time.time()), decode=True,
+                                    filters={'type': 'container', 'event': 'die', 'label': f"{RUN_LABEL}={run_id}"})
+        threading.Thread(target=self.__read, name="pelato-events", daemon=True).start()
+
+    def __read(self):
+
+        try:
+            for event in self.stream:
+                attributes = event.get('Actor', {}).get('Attributes', {})
+                with self.condition:
+                    self.codes[attributes.get('name')] = int(attributes.get('exitCode', -1))
+                    self.condition.notify_all()
+        except Exception:
+            pass
+        finally:
+            with self.condition:
+                self.closed = True
+                self.condition.notify_all()
+
+    def wait(self, name, container):
+
+        with self.condition:
+            while name not in self.codes and not self.closed:
+                self.condition.wait()
+            if name in self.codes:
+                return self.codes.pop(name)
+
+        # The stream broke, ask the container
+        return container.wait()['StatusCode']
+
+    def close(self):
+        self.stream.close()
+
+
+class FailFast:
+
+    # First failure of a run: the jobs not started yet are skipped, the running containers stopped
+    def __init__(self):
+
+        self.failed = threading.Event()
+        self.running = {}
+        self.stopped = set()
+        self.lock = threading.Lock()
+
+    def start(self, name, container):
+
+        # False if the run already failed, the container must not start
+        with self.lock:
+            if self.failed.is_set():
+                return False
+            self.running[name] = container
+            return True
+
+    def finish(self, name):
+
+        # True if the container was stopped because of another failure
+        with self.lock:
+            self.running.pop(name, None)
+            return name in self.stopped
+
+    def fail(self, name):
+
+        with self.lock:
+            if self.failed.is_set():
+                return
+            self.failed.set()
+            running = {other: container for other, container in self.running.items() if other != name}
+            self.stopped |= set(running)
+
+        log(f"{Colors.RED} - {name} failed, stopping {len(running)} running containers and skipping the queued ones{Colors.RESET}")
+        for other, container in running.items():
+            try:
+                container.stop(timeout=STOP_TIMEOUT)
+            except Exception as e:
+                log(f"{Colors.YELLOW} - Could not stop container {other}: {e}{Colors.RESET}")
+
+
+class ContainerScheduler:
+
+    def __init__(self, max_concurrency=None, cpus=None, memory=None, fail_fast=False, deploy_concurrency=None):
+
+        self.cpus = float(cpus) if cpus else None
+        self.memory = parse_size(memory)
+        self.max_concurrency = int(max_concurrency) if max_concurrency else default_concurrency(self.memory)
+        # An explicit max_concurrency bounds the deploys too, the default one only the builds
+        self.deploy_concurrency = int(deploy_concurrency or max_concurrency or DEFAULT_DEPLOY_CONCURRENCY)
+        self.fail_fast = fail_fast
+
+    @classmethod
+    def from_env(cls, parallel):
+
+        # PARALLEL_BUILD=False runs one container at a time
+        if parallel == 'False':
+            return cls(1, os.getenv('CONTAINER_CPUS'), os.getenv('CONTAINER_MEMORY'), os.getenv('FAIL_FAST') == 'True', 1)
+        return cls(os.getenv('MAX_CONCURRENCY'), os.getenv('CONTAINER_CPUS'), os.getenv('CONTAINER_MEMORY'),
+                   os.getenv('FAIL_FAST') == 'True', os.getenv('DEPLOY_CONCURRENCY'))
+
+    def limits(self):
+
+        limits = {}
+        if self.cpus:
+            limits['nano_cpus'] = int(self.cpus * 1e9)
+        if self.memory:
+            limits['mem_limit'] = self.memory
+        return limits
+
+    def run(self, client, jobs, action, max_concurrency=None):
+
+        # Run the jobs keeping at most max_concurrency containers alive (the scheduler's one
+        # unless given), a new one is started as soon as a running one finishes.
+        # Returns {container name: exit code}, None for the jobs skipped or stopped by fail-fast
+        results = {}
+        max_concurrency = max_concurrency or self.max_concurrency
+
+        log(f'{Colors.BLUE}Running {len(jobs)} containers, at most {max_concurrency} at a time{Colors.RESET}')
+
+        # The jobs run in pool threads, parent their spans to the caller's one
+        parent = tracing.current_span()
+        
+        # Exits are reported in the order they happen, by the daemon
+        run_id = uuid.uuid4().hex[:12]
+        try:
+            events = ExitEvents(client, run_id)
+        except Exception as e:
+            log(f"{Colors.YELLOW} - Could not follow the container events, waiting on each container: {e}{Colors.RESET}")
+            events = None
+        fail_fast = FailFast() if self.fail_fast else None
+        
+        try:
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                futures = {executor.submit(self.__run_job, client, job, action, parent, run_id, events, fail_fast): job['name'] for job in jobs}
+
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        log(f"{Colors.YELLOW} - Error waiting for container {name}: {e}{Colors.RESET}")
+                        results[name] = None
+                        if fail_fast is not None:
+                            fail_fast.fail(name)
+        finally:
+            if events is not None:
+                events.close()
+
+        return results
+
+    def run_one(self, client, job, action):
+
+        # Run a single job in the calling thread, for callers managing their own concurrency
+        try:
+            return self.__run_job(client, job, action)
+        except Exception as e:
+            log(f"{Colors.YELLOW} - Error waiting for container {job['name']}: {e}{Colors.RESET}")
+            return None
+
+    def __run_job(self, client, job, action, parent=None, run_id=None, events=None, fail_fast=None):
+
+        import docker
+        name = job['name']
+        
+        if fail_fast is not None and fail_fast.failed.is_set():
+            log(f"{Colors.YELLOW} - Skipping {name}, an earlier {action.lower()} failed{Colors.RESET}")
+            return None
+        
+        with tracing.span('container.job', parent, component=job.get('component', name), action=action, image=job['image']) as span:
+            
+            # Check if container with the same name already exists and remove it
+            try:
+                existing_container = client.containers.get(name)
+                log(f"{Colors.YELLOW} - Removing existing container {name}{Colors.RESET}")
+                existing_container.remove(force=True)
+            except docker.errors.NotFound:
+                # Container doesn't exist, continue
+                pass
+            except Exception as e:
+                log(f"{Colors.RED} - Warning: Could not remove existing container {name}: {e}{Colors.RESET}")
+            
+            log(f"{Colors.BLUE} - {job['message']}{Colors.RESET}")
+            with tracing.span('container.create', container=name):
+                container = client.containers.create(
+                    job['image'],
+                    job.get('command'),
+                    environment=job['environment'],
+                    volumes=job['volumes'],
+                    detach=True,
+                    name=name,
+                    labels={RUN_LABEL: run_id} if run_id else None,
+                    **self.limits()
+                )
+            
+            # Sources shipped as archives, for daemons that can't bind mount them
+            if 'upload' in job:
+                from .container_backend import tar_directory
+                with tracing.span('copy', container=name, direction='in'):
+                    for path, local_dir in job['upload'].items():
+                        container.put_archive(path, tar_directory(local_dir))
+            
+            # A failure may have happened while the container was created
+            if fail_fast is not None and not fail_fast.start(name, container):
+                log(f"{Colors.YELLOW} - Skipping {name}, an earlier {action.lower()} failed{Colors.RESET}")
+                container.remove(force=True)
+                return None
+            
+            with tracing.span('container.run', container=name):
+                container.start()
+            
+            with tracing.span('container.wait', container=name) as wait_span:
+                # Hand the output to the job while the container runs, the stream ends when it exits
+                if 'on_log' in job:
+                    for chunk in container.logs(stream=True, follow=True):
+                        job['on_log'](chunk)
+                exit_code = events.wait(name, container) if events is not None else container.wait()['StatusCode']
+                wait_span.set_attribute('exit_code', exit_code)
+            
+            span.set_attribute('exit_code', exit_code)
+            
+            if fail_fast is not None:
+                if fail_fast.finish(name):
+                    span.set_error("stopped")
+                    log(f"{Colors.YELLOW} - {action} of {name} stopped after an earlier failure, removing container{Colors.RESET}")
+                    container.remove(force=True)
+                    return None
+                if exit_code != 0:
+                    fail_fast.fail(name)
+            
+            # Bring the outputs back next to the sources
+            if exit_code == 0 and 'download' in job:
+                from .container_backend import untar_directory
+                with tracing.span('copy', container=name, direction='out'):
+                    for path, local_dir in job['download'].items():
+                        shutil.rmtree(local_dir, ignore_errors=True)
+                        chunks, _ = container.get_archive(path)
+                        untar_directory(chunks, local_dir)
+            
+            # Let the job inspect the container (e.g. its logs) before it is removed
+            if 'on_exit' in job:
+                job['on_exit'](container, exit_code)
+            
+            if exit_code == 0:
+                log(f"{Colors.GREEN} - {action} successful for {name}, removing container{Colors.RESET}")
+                container.remove()
+            else:
+                span.set_error(f"exit code {exit_code}")
+                log(f"{Colors.RED} - {action} failed for {name} (exit code: {exit_code}), keeping container for debugging{Colors.RESET}")
+            
+            return exit_code
\ No newline at end of file
@@ -0,0 +1,322 @@
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import threading
+import contextlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import src.tracing as tracing
+from .colors import Colors
+
+# `pelato serve`: one Pelato kept alive (docker client, compiled templates, build workers,
+# wadm connection) running the jobs posted to a localhost HTTP API one at a time
+
+JOB_COMMANDS = ['gen', 'build', 'deploy', 'remove', 'brush']
+JOB_STATES = ['queued', 'running', 'succeeded', 'failed', 'cancelled']
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_FINISHED_JOBS = 200
+
+class Job:
+
+    def __init__(self, command, project_dir):
+
+        self.id = uuid.uuid4().hex[:12]
+        self.command = command
+        self.project_dir = project_dir
+        self.status = 'queued'
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.output = []
+        self.condition = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in ('succeeded', 'failed', 'cancelled')
+
+    def write(self, text):
+        with self.condition:
+            self.output.append(text)
+            self.condition.notify_all()
+
+    def set_status(self, status, error=None):
+
+        with self.condition:
+            self.status = status
+            self.error = error
+            if status == 'running':
+                self.started_at = time.time()
+            elif self.done:
+                self.finished_at = time.time()
+            self.condition.notify_all()
+
+    def follow(self, start=0):
+
+        # Output chunks from start on, as they are written, until the job is done
+        while True:
+            with self.condition:
+                while start >= len(self.output) and not self.done:
+                    self.condition.wait()
+                chunks = self.output[start:]
+                done = self.done
+            start += len(chunks)
+            yield from chunks
+            if done and not chunks:
+                return
+
+    def to_dict(self, output=False):
+
+        job = {
+            'id': self.id,
+            'command': self.command,
+            'project': self.project_dir,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+        if output:
+            job['output'] = ''.join(self.output)
+        return job
+
+
+class JobOutput(io.TextIOBase):
+
+    # stdout while a job runs: the server console and the job output
+    def __init__(self, job, stream):
+        self.job = job
+        self.stream = stream
+
+    def write(self, text):
+        self.stream.write(text)
+        self.job.write(text)
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class PelatoServer:
+
+    def __init__(self, pelato, host=DEFAULT_HOST, port=DEFAULT_PORT):
+
+        self.pelato = pelato
+        self.host = host
+        self.port = port
+        self.metrics_enabled = pelato.metrics_enabled
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.running = None
+        self.httpd = None
+
+    def submit(self, command, project_dir):
+
+        if command not in JOB_COMMANDS:
+            raise ValueError(f"Unknown command {command}, expected one of {', '.join(JOB_COMMANDS)}")
+        if not project_dir or not os.path.isdir(project_dir):
+            raise ValueError(f"Project directory {project_dir} does not exist")
+
+        job = Job(command, os.path.abspath(project_dir))
+        with self.lock:
+            self.jobs[job.id] = job
+            self.__forget_finished()
+        self.queue.put(job)
+        # Not in the output of the job running meanwhile
+        print(f"{Colors.BLUE}📥 Job {job.id} queued: {command} {job.project_dir}{Colors.RESET}", file=sys.__stdout__, flush=True)
+        return job
+
+    def __forget_finished(self):
+
+        # Keep the history bounded, the oldest finished jobs go first
+        finished = [job for job in self.jobs.values() if job.done]
+        for job in sorted(finished, key=lambda j: j.finished_at)[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job.id]
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return sorted(self.jobs.values(), key=lambda job: job.created_at)
+
+    def cancel(self, job_id):
+
+        # Only queued jobs, a running stage is not interrupted
+        job = self.get(job_id)
+        if job is None or job.status != 'queued':
+            return False
+        job.set_status('cancelled')
+        return True
+
+    def __stage(self, job):
+
+        pelato = self.pelato
+        return {
+            'gen': pelato.generate,
+            'build': pelato.build,
+            'deploy': pelato.deploy,
+            'remove': pelato.remove,
+            'brush': pelato.all
+        }[job.command]
+
+    def run_job(self, job):
+
+        # Same steps as pelato.py for one command, on the warm Pelato
+        pelato = self.pelato
+        pelato.metrics_enabled = self.metrics_enabled
+        pelato.metrics = {}
+        start_time = time.time()
+
+        if pelato.tracing_enabled:
+            tracer = tracing.configure(pelato.trace_file or f"{job.project_dir}/traces.jsonl",
+                                       {'pelato.command': job.command, 'pelato.project': job.project_dir, 'pelato.job': job.id})
+            tracer.start_root(f"pelato {job.command}")
+
+        job.set_status('running')
+        self.running = job
+        try:
+            with contextlib.redirect_stdout(JobOutput(job, sys.__stdout__)):
+                # The stages log their failures and return False
+                ok = self.__stage(job)(job.project_dir)
+                if pelato.metrics_enabled:
+                    pelato.metrics['time_total'] = '%.3f' % (time.time() - start_time)
+                    pelato.save_metrics(job.project_dir, job.command, start_time)
+            if not ok:
+                job.set_status('failed', f"{job.command} failed, see the job output")
+            else:
+                job.set_status('succeeded')
+        except Exception as e:
+            job.write(f"Unexpected error: {e}\n")
+            job.set_status('failed', str(e))
+        finally:
+            self.running = None
+            tracing.get_tracer().export()
+
+        color = Colors.GREEN if job.status == 'succeeded' else Colors.RED
+        print(f"{color}📤 Job {job.id} {job.status} in {job.finished_at - job.started_at:.3f}s{Colors.RESET}")
+
+    def __work(self):
+
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            if job.status == 'queued':
+                self.run_job(job)
+
+    def serve_forever(self):
+
+        # One container backend for every job, connected once
+        try:
+            self.pelato.get_backend().client
+        except Exception as e:
+            print(f"{Colors.YELLOW}Docker is not reachable ({e}), only gen jobs will work{Colors.RESET}")
+
+        worker = threading.Thread(target=self.__work, name="pelato-jobs", daemon=True)
+        worker.start()
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), handler(self))
+        self.httpd.daemon_threads = True
+        print(f"{Colors.GREEN}🛰️  PELATO serving on http://{self.host}:{self.port}{Colors.RESET}")
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.queue.put(None)
+            self.httpd.server_close()
+
+    def shutdown(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+
+
+def handler(server):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            sys.stderr.write(f"{self.address_string()} - {format % args}\n")
+
+        def send_json(self, code, body):
+
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_log(self, job):
+
+            # Chunked text/plain, one chunk per output write, until the job is done
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            try:
+                for text in job.follow():
+                    data = text.encode()
+                    if data:
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                        self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def route(self):
+            parts = [part for part in self.path.split('?')[0].split('/') if part]
+            job = server.get(parts[1]) if len(parts) > 1 and parts[0] == 'jobs' else None
+            return parts, job
+
+        def do_GET(self):
+
+            parts, job = self.route()
+            if parts == ['health']:
+                self.send_json(200, {'status': 'ok', 'queued': server.queue.qsize(),
+                                     'running': server.running.id if server.running else None})
+            elif parts == ['jobs']:
+                self.send_json(200, [job.to_dict() for job in server.list()])
+            elif job is None:
+                self.send_json(404, {'error': 'not found'})
+            elif len(parts) == 2:
+                self.send_json(200, job.to_dict(output=True))
+            elif len(parts) == 3 and parts[2] == 'log':
+                self.send_log(job)
+            else:
+                self.send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+
+            parts, _ = self.route()
+            if parts != ['jobs']:
+                self.send_json(404, {'error': 'not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                job = server.submit(body.get('command'), body.get('project'))
+            except (ValueError, AttributeError) as e:
+                self.send_json(400, {'error': str(e)})
+                return
+            self.send_json(202, job.to_dict())
+
+        def do_DELETE(self):
+
+            parts, job = self.route()
+            if job is None or len(parts) != 2:
+                self.send_json(404, {'error': 'not found'})
+            elif server.cancel(job.id):
+                self.send_json(200, job.to_dict())
+            else:
+                self.send_json(409, {'error': f"job is {job.status}"})
+
+    return Handler
\ No newline at end of file
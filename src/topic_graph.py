@@ -0,0 +1,142 @@
+from .scheduler import log
+from .colors import Colors
+
+# Dataflow between the components, from the source_topic / dest_topic of the tasks.
+# Stored in <project>/.pelato next to the other generation state
+TOPIC_GRAPH = "topic_graph.json"
+
+def __topics(value):
+
+    # A topic, a comma separated list of topics or a yaml list
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return sorted({str(topic).strip() for topic in value if str(topic).strip()})
+
+def build_graph(tasks):
+
+    # Edge producer -> consumer when the producer writes a topic the consumer reads
+    components = {}
+    for task in tasks:
+        components[task['component_name']] = {
+            'source_topics': __topics(task.get('source_topic')),
+            'dest_topics': __topics(task.get('dest_topic'))
+        }
+
+    readers = {}
+    for name, component in components.items():
+        for topic in component['source_topics']:
+            readers.setdefault(topic, []).append(name)
+
+    edges = {}
+    for name, component in components.items():
+        edges[name] = sorted({reader for topic in component['dest_topics'] for reader in readers.get(topic, []) if reader != name})
+
+    return {'components': components, 'edges': edges}
+
+def __cycles(edges, names):
+
+    # Strongly connected components of the subgraph of names (Tarjan, without recursion)
+    index, low, stack, on_stack, result = {}, {}, [], set(), []
+
+    def visit(node, work):
+        index[node] = low[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+        work.append((node, iter([c for c in edges.get(node, []) if c in names])))
+
+    for root in sorted(names):
+        if root in index:
+            continue
+        work = []
+        visit(root, work)
+        while work:
+            node, consumers = work[-1]
+            consumer = next(consumers, None)
+            if consumer is not None:
+                if consumer not in index:
+                    visit(consumer, work)
+                elif consumer in on_stack:
+                    low[node] = min(low[node], index[consumer])
+                continue
+
+            work.pop()
+            if work:
+                low[work[-1][0]] = min(low[work[-1][0]], low[node])
+            if low[node] == index[node]:
+                component = []
+                while not component or component[-1] != node:
+                    component.append(stack.pop())
+                    on_stack.discard(component[-1])
+                result.append(sorted(component))
+    return result
+
+def levels(graph):
+
+    # Kahn's algorithm: the first level holds the components nobody feeds, every next
+    # level is fed only by the previous ones. When only cycles are left, the cycles no
+    # other remaining component feeds make a level of their own and the rest goes on
+    edges = graph['edges']
+    indegree = {name: 0 for name in edges}
+    for consumers in edges.values():
+        for consumer in consumers:
+            indegree[consumer] = indegree.get(consumer, 0) + 1
+
+    result = []
+    remaining = set(indegree)
+    level = sorted(name for name, degree in indegree.items() if degree == 0)
+    while remaining:
+        if not level:
+            cycles = __cycles(edges, remaining)
+            member_of = {name: i for i, cycle in enumerate(cycles) for name in cycle}
+            fed = {member_of[consumer] for name in remaining for consumer in edges.get(name, [])
+                   if consumer in remaining and member_of[consumer] != member_of[name]}
+            for i, cycle in enumerate(cycles):
+                if i not in fed:
+                    log(f"{Colors.YELLOW} - Topic cycle between {', '.join(cycle)}, no order among them{Colors.RESET}")
+                    level.extend(cycle)
+            level.sort()
+
+        result.append(level)
+        remaining.difference_update(level)
+        next_level = set()
+        for name in level:
+            for consumer in edges.get(name, []):
+                indegree[consumer] -= 1
+                if indegree[consumer] == 0 and consumer in remaining:
+                    next_level.add(consumer)
+        level = sorted(next_level)
+
+    return result
+
+def deploy_order(graph):
+
+    # Consumers first, so producers never publish to a topic nobody listens to yet
+    return list(reversed(levels(graph)))
+
+def remove_order(graph):
+
+    # Producers first, so consumers can drain what is still in flight
+    return levels(graph)
+
+def deploy_dependencies(graph):
+
+    # {component: consumers to deploy before it}, cycles do not wait on each other
+    dependencies = {}
+    earlier = set()
+    for level in deploy_order(graph):
+        for name in level:
+            dependencies[name] = set(graph['edges'].get(name, [])) & earlier
+        earlier.update(level)
+    return dependencies
+
+def group_entries(entries, order):
+
+    # Split planned entries by level, the ones outside the graph go first
+    position = {name: i for i, level in enumerate(order) for name in level}
+    groups = [[] for _ in range(len(order) + 1)]
+    for entry in entries:
+        i = position.get(entry['task'])
+        groups[0 if i is None else i + 1].append(entry)
+    return [group for group in groups if group]
\ No newline at end of file
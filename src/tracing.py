@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Spans for every component and phase, exported as OTLP/JSON (one ExportTraceServiceRequest
+# per line, the format of the OpenTelemetry collector file exporter and otlpjsonfile receiver)
+
+SERVICE_NAME = "pelato"
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+def __attribute_value(value):
+
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+def otlp_attributes(attributes):
+    return [{'key': key, 'value': __attribute_value(value)} for key, value in attributes.items() if value is not None]
+
+def new_id(size):
+    return os.urandom(size).hex()
+
+
+class Span:
+
+    def __init__(self, tracer, name, parent=None, attributes=None, start_time=None):
+
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = tracer.trace_id
+        self.span_id = new_id(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = dict(attributes or {})
+        self.start_time = start_time if start_time is not None else time.time()
+        self.end_time = None
+        self.status = STATUS_UNSET
+        self.message = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, message):
+        self.status = STATUS_ERROR
+        self.message = str(message)
+
+    def end(self, end_time=None):
+
+        if self.end_time is None:
+            self.end_time = end_time if end_time is not None else time.time()
+            self.tracer.record(self)
+
+    @property
+    def duration(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    def to_otlp(self):
+
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,
+            'startTimeUnixNano': str(int(self.start_time * 1e9)),
+            'endTimeUnixNano': str(int(self.end_time * 1e9)),
+            'attributes': otlp_attributes(self.attributes),
+            'status': {'code': self.status}
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.message:
+            span['status']['message'] = self.message
+        return span
+
+
+class Tracer:
+
+    # Thread-safe: spans opened in a thread are parented to the innermost span open in the
+    # same thread, or to an explicit parent (e.g. the stage span of a thread pool)
+
+    def __init__(self, path=None, enabled=True, attributes=None):
+
+        self.path = path
+        self.enabled = enabled
+        self.attributes = attributes or {}
+        self.trace_id = new_id(16)
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.root = None
+
+    def __stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def current_span(self):
+        stack = self.__stack()
+        return stack[-1] if stack else self.root
+
+    def start_span(self, name, parent=None, start_time=None, **attributes):
+        return Span(self, name, parent if parent is not None else self.current_span(), attributes, start_time)
+
+    @contextmanager
+    def span(self, name, parent=None, **attributes):
+
+        if not self.enabled:
+            yield DISABLED_SPAN
+            return
+
+        span = self.start_span(name, parent, **attributes)
+        stack = self.__stack()
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_error(e)
+            raise
+        finally:
+            stack.remove(span)
+            span.end()
+
+    def start_root(self, name, **attributes):
+
+        # Span of the whole run, parent of the spans opened in threads with nothing open
+        if self.enabled:
+            self.root = Span(self, name, None, attributes)
+        return self.root
+
+    def record(self, span):
+        if self.enabled:
+            with self.lock:
+                self.spans.append(span)
+
+    def export(self):
+
+        # Append the finished spans to the JSONL file, as one OTLP request
+        if not self.enabled or not self.path:
+            return
+
+        if self.root is not None:
+            self.root.end()
+
+        with self.lock:
+            spans, self.spans = self.spans, []
+        if not spans:
+            return
+
+        request = {'resourceSpans': [{
+            'resource': {'attributes': otlp_attributes({'service.name': SERVICE_NAME, **self.attributes})},
+            'scopeSpans': [{
+                'scope': {'name': 'pelato'},
+                'spans': [span.to_otlp() for span in sorted(spans, key=lambda s: s.start_time)]
+            }]
+        }]}
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(request) + '\n')
+
+
+class DisabledSpan:
+
+    span_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, message):
+        pass
+
+    def end(self, end_time=None):
+        pass
+
+
+DISABLED_SPAN = DisabledSpan()
+
+# Global tracer, disabled until configured (ENABLE_TRACING=True)
+__tracer = Tracer(enabled=False)
+
+def configure(path, attributes=None):
+
+    global __tracer
+    __tracer = Tracer(path, True, attributes)
+    return __tracer
+
+def get_tracer():
+    return __tracer
+
+def span(name, parent=None, **attributes):
+    return get_tracer().span(name, parent, **attributes)
+
+def current_span():
+    return get_tracer().current_span()
\ No newline at end of file
@@ -1,30 +1,184 @@
-import yaml
 import os
-from .colors import Colors
+import json
+import hashlib
+import filecmp
+import shutil
+import fcntl
 
-def dump_metrics(metrics, project_dir):
+def get_available_templates():
+
+    ## Read all directories found inside code_generator/templates and return the names as a list
+    templates_dir = "src/code_generator/templates"
+    return [name for name in os.listdir(templates_dir) if os.path.isdir(os.path.join(templates_dir, name))]
+
+## Project state (manifests, caches) lives in <project>/.pelato, outside gen/
+
+STATE_DIR = ".pelato"
+
+def state_path(project_dir, name):
+    return os.path.join(project_dir, STATE_DIR, name)
+
+def load_state(project_dir, name, default=None):
+    
+    path = state_path(project_dir, name)
+    if not os.path.exists(path):
+        return default
     
-    with open(f"{project_dir}/metrics.yaml", 'w') as file:
-        yaml.dump(metrics, file)
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        # A corrupted state file is treated as missing
+        return default
+
+def dump_state(project_dir, name, data):
     
-    print(f"{Colors.BLUE}📊 Metrics saved in {project_dir}/metrics.yaml{Colors.RESET}")
+    path = state_path(project_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
     
-    return
+    # Write to a temporary file and rename it, so readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(data, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+## YAML helpers
 
-def load_metrics(project_dir):
+def load_yaml(stream):
     
-    if not os.path.exists(f"{project_dir}/metrics.yaml"):
-        return {
-            "runs": []
-        }
+    # libyaml's C loader when PyYAML was built with it, several times faster than the
+    # pure Python one. yaml is imported here, --help doesn't need it
+    import yaml
+    return yaml.load(stream, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+## Hashing helpers
+
+def hash_bytes(*chunks):
     
-    with open(f"{project_dir}/metrics.yaml", 'r') as file:
-        metrics = yaml.safe_load(file)
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        digest.update(chunk)
+        # Separator, so that ("ab", "c") and ("a", "bc") hash differently
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def hash_file(path):
     
-    return metrics
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-def get_available_templates():
+def hash_directory(path, exclude=()):
+    
+    # Hash relative paths and contents of every file, in a stable order
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if os.path.relpath(os.path.join(root, d), path) not in exclude)
+        for filename in sorted(files):
+            rel_path = os.path.relpath(os.path.join(root, filename), path)
+            if rel_path in exclude:
+                continue
+            digest.update(rel_path.encode() + b'\0')
+            digest.update(hash_file(os.path.join(root, filename)).encode())
+    return digest.hexdigest()
 
-    ## Read all directories found inside code_generator/templates and return the names as a list
-    templates_dir = "src/code_generator/templates"
-    return [name for name in os.listdir(templates_dir) if os.path.isdir(os.path.join(templates_dir, name))]
\ No newline at end of file
+def dir_size(path):
+    
+    size = 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            try:
+                size += os.lstat(os.path.join(root, filename)).st_size
+            except OSError:
+                pass
+    return size
+
+
+## File helpers
+
+def write_if_changed(path, content):
+    
+    # Leave the file (and its mtime) untouched if the content is the same
+    if isinstance(content, str):
+        content = content.encode()
+    
+    if os.path.isfile(path):
+        with open(path, 'rb') as file:
+            if file.read() == content:
+                return False
+    
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    
+    # Replace atomically instead of writing in place
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+    return True
+
+def copy_if_changed(src, dst):
+    
+    if os.path.isfile(dst) and filecmp.cmp(src, dst, shallow=False):
+        return False
+    
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    tmp_path = f"{dst}.{os.getpid()}.tmp"
+    shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+    return True
+
+
+## File materialization: share the file with the source when the filesystem allows it
+
+MATERIALIZE_MODES = ['copy', 'hardlink', 'reflink', 'auto']
+
+# Linux ioctl that clones a file with copy-on-write (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# (method, source device, destination device) pairs that already failed once
+__unsupported = set()
+
+def __reflink(src, dst):
+    
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+
+def materialize_file(src, dst, mode='copy'):
+    
+    if mode == 'copy':
+        return copy_if_changed(src, dst)
+    
+    if os.path.isfile(dst) and (os.path.samefile(src, dst) or filecmp.cmp(src, dst, shallow=False)):
+        return False
+    
+    dst_dir = os.path.dirname(dst) or '.'
+    os.makedirs(dst_dir, exist_ok=True)
+    devices = (os.stat(src).st_dev, os.stat(dst_dir).st_dev)
+    
+    methods = {'hardlink': ['hardlink'], 'reflink': ['reflink'], 'auto': ['reflink', 'hardlink']}[mode]
+    tmp_path = f"{dst}.{os.getpid()}.tmp"
+    
+    for method in methods:
+        if (method, *devices) in __unsupported:
+            continue
+        try:
+            if method == 'hardlink':
+                os.link(src, tmp_path)
+            else:
+                __reflink(src, tmp_path)
+            os.replace(tmp_path, dst)
+            return True
+        except OSError:
+            # Don't try again this method between the same filesystems
+            __unsupported.add((method, *devices))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    # Fall back to a plain copy
+    return copy_if_changed(src, dst)
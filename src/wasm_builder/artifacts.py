@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import shutil
+import threading
+import src.utils as ut
+from .cache import format_size
+from ..colors import Colors
+
+# Content-addressed store of the built wasm modules, keyed by the build image and the
+# sources they were built from with the component name factored out. Components compiling the same code (same
+# template and task code, different wadm config) are built once and pushed under each tag
+
+ARTIFACT_FILE = "component.wasm"
+ARTIFACT_INFO = "artifact.json"
+PUSHED_FILE = "pushed.json"
+
+# Files holding the component name, not the code
+NAMED_FILES = ('build', 'wadm.yaml', 'wasmcloud.toml')
+
+def source_key(task_dir, component, image):
+
+    # Sources hash, the same for two components differing only in name and wadm config.
+    # image is the build image id: a new toolchain builds a different module
+    try:
+        with open(os.path.join(task_dir, 'wasmcloud.toml'), 'r') as file:
+            lines = [line for line in file.read().splitlines() if not line.startswith('name =')]
+    except OSError:
+        lines = []
+    toml = '\n'.join(lines).replace(component, '{component}')
+    return ut.hash_bytes(image, ut.hash_directory(task_dir, exclude=NAMED_FILES), toml)
+
+def wasm_digest(path):
+    # Digest of the layer wash push uploads, the module itself
+    return f"sha256:{ut.hash_file(path)}"
+
+def registry_digests(oci_url, user=None, password=None, timeout=5):
+
+    # Layer digests of the manifest the registry holds for oci_url: empty if the tag is
+    # missing, None if the registry can't be asked
+    import base64
+    import urllib.request
+    import urllib.error
+
+    host, _, rest = oci_url.partition('/')
+    repository, _, tag = rest.rpartition(':')
+    if not repository or '/' in tag or ('.' not in host and ':' not in host and host != 'localhost'):
+        return None
+
+    scheme = 'http' if host.split(':')[0] in ('localhost', '127.0.0.1') else 'https'
+    url = f"{scheme}://{host}/v2/{repository}/manifests/{tag}"
+    accept = 'application/vnd.oci.image.manifest.v1+json, application/vnd.docker.distribution.manifest.v2+json'
+    basic = 'Basic ' + base64.b64encode(f"{user}:{password}".encode()).decode() if user else None
+
+    def get(url, authorization=None, headers=None):
+        request = urllib.request.Request(url, headers=dict(headers or {}))
+        if authorization:
+            request.add_header('Authorization', authorization)
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.load(response)
+
+    try:
+        try:
+            manifest = get(url, basic, {'Accept': accept})
+        except urllib.error.HTTPError as e:
+            challenge = e.headers.get('WWW-Authenticate', '')
+            if e.code != 401 or not challenge.startswith('Bearer '):
+                raise
+
+            # Token auth: ask the realm for a pull token, then retry
+            params = dict(part.split('=', 1) for part in challenge[len('Bearer '):].replace('"', '').split(','))
+            realm = params.pop('realm')
+            query = '&'.join(f"{key}={value}" for key, value in params.items())
+            token = get(f"{realm}?{query}", basic)
+            manifest = get(url, f"Bearer {token.get('token') or token.get('access_token')}", {'Accept': accept})
+    except urllib.error.HTTPError as e:
+        return set() if e.code == 404 else None
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return {layer['digest'] for layer in manifest.get('layers', [])}
+
+
+class ArtifactStore:
+
+    def __init__(self, store_dir, registry_check=True):
+
+        self.store_dir = os.path.abspath(os.path.expanduser(store_dir))
+        self.registry_check = registry_check
+        self.lock = threading.Lock()
+
+    def __dir(self, key):
+        return os.path.join(self.store_dir, key[:2], key)
+
+    def get(self, key):
+
+        # Path of the module built from these sources, None if it was never built
+        path = os.path.join(self.__dir(key), ARTIFACT_FILE)
+        return path if os.path.isfile(path) else None
+
+    def digest(self, key):
+
+        try:
+            with open(os.path.join(self.__dir(key), ARTIFACT_INFO), 'r') as file:
+                return json.load(file)['digest']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, keys, wasm):
+
+        # Store the module under every key (the build rewrites some sources, e.g. go.sum,
+        # so the sources after the build identify it as well). Returns its digest
+        digest = wasm_digest(wasm)
+        info = {'digest': digest, 'size': os.path.getsize(wasm), 'created_at': time.time()}
+        for key in dict.fromkeys(keys):
+            directory = self.__dir(key)
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = os.path.join(directory, f"{ARTIFACT_FILE}.{os.getpid()}.{threading.get_ident()}.tmp")
+            shutil.copyfile(wasm, tmp_path)
+            os.replace(tmp_path, os.path.join(directory, ARTIFACT_FILE))
+            with open(os.path.join(directory, ARTIFACT_INFO), 'w') as file:
+                json.dump(info, file)
+        return digest
+
+    def restore(self, key, path):
+
+        # Copy the module to the build/ folder of a component that was not built
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(self.get(key), path)
+
+    def __pushed(self):
+
+        try:
+            with open(os.path.join(self.store_dir, PUSHED_FILE), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def record_push(self, oci_url, digest):
+
+        with self.lock:
+            pushed = self.__pushed()
+            pushed[oci_url] = digest
+            os.makedirs(self.store_dir, exist_ok=True)
+            path = os.path.join(self.store_dir, PUSHED_FILE)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as file:
+                json.dump(pushed, file, indent=2, sort_keys=True)
+            os.replace(tmp_path, path)
+
+    def is_pushed(self, oci_url, digest, user=None, password=None):
+
+        # Ask the registry, and when it can't be reached trust the pushes made from here
+        if self.registry_check:
+            digests = registry_digests(oci_url, user, password)
+            if digests is not None:
+                return digest in digests
+        return self.__pushed().get(oci_url) == digest
+
+    def info(self):
+
+        size, count = 0, 0
+        if os.path.isdir(self.store_dir):
+            size = ut.dir_size(self.store_dir)
+            count = sum(1 for _, _, files in os.walk(self.store_dir) if ARTIFACT_FILE in files)
+        print(f"{Colors.BLUE}Artifact store{Colors.RESET}")
+        print(f"   {Colors.CYAN}• {count} modules{Colors.RESET} {format_size(size):>12}  {self.store_dir}")
+
+    def prune(self):
+
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+        print(f"{Colors.GREEN} - Removed the artifact store {self.store_dir}{Colors.RESET}")
\ No newline at end of file
@@ -1,129 +1,464 @@
-import docker
 import os
+import math
 import logging
 import yaml
 import time
+import io
+import tarfile
+from datetime import datetime, timezone
+import src.utils as ut
+import src.code_generator.template_registry as template_registry
+import src.tracing as tracing
+import src.project_plan as project_plan
+from ..scheduler import log
+from ..container_backend import DockerBackend
+from .build_log import BuildLog
+from . import artifacts as artifacts_store
 from ..colors import Colors
 
-def build_project(project_dir, reg_user, reg_pass, detached, metrics, metrics_enabled):
+BUILD_MANIFEST = "build_manifest.json"
+DOCKER_DIR = "src/wasm_builder/docker"
+BUILD_IMAGE = "wash-build-image:latest"
+DEPS_IMAGE = "wash-build-deps"
+
+def build_project(project_dir, reg_user, reg_pass, scheduler, metrics, metrics_enabled, incremental=False, cache=None, pool=None, prewarm=False, batch=False, only=None, backend=None, artifacts=None, dispatcher=None):
     
+    # Returns False if the project could not be built or a component failed
     build_metrics = {}
     start_time = 0
     
     # Check if the project directory is valid
     if not os.path.exists(f"{project_dir}/gen"):
         logging.error(f"{Colors.RED}Project directory is not valid{Colors.RESET}")
-        return
+        return False
     
     print(f'{Colors.BLUE}Building WASM components{Colors.RESET}')
     
     os.environ["DOCKER_CLIENT_TIMEOUT"] = "120"
     os.environ["DOCKER_TIMEOUT"] = "120"
     
-    # Docker client
-    client = docker.from_env()
+    # Docker client, shared with the other stages when given
+    backend = backend or DockerBackend()
+    client = backend.client
     
     if metrics_enabled:
         start_time = time.time()
     
-    # Build the images for the project if they don't exist
-    try:
-        client.images.get("wash-build-image:latest")
-    except docker.errors.ImageNotFound:
-        
-        print(f'{Colors.YELLOW} - Building wash-build-image from Dockerfile...{Colors.RESET}')
-        client.images.build(
-            path="src/wasm_builder/docker",
-            dockerfile="build.Dockerfile",
-            tag="wash-build-image:latest"
-        )
-        if metrics_enabled:
-            build_metrics['image_build_time'] = '%.3f'%(time.time() - start_time)
+    build_image = prepare_build_image(backend, prewarm, build_metrics if metrics_enabled else {})
+    
+    if pool is not None:
+        pool.image = build_image
         
+    manifest = ut.load_state(project_dir, BUILD_MANIFEST, {})
+    skipped = []
+    
     try:
-        wait_list = []
+        jobs = []
+        pending = {}
         
         for task in os.listdir(f"{project_dir}/gen"):
-            __build_wasm(f"{project_dir}/gen/{task}", client, reg_user, reg_pass, detached, wait_list)
             
-        if detached == 'True':
+            if only is not None and task not in only:
+                continue
             
-            print(f'{Colors.BLUE}Waiting for build to finish...{Colors.RESET}')
-            for container_name in wait_list:
-                try:
-                    container = client.containers.get(container_name)
-                    result = container.wait()
-                    exit_code = result['StatusCode']
-                    
-                    if exit_code == 0:
-                        print(f"{Colors.GREEN} - Build successful for {container_name}, removing container{Colors.RESET}")
-                        container.remove()
-                    else:
-                        print(f"{Colors.RED} - Build failed for {container_name} (exit code: {exit_code}), keeping container for debugging{Colors.RESET}")
-                        
-                except Exception as e:
-                    print(f"{Colors.YELLOW} - Error waiting for container {container_name}: {e}{Colors.RESET}")
-                    continue
+            job = plan_build(project_dir, task, manifest, incremental, reg_user, reg_pass, cache, build_image)
+            
+            if job is None:
+                skipped.append(task)
+            else:
+                jobs.append(job)
+                pending[job['name']] = job
+        
+        results = {}
+        
+        # One build per distinct source, the other components get a copy of its module
+        copies = []
+        if artifacts is not None:
+            # The build image is part of the key, modules built by an older toolchain are not reused
+            image = backend.image(build_image)
+            image_id = image.id if image is not None else build_image
+            jobs, copies = __deduplicate(jobs, artifacts, image_id)
+            if copies:
+                print(f"{Colors.CYAN} - {len(copies)} components reuse the module of identical sources, building {len(jobs)}{Colors.RESET}")
+        built = jobs
+        
+        # One container per template family, failing over to per-component builds
+        if batch and jobs and dispatcher is None:
+            results = __batch_build(client, scheduler, project_dir, jobs, cache, build_image, reg_user, reg_pass, build_metrics)
+            jobs = [job for job in jobs if results.get(job['name']) != 0]
+            if jobs:
+                print(f"{Colors.YELLOW} - Rebuilding {len(jobs)} components one by one{Colors.RESET}")
+        
+        # Long-lived workers if enabled, then the build endpoints, otherwise one container per component
+        if jobs and pool is not None:
+            results.update(pool.run(jobs, scheduler.fail_fast))
+        elif jobs and dispatcher is not None:
+            results.update(dispatcher.run(jobs, lambda endpoint: prepare_build_image(endpoint, prewarm, build_metrics if metrics_enabled else {})))
+        elif jobs:
+            results.update(scheduler.run(client, jobs, 'Build'))
+        
+        if artifacts is not None:
+            for job in built:
+                wasm = f"{job['source']}/build/{job['component']}.wasm"
+                if results.get(job['name']) == 0 and os.path.isfile(wasm):
+                    digest = artifacts.put([job['source_key'], artifacts_store.source_key(job['source'], job['component'], image_id)], wasm)
+                    artifacts.record_push(job['oci_url'], digest)
+            if copies:
+                results.update(__push_copies(client, scheduler, copies, artifacts, build_image, reg_user, reg_pass, build_metrics))
+        
+        for container_name, exit_code in results.items():
+            if exit_code == 0:
+                record_build(manifest, pending[container_name])
+        failed = [name for name in pending if results.get(name) != 0]
+        
+        # Phase durations and artifact size of the components built one by one
+        component_metrics = build_metrics.setdefault('components', {})
+        for job in jobs:
+            if job['build_log'].exit_code is not None:
+                component_metrics[job['task']] = job['build_log'].summary()
         
     except Exception as e:
         logging.error(f"{Colors.RED}Error building project: {e}{Colors.RESET}")
-        return
+        return False
+    
+    finally:
+        # Drop the components that are not generated anymore
+        for task in list(manifest):
+            if not os.path.isdir(f"{project_dir}/gen/{task}"):
+                del manifest[task]
+        ut.dump_state(project_dir, BUILD_MANIFEST, manifest)
+    
+    # Keep the caches under their size limit
+    if cache:
+        cache.limit(client)
     
     if metrics_enabled:
         build_metrics['components_build_time'] = '%.3f'%(time.time() - start_time)
+        build_metrics['skipped_components'] = len(skipped)
         metrics['build'] = build_metrics
-        
+    
+    if failed:
+        print(f"{Colors.RED}{len(failed)} components failed to build{Colors.RESET}")
+        return False
     print(f"{Colors.GREEN}Project built successfully{Colors.RESET}")
+    return True
+
+def prepare_build_image(backend, prewarm, build_metrics):
     
-def __build_wasm(task_dir, client, reg_user, reg_pass, detached, wait_list):
+    start_time = time.time()
     
-    wadm = __parse_yaml(f"{task_dir}/wadm.yaml")
+    # Build the images for the project if they don't exist, or if the build context changed
+    context_digest = ut.hash_directory(DOCKER_DIR, exclude=('deps.Dockerfile',))
+    image = backend.image(BUILD_IMAGE)
+    if image is None or image.labels.get('pelato.context') != context_digest:
+        
+        print(f'{Colors.YELLOW} - Building wash-build-image from Dockerfile...{Colors.RESET}')
+        with tracing.span('image.build', image=BUILD_IMAGE):
+            backend.build_image(
+                BUILD_IMAGE,
+                path=DOCKER_DIR,
+                dockerfile="build.Dockerfile",
+                labels={'pelato.context': context_digest}
+            )
+        build_metrics['image_build_time'] = '%.3f'%(time.time() - start_time)
     
-    path = os.path.abspath(task_dir)
+    # Image with the template dependencies already downloaded
+    if prewarm:
+        try:
+            return __ensure_deps_image(backend, context_digest, build_metrics)
+        except Exception as e:
+            print(f"{Colors.YELLOW} - Could not build the dependency layer, downloading dependencies at build time: {e}{Colors.RESET}")
     
-    oci_url = wadm['spec']['components'][0]['properties']['image']
-    name = wadm['spec']['components'][0]['name'] + '-build'
+    return BUILD_IMAGE
+
+def plan_build(project_dir, task, manifest, incremental, reg_user, reg_pass, cache, image):
+    
+    # Build job for the component, None if it is already built and pushed
+    task_dir = f"{project_dir}/gen/{task}"
+    digest = ut.hash_directory(task_dir, exclude=('build',))
+    oci_url = __get_image(task_dir)
     
-    # Check if container with the same name already exists and remove it
+    # Skip the components already built and pushed from the same sources
+    if incremental and __is_up_to_date(manifest.get(task), digest, oci_url):
+        print(f"{Colors.CYAN} - Skipping {task}, {oci_url} is up to date{Colors.RESET}")
+        return None
+    
+    job = __build_job(task_dir, reg_user, reg_pass, cache, image)
+    job['task'] = task
+    job['digest'] = digest
+    return job
+
+def __module_path(task_dir):
+    
+    # Components with the same go.mod module share (almost) the same dependency graph
     try:
-        existing_container = client.containers.get(name)
-        print(f"{Colors.YELLOW} - Removing existing container {name}{Colors.RESET}")
-        existing_container.remove(force=True)
-    except docker.errors.NotFound:
-        # Container doesn't exist, continue
+        with open(f"{task_dir}/go.mod", 'r') as file:
+            for line in file:
+                if line.startswith('module '):
+                    return line.split()[1]
+    except OSError:
         pass
-    except Exception as e:
-        print(f"{Colors.RED} - Warning: Could not remove existing container {name}: {e}{Colors.RESET}")
+    return task_dir
+
+def __batch_build(client, scheduler, project_dir, jobs, cache, image, reg_user, reg_pass, build_metrics):
+    
+    # Components sharing a go.mod module path can't live in the same go.work, so each
+    # family is built in one container sharing the warm Go caches, as many components at
+    # a time as the container has CPUs
+    families = {}
+    for job in jobs:
+        families.setdefault(__module_path(job['source']), []).append(job)
+    
+    cache_volumes, cache_environment = cache.mounts() if cache else ({}, [])
+    gen_dir = os.path.abspath(f"{project_dir}/gen")
+    results = {}
+    component_metrics = build_metrics.setdefault('components', {})
+    
+    def collect(family_jobs):
+        
+        by_dir = {os.path.basename(job['source']): job for job in family_jobs}
+        
+        def on_exit(container, exit_code):
+            
+            # Per-component result and timing from the markers printed by pelato-batch-build
+            for timestamp, line in log_lines(container):
+                if line.startswith('PELATO-BATCH-RESULT '):
+                    _, task, code, seconds = line.split()
+                    job = by_dir[task]
+                    results[job['name']] = int(code)
+                    component_metrics[task] = {'mode': 'batch', 'exit_code': int(code), 'time': '%.3f' % float(seconds)}
+                    
+                    span = tracing.get_tracer().start_span('build.component', start_time=timestamp - float(seconds),
+                                                           component=job['component'], mode='batch', exit_code=int(code))
+                    if code != '0':
+                        span.set_error(f"exit code {code}")
+                    span.end(timestamp)
+                    if code == '0':
+                        log(f"{Colors.GREEN} - Batch build successful for {task} ({float(seconds):.1f}s){Colors.RESET}")
+                    else:
+                        log(f"{Colors.RED} - Batch build failed for {task} (exit code: {code}){Colors.RESET}")
+        
+        return on_exit
+    
+    # With a CPU limit nproc still sees every CPU of the host
+    if scheduler.cpus:
+        cache_environment = cache_environment + [f'PELATO_BATCH_JOBS={max(1, math.ceil(scheduler.cpus))}']
+    
+    batch_jobs = []
+    for i, (module, family_jobs) in enumerate(families.items()):
+        
+        batch = '\n'.join(f"{os.path.basename(job['source'])}|{job['component']}|{job['oci_url']}" for job in family_jobs)
+        batch_jobs.append({
+            'name': f"{os.path.basename(os.path.abspath(project_dir))}-batch-{i}-build",
+            'image': image,
+            'command': ["pelato-batch-build"],
+            'environment': [f'PELATO_BATCH={batch}',
+                            f'WASH_REG_USER={reg_user}',
+                            f'WASH_REG_PASSWORD={reg_pass}',
+                            f'HOST_UID={os.getuid()}',
+                            f'HOST_GID={os.getgid()}'] + cache_environment,
+            'volumes': {gen_dir: {'bind': '/gen', 'mode': 'rw'}, **cache_volumes},
+            'message': f"Building {len(family_jobs)} components of {module} in one container",
+            'on_exit': collect(family_jobs)
+        })
+    
+    scheduler.run(client, batch_jobs, 'Batch build')
+    return results
+
+def __deduplicate(jobs, artifacts, image_id):
+    
+    # Jobs to run: the first component of every source not in the store yet.
+    # The others are copies, served from the store once their source is built
+    groups = {}
+    for job in jobs:
+        job['source_key'] = artifacts_store.source_key(job['source'], job['component'], image_id)
+        groups.setdefault(job['source_key'], []).append(job)
+    
+    builds = []
+    copies = []
+    for key, group in groups.items():
+        if artifacts.get(key) is None:
+            builds.append(group[0])
+            copies.extend(group[1:])
+        else:
+            copies.extend(group)
+    return builds, copies
+
+def __push_copies(client, scheduler, jobs, artifacts, image, reg_user, reg_pass, build_metrics):
+    
+    # Copy the stored module to build/ of every component, and push it under the tags
+    # the registry doesn't hold it for yet: one container per module for all its tags
+    results = {}
+    pushes = {}
+    skipped = 0
+    for job in jobs:
+        key = job['source_key']
+        if artifacts.get(key) is None:
+            log(f"{Colors.RED} - No module for {job['component']}, the build of its sources failed{Colors.RESET}")
+            results[job['name']] = None
+            continue
+        
+        artifacts.restore(key, f"{job['source']}/build/{job['component']}.wasm")
+        if artifacts.is_pushed(job['oci_url'], artifacts.digest(key), reg_user, reg_pass):
+            log(f"{Colors.CYAN} - {job['oci_url']} already holds the module of {job['component']}, not pushing{Colors.RESET}")
+            results[job['name']] = 0
+            skipped += 1
+        else:
+            pushes.setdefault(key, []).append(job)
+    
+    push_jobs = {}
+    for key, key_jobs in pushes.items():
+        tags = [job['oci_url'] for job in key_jobs]
+        push_job = {
+            'name': f"{key_jobs[0]['component']}-push",
+            'image': image,
+            'command': ["pelato-push"],
+            'environment': ['PELATO_PUSH=' + '\n'.join(tags),
+                            f'WASH_REG_USER={reg_user}',
+                            f'WASH_REG_PASSWORD={reg_pass}'],
+            'volumes': {os.path.dirname(artifacts.get(key)): {'bind': '/artifact', 'mode': 'ro'}},
+            'component': key_jobs[0]['component'],
+            'message': f"Pushing one module as {', '.join(tags)}"
+        }
+        push_jobs[push_job['name']] = (push_job, key, key_jobs)
+    
+    if push_jobs:
+        exit_codes = scheduler.run(client, [job for job, _, _ in push_jobs.values()], 'Push')
+        for name, (_, key, key_jobs) in push_jobs.items():
+            for job in key_jobs:
+                results[job['name']] = exit_codes.get(name)
+                if exit_codes.get(name) == 0:
+                    artifacts.record_push(job['oci_url'], artifacts.digest(key))
+    
+    build_metrics['deduplicated_components'] = len(jobs)
+    build_metrics['skipped_pushes'] = skipped
+    return results
+
+def __ensure_deps_image(backend, context_digest, build_metrics):
+    
+    # The tag depends on the template module files (and on the base image), so the
+    # layer is rebuilt only when the template dependencies change
+    templates = template_registry.get_registry().templates
+    modules = {
+        name: [os.path.join(template.path, f) for f in ['go.mod', 'go.sum'] if os.path.isfile(os.path.join(template.path, f))]
+        for name, template in templates.items()
+    }
+    digest = ut.hash_bytes(
+        context_digest,
+        ut.hash_file(f"{DOCKER_DIR}/deps.Dockerfile"),
+        *[f"{name}/{os.path.basename(f)}:{ut.hash_file(f)}" for name in sorted(modules) for f in modules[name]]
+    )
+    tag = f"{DEPS_IMAGE}:{digest[:16]}"
+    
+    if backend.image(tag) is not None:
+        return tag
+    
+    print(f'{Colors.YELLOW} - Building dependency layer {tag}...{Colors.RESET}')
+    start_time = time.time()
+    
+    # Build context: the Dockerfile and the module files of every template
+    context = io.BytesIO()
+    with tarfile.open(fileobj=context, mode='w') as tar:
+        tar.add(f"{DOCKER_DIR}/deps.Dockerfile", arcname="Dockerfile")
+        for name, files in modules.items():
+            for f in files:
+                tar.add(f, arcname=f"modules/{name}/{os.path.basename(f)}")
+    context.seek(0)
+    
+    with tracing.span('image.build', image=tag):
+        backend.build_image(tag, fileobj=context, custom_context=True, labels={'pelato.deps': digest})
+    build_metrics['deps_image_build_time'] = '%.3f'%(time.time() - start_time)
+    
+    return tag
+
+def docker_time(value):
+    
+    # RFC 3339 timestamps with nanoseconds, as used by the Docker API
+    date, _, fraction = value.rstrip('Z').partition('.')
+    return datetime.fromisoformat(date).replace(tzinfo=timezone.utc).timestamp() + float(f"0.{fraction or 0}")
+
+def log_lines(container):
+    
+    # (timestamp, line) for every line printed by the container
+    lines = []
+    for raw in container.logs(timestamps=True).decode(errors='replace').splitlines():
+        timestamp, _, line = raw.partition(' ')
+        try:
+            lines.append((docker_time(timestamp), line))
+        except ValueError:
+            lines.append((time.time(), raw))
+    return lines
+
+def __load_wadm(task_dir):
+    
+    # Compiled by gen while wadm.yaml is unchanged, parsed otherwise
+    return project_plan.manifest(task_dir) or __parse_yaml(f"{task_dir}/wadm.yaml")
+
+def __get_image(task_dir):
+    
+    wadm = __load_wadm(task_dir)
+    return wadm['spec']['components'][0]['properties']['image']
+
+def __is_up_to_date(entry, digest, oci_url):
+    
+    if not entry or entry.get('image') != oci_url:
+        return False
+    
+    return digest in entry.get('digests', [])
+
+def record_build(manifest, job):
+    
+    # The build rewrites some sources (e.g. go mod tidy), so both the digest of the
+    # sources before the build and the one after it identify this artifact
+    manifest[job['task']] = {
+        'image': job['oci_url'],
+        'digests': sorted({job['digest'], ut.hash_directory(job['source'], exclude=('build',))}),
+        'built_at': time.time()
+    }
+    
+def __build_job(task_dir, reg_user, reg_pass, cache, image=BUILD_IMAGE):
+    
+    wadm = __load_wadm(task_dir)
+    
+    path = os.path.abspath(task_dir)
+    
+    oci_url = wadm['spec']['components'][0]['properties']['image']
+    name = wadm['spec']['components'][0]['name'] + '-build'
     
     uid = os.getuid()
     gid = os.getgid()
     
-    # Build the wasm module
-    print(f"{Colors.BLUE} - Building WASM module {oci_url}{Colors.RESET}")
-    container = client.containers.run(
-        "wash-build-image:latest",
-        environment=[f'REGISTRY={oci_url}',
-                     f'WASH_REG_USER={reg_user}',
-                     f'WASH_REG_PASSWORD={reg_pass}',
-                     f'HOST_UID={uid}',
-                     f'HOST_GID={gid}',
-                     f'COMPONENT_NAME={wadm["spec"]["components"][0]["name"]}'],
-        volumes={path: {'bind': '/app', 'mode': 'rw'}},
-        remove=False,
-        detach=True,
-        name=name
-    )
+    # Persistent Go module, Go build and TinyGo caches shared by every build
+    cache_volumes, cache_environment = cache.mounts() if cache else ({}, [])
     
-    if detached == 'False':
-        container.wait()
-    else:
-        wait_list.append(name)
+    # Phase timings and log tail, from the output streamed while the build runs
+    build_log = BuildLog(wadm["spec"]["components"][0]["name"], path)
+    
+    # Build the wasm module
+    return {
+        'name': name,
+        'image': image,
+        'environment': [f'REGISTRY={oci_url}',
+                        f'WASH_REG_USER={reg_user}',
+                        f'WASH_REG_PASSWORD={reg_pass}',
+                        f'HOST_UID={uid}',
+                        f'HOST_GID={gid}',
+                        f'COMPONENT_NAME={wadm["spec"]["components"][0]["name"]}'] + cache_environment,
+        'volumes': {path: {'bind': '/app', 'mode': 'rw'}, **cache_volumes},
+        'source': path,
+        'component': wadm["spec"]["components"][0]["name"],
+        'oci_url': oci_url,
+        'message': f"Building WASM module {oci_url}",
+        'build_log': build_log,
+        'on_log': build_log.feed,
+        'on_exit': build_log.on_exit
+    }
     
 
 def __parse_yaml(yaml_file):
     with open(yaml_file, 'r') as stream:
         try:
-            return yaml.safe_load(stream)
+            return ut.load_yaml(stream)
         except yaml.YAMLError as exc:
             print(exc)
             return None
\ No newline at end of file
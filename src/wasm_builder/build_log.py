@@ -0,0 +1,117 @@
+import os
+import time
+from collections import deque
+import src.tracing as tracing
+from ..scheduler import log
+from ..colors import Colors
+
+# Lines printed by pelato-build (docker/build.sh) -> phase starting there, None ends the phase
+PHASE_MARKERS = [
+    ('Downloading dependencies', 'deps'),
+    ('Tidying modules', 'tidy'),
+    ('Resolving missing dependencies', 'deps'),
+    ('Building WASM component', 'compile'),
+    ('Build completed successfully', None),
+    ('Pushing to registry', 'push'),
+    ('Push completed', None),
+    ('Skipping push', None),
+    ('Setting file permissions', None),
+]
+TAIL_LINES = 20
+
+class BuildLog:
+
+    # Fed with the build output while it runs (streamed container logs or exec output),
+    # times the phases between the markers and keeps the tail of the log
+
+    def __init__(self, component, source=None, tail_lines=TAIL_LINES):
+
+        self.component = component
+        self.source = source
+        self.tail_lines = deque(maxlen=tail_lines)
+        self.buffer = ''
+        self.segments = []
+        self.current = None
+        self.last_time = None
+        self.wasm_size = None
+        self.exit_code = None
+
+    def feed(self, chunk):
+
+        # Chunks don't always end at a line boundary, keep the partial line for the next one
+        now = time.time()
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode(errors='replace')
+
+        self.buffer += chunk
+        *lines, self.buffer = self.buffer.split('\n')
+        for line in lines:
+            self.line(now, line.rstrip('\r'))
+
+    def line(self, timestamp, text):
+
+        self.last_time = timestamp
+        self.tail_lines.append(text)
+
+        for marker, phase in PHASE_MARKERS:
+            if text.startswith(marker):
+                self.__close(timestamp)
+                if phase is not None:
+                    self.current = (phase, timestamp, text)
+                break
+
+    def __close(self, timestamp):
+        if self.current is not None:
+            phase, start, text = self.current
+            self.segments.append((phase, start, timestamp, text))
+            self.current = None
+
+    def phases(self):
+
+        # Seconds spent in each phase, a phase can run more than once (e.g. deps)
+        durations = {}
+        for phase, start, end, _ in self.segments:
+            durations[phase] = durations.get(phase, 0.0) + end - start
+        return durations
+
+    def tail(self):
+        return '\n'.join(self.tail_lines)
+
+    def finish(self, exit_code):
+
+        # The phase running when the build stopped ends with the last line it printed
+        if self.buffer:
+            self.line(time.time(), self.buffer)
+            self.buffer = ''
+        failed = self.current[0] if self.current is not None and exit_code != 0 else None
+        self.__close(self.last_time or time.time())
+        self.exit_code = exit_code
+
+        if exit_code == 0 and self.source:
+            wasm = os.path.join(self.source, 'build', f"{self.component}.wasm")
+            if os.path.isfile(wasm):
+                self.wasm_size = os.path.getsize(wasm)
+
+        tracer = tracing.get_tracer()
+        for i, (phase, start, end, text) in enumerate(self.segments):
+            span = tracer.start_span(phase, start_time=start, component=self.component)
+            if phase == 'push':
+                span.set_attribute('registry', text.partition(':')[2].strip())
+            if failed is not None and i == len(self.segments) - 1:
+                span.set_attribute('exit_code', exit_code)
+                span.set_error(f"exit code {exit_code}")
+            span.end(end)
+
+        if exit_code != 0:
+            during = f" during {failed}" if failed else ""
+            log(f"{Colors.RED} - Build of {self.component} failed{during}, last lines:{Colors.RESET}\n{self.tail()}")
+
+    def on_exit(self, container, exit_code):
+        self.finish(exit_code)
+
+    def summary(self):
+
+        summary = {'exit_code': self.exit_code, 'phases': {phase: '%.3f' % seconds for phase, seconds in self.phases().items()}}
+        if self.wasm_size is not None:
+            summary['wasm_size'] = self.wasm_size
+        return summary
\ No newline at end of file
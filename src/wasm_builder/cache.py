@@ -0,0 +1,150 @@
+import os
+import shutil
+import src.utils as ut
+from ..scheduler import parse_size
+from ..colors import Colors
+
+# Cache name -> (path inside the build container, environment variable pointing to it)
+CACHES = {
+    'go-build': ('/cache/go-build', 'GOCACHE'),
+    'tinygo': ('/cache/xdg', 'XDG_CACHE_HOME'),
+    'gomod': ('/cache/gomod', 'GOMODCACHE'),
+}
+
+CACHE_MODES = ['volume', 'host', 'off']
+VOLUME_PREFIX = "pelato-cache-"
+
+def format_size(size):
+
+    if size is None:
+        return "unknown"
+
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+class BuildCache:
+
+    def __init__(self, mode='volume', cache_dir=None, max_size=None):
+
+        if mode not in CACHE_MODES:
+            print(f"{Colors.YELLOW}Unknown build cache mode {mode}, caches disabled{Colors.RESET}")
+            mode = 'off'
+
+        self.mode = mode
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir or "~/.cache/pelato"))
+        self.max_size = parse_size(max_size)
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv('BUILD_CACHE', 'volume'), os.getenv('BUILD_CACHE_DIR'), os.getenv('BUILD_CACHE_MAX_SIZE'))
+
+    def __source(self, name):
+
+        # Named volume or host directory backing the cache
+        if self.mode == 'volume':
+            return VOLUME_PREFIX + name
+        return os.path.join(self.cache_dir, name)
+
+    def mounts(self):
+
+        # Volumes and environment to add to every build container
+        volumes = {}
+        environment = []
+
+        if self.mode == 'off':
+            return volumes, environment
+
+        for name, (path, variable) in CACHES.items():
+            source = self.__source(name)
+            if self.mode == 'host':
+                os.makedirs(source, exist_ok=True)
+            volumes[source] = {'bind': path, 'mode': 'rw'}
+            environment.append(f'{variable}={path}')
+
+        return volumes, environment
+
+    def sizes(self, client):
+
+        sizes = {}
+
+        if self.mode == 'volume':
+            usage = {v['Name']: v.get('UsageData', {}).get('Size') for v in client.df().get('Volumes') or []}
+            for name in CACHES:
+                size = usage.get(self.__source(name))
+                sizes[name] = size if size is None or size >= 0 else None
+
+        elif self.mode == 'host':
+            for name in CACHES:
+                path = self.__source(name)
+                sizes[name] = ut.dir_size(path) if os.path.isdir(path) else 0
+
+        return sizes
+
+    def prune(self, client, names=None):
+
+        # docker only when a cache is pruned, not when the cache settings are read
+        import docker
+
+        for name in names or list(CACHES):
+
+            source = self.__source(name)
+
+            try:
+                if self.mode == 'volume':
+                    client.volumes.get(source).remove(force=True)
+
+                elif self.mode == 'host' and os.path.isdir(source):
+                    try:
+                        shutil.rmtree(source)
+                    except PermissionError:
+                        # Files written by root inside the build containers
+                        client.containers.run(
+                            "wash-build-image:latest",
+                            ["sh", "-c", "rm -rf /cache/* /cache/.[!.]*"],
+                            volumes={source: {'bind': '/cache', 'mode': 'rw'}},
+                            remove=True
+                        )
+
+                print(f"{Colors.GREEN} - Cache {name} pruned{Colors.RESET}")
+
+            except docker.errors.NotFound:
+                pass
+            except Exception as e:
+                print(f"{Colors.RED} - Could not prune cache {name}: {e}{Colors.RESET}")
+
+    def limit(self, client, max_size=None):
+
+        # Prune caches, cheapest to rebuild first, until their total size fits max_size
+        max_size = max_size if max_size is not None else self.max_size
+        if max_size is None or self.mode == 'off':
+            return
+
+        sizes = self.sizes(client)
+        total = sum(size or 0 for size in sizes.values())
+
+        for name in CACHES:
+            if total <= max_size:
+                break
+            if sizes.get(name):
+                print(f"{Colors.YELLOW} - Caches use {format_size(total)}, over the limit of {format_size(max_size)}{Colors.RESET}")
+                self.prune(client, [name])
+                total -= sizes[name]
+
+    def info(self, client):
+
+        print(f"{Colors.BLUE}Build caches ({self.mode}){Colors.RESET}")
+
+        if self.mode == 'off':
+            return
+
+        sizes = self.sizes(client)
+        for name, (path, variable) in CACHES.items():
+            print(f"   {Colors.CYAN}• {name:<9}{Colors.RESET} {format_size(sizes.get(name)):>12}  {self.__source(name)} -> {variable}")
+
+        total = sum(size or 0 for size in sizes.values())
+        limit = f" (limit {format_size(self.max_size)})" if self.max_size else ""
+        print(f"   {Colors.BLUE}Total{Colors.RESET} {format_size(total)}{limit}")
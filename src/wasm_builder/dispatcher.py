@@ -0,0 +1,195 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ..scheduler import log
+from .build_log import BuildLog
+import src.tracing as tracing
+from ..colors import Colors
+
+# Builds spread over several Docker daemons (BUILD_ENDPOINTS), each running at most
+# `capacity` containers. Remote daemons get the sources as a tar archive instead of a
+# bind mount, and a build whose daemon fails or can't be reached is retried on another one
+
+# Seconds an endpoint is left alone after an error
+RETRY_AFTER = 60
+MAX_ATTEMPTS = 3
+
+def parse_endpoints(value):
+
+    # "unix:///var/run/docker.sock=4,tcp://ci-1:2375=8" -> [(url, capacity)]
+    endpoints = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, capacity = item.rpartition('=') if '=' in item else (item, '', '1')
+        try:
+            endpoints.append((url, max(1, int(capacity))))
+        except ValueError:
+            raise ValueError(f"Invalid build endpoint {item}, expected <url>=<capacity>")
+    return endpoints
+
+
+class BuildHost:
+
+    def __init__(self, url, capacity, backend, local=False):
+
+        self.url = url
+        self.capacity = capacity
+        self.backend = backend
+        # Local daemons see the project directory, the sources are bind mounted
+        self.local = local
+        self.running = 0
+        self.builds = 0
+        self.down_until = 0
+        self.image = None
+        self.lock = threading.Lock()
+
+    def is_up(self, now):
+        return self.down_until <= now
+
+
+class BuildDispatcher:
+
+    def __init__(self, hosts, scheduler, retry_after=RETRY_AFTER, max_attempts=MAX_ATTEMPTS):
+
+        self.hosts = hosts
+        self.scheduler = scheduler
+        self.retry_after = retry_after
+        self.max_attempts = max_attempts
+        self.condition = threading.Condition()
+        self.failed = threading.Event()
+
+    @classmethod
+    def from_endpoints(cls, endpoints, scheduler, local_backend=None, fake_latency=None):
+
+        # "local" is the daemon of the other stages, fake:// endpoints are in-memory daemons
+        from ..container_backend import DockerBackend, FakeBackend
+        import docker
+
+        hosts = []
+        for url, capacity in parse_endpoints(endpoints):
+            if url == 'local':
+                hosts.append(BuildHost(url, capacity, local_backend, local=True))
+            elif url.startswith('fake://'):
+                hosts.append(BuildHost(url, capacity, FakeBackend(latency=fake_latency or 0.0), local=False))
+            else:
+                client = docker.DockerClient(base_url=url, max_pool_size=capacity + 4)
+                hosts.append(BuildHost(url, capacity, DockerBackend(client), local=url.startswith('unix://')))
+        return cls(hosts, scheduler)
+
+    @property
+    def capacity(self):
+        return sum(host.capacity for host in self.hosts)
+
+    def __acquire(self, tried):
+
+        # Least loaded endpoint with a free slot, preferring the ones this job didn't fail on.
+        # When every endpoint is down they are all tried again
+        with self.condition:
+            while True:
+                now = time.time()
+                up = [host for host in self.hosts if host.is_up(now)] or self.hosts
+                candidates = [host for host in up if host.url not in tried] or up
+                free = [host for host in candidates if host.running < host.capacity]
+                if free:
+                    host = min(free, key=lambda h: h.running / h.capacity)
+                    host.running += 1
+                    return host
+                self.condition.wait(timeout=1)
+
+    def __release(self, host, error):
+
+        with self.condition:
+            host.running -= 1
+            if error:
+                host.down_until = time.time() + self.retry_after
+            else:
+                host.builds += 1
+            self.condition.notify_all()
+
+    def __image(self, host, prepare):
+
+        # Build image on the endpoint, prepared by its first job
+        with host.lock:
+            if host.image is None:
+                host.image = prepare(host.backend)
+            return host.image
+
+    def __run_on(self, host, job, prepare):
+
+        # None when the endpoint failed (unreachable, docker error), the build exit code otherwise
+        try:
+            image = self.__image(host, prepare)
+        except Exception as e:
+            log(f"{Colors.YELLOW} - Could not prepare the build image on {host.url}: {e}{Colors.RESET}")
+            return None
+
+        # A log of its own for every attempt, a retry doesn't add to the output of the failed one
+        build_log = BuildLog(job['build_log'].component, job['build_log'].source)
+        remote_job = dict(job, image=image, message=f"{job['message']} on {host.url}",
+                          build_log=build_log, on_log=build_log.feed, on_exit=build_log.on_exit)
+        if not host.local:
+            # Named cache volumes live on each daemon, host paths don't
+            remote_job['volumes'] = {source: mount for source, mount in job['volumes'].items()
+                                     if mount['bind'] != '/app' and not os.path.isabs(source)}
+            remote_job['upload'] = {'/app': job['source']}
+            remote_job['download'] = {'/app/build': os.path.join(job['source'], 'build')}
+        exit_code = self.scheduler.run_one(host.backend.client, remote_job, 'Build')
+
+        # The build ran to the end on this endpoint, its log is the one of the job
+        if exit_code is not None:
+            job.update(build_log=build_log, on_log=build_log.feed, on_exit=build_log.on_exit)
+        return exit_code
+
+    def run_one(self, job, prepare):
+
+        # Run the job on the least loaded endpoint, moving to another one if it fails
+        if self.failed.is_set():
+            log(f"{Colors.YELLOW} - Skipping {job['name']}, an earlier build failed{Colors.RESET}")
+            return None
+
+        tried = set()
+        for attempt in range(self.max_attempts):
+            host = self.__acquire(tried)
+            tried.add(host.url)
+            exit_code = None
+            try:
+                with tracing.span('build.endpoint', endpoint=host.url, attempt=attempt + 1):
+                    exit_code = self.__run_on(host, job, prepare)
+            finally:
+                self.__release(host, exit_code is None)
+
+            if exit_code is not None:
+                if exit_code != 0 and self.scheduler.fail_fast:
+                    self.failed.set()
+                return exit_code
+            if attempt + 1 < self.max_attempts:
+                log(f"{Colors.YELLOW} - {host.url} failed building {job['name']}, retrying on another endpoint{Colors.RESET}")
+
+        log(f"{Colors.RED} - Build of {job['name']} failed on {', '.join(sorted(tried))}{Colors.RESET}")
+        return None
+
+    def run(self, jobs, prepare):
+
+        # Returns {job name: exit code}, like the scheduler
+        log(f"{Colors.BLUE}Running {len(jobs)} builds on {len(self.hosts)} endpoints, "
+            f"{', '.join(f'{host.url} ({host.capacity})' for host in self.hosts)}{Colors.RESET}")
+
+        # The jobs run in pool threads, parent their spans to the caller's one
+        parent = tracing.current_span()
+        self.failed.clear()
+        for host in self.hosts:
+            host.builds = 0
+
+        def run_one(job):
+            with tracing.span('build.component', parent, component=job.get('component', job['name'])):
+                return self.run_one(job, prepare)
+
+        with ThreadPoolExecutor(max_workers=self.capacity) as executor:
+            exit_codes = list(executor.map(run_one, jobs))
+
+        for host in self.hosts:
+            log(f"{Colors.CYAN} - {host.url}: {host.builds} builds{Colors.RESET}")
+        return {job['name']: exit_code for job, exit_code in zip(jobs, exit_codes)}
\ No newline at end of file
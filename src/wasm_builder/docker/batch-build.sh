@@ -0,0 +1,28 @@
+#!/bin/sh
+# Build several components of the same template family in one container, so that
+# they share the Go module and build caches. $PELATO_BATCH holds one component per
+# line as "<dir under /gen>|<component name>|<OCI reference>". Up to $PELATO_BATCH_JOBS
+# components (default: the CPUs of the container) are built at the same time.
+
+if [ "$1" = "--one" ]; then
+  IFS='|' read -r dir component registry <<EOF
+$2
+EOF
+  output=$(mktemp)
+  start=$(date +%s.%N)
+
+  ( cd "/gen/$dir" && COMPONENT_NAME="$component" REGISTRY="$registry" pelato-build ) >"$output" 2>&1
+  code=$?
+
+  end=$(date +%s.%N)
+  seconds=$(awk "BEGIN { print $end - $start }")
+
+  # The output of the component is printed in one piece, between its markers
+  flock /tmp/pelato-batch.lock sh -c 'echo "PELATO-BATCH-START $1"; cat "$2"; echo "PELATO-BATCH-RESULT $1 $3 $4"' \
+    _ "$dir" "$output" "$code" "$seconds"
+  rm -f "$output"
+  exit 0
+fi
+
+jobs=${PELATO_BATCH_JOBS:-$(nproc)}
+echo "$PELATO_BATCH" | grep -v '^$' | xargs -d '\n' -P "$jobs" -I{} "$0" --one {}
@@ -0,0 +1,40 @@
+#!/bin/sh
+# Build the WASM component in the current directory and push it to $REGISTRY
+set -e
+
+echo 'Setting Go flags...'
+go env -w GOFLAGS=-buildvcs=false
+
+# The dependency layer (deps.Dockerfile) already holds every module of the templates
+if [ -z "$PELATO_DEPS_PREWARMED" ]; then
+  echo 'Downloading dependencies...'
+  go mod download
+fi
+
+echo 'Tidying modules...'
+go mod tidy
+
+if [ -z "$PELATO_DEPS_PREWARMED" ]; then
+  echo 'Resolving missing dependencies...'
+  go get github.com/bytecodealliance/wasm-tools-go/internal/go/gen@v0.3.2 || true
+  go get github.com/bytecodealliance/wasm-tools-go/internal/oci@v0.3.2 || true
+  go get github.com/bytecodealliance/wasm-tools-go/wit@v0.3.2 || true
+  go get github.com/bytecodealliance/wasm-tools-go/cmd/wit-bindgen-go@v0.3.2 || true
+  go mod tidy
+fi
+
+echo 'Building WASM component...'
+wash build
+echo 'Build completed successfully!'
+
+if [ -n "$REGISTRY" ]; then
+  echo "Pushing to registry: $REGISTRY"
+  wash push "$REGISTRY" "build/${COMPONENT_NAME}.wasm"
+  echo 'Push completed!'
+else
+  echo 'Skipping push (no REGISTRY set)'
+fi
+
+echo 'Setting file permissions...'
+chown -R "${HOST_UID:-1000}:${HOST_GID:-1000}" . 2>/dev/null || true
+echo 'All done!'
@@ -0,0 +1,11 @@
+#!/bin/sh
+# Push a module already built (mounted as /artifact/component.wasm) under several tags.
+# $PELATO_PUSH holds one OCI reference per line.
+set -e
+
+echo "$PELATO_PUSH" | while read -r registry; do
+  [ -z "$registry" ] && continue
+  echo "Pushing to registry: $registry"
+  wash push "$registry" /artifact/component.wasm
+done
+echo 'Push completed!'
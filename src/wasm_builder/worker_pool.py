@@ -0,0 +1,195 @@
+import os
+import json
+import queue
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from ..scheduler import log
+import src.tracing as tracing
+from ..colors import Colors
+
+WORKER_PREFIX = "pelato-build-worker-"
+JOBS_DIR = "/jobs"
+
+class WorkerPool:
+
+    # N long-lived build containers, kept up across components and runs. Jobs are
+    # shipped into a per-job directory and run with exec, each worker is health
+    # checked before a job and recycled after max_jobs jobs.
+
+    def __init__(self, backend, size, image="wash-build-image:latest", max_jobs=50,
+                 volumes=None, environment=None, limits=None, state_file=None):
+
+        self.backend = backend
+        self.size = max(1, int(size))
+        self.image = image
+        self.max_jobs = int(max_jobs)
+        self.volumes = volumes or {}
+        self.environment = environment or []
+        self.limits = limits or {}
+        self.state_file = state_file
+        self.workers = {}
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+
+    def __load_counts(self):
+
+        # Number of jobs already run by each worker, kept across runs
+        if self.state_file and os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r') as file:
+                    return json.load(file)
+            except (OSError, ValueError):
+                pass
+        return {}
+
+    def __save_counts(self):
+
+        if not self.state_file:
+            return
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        with open(self.state_file, 'w') as file:
+            json.dump({name: count for name, (_, count) in self.workers.items()}, file)
+
+    def __start_worker(self, name):
+
+        existing = self.backend.find_worker(name)
+        if existing is not None:
+            self.backend.remove_worker(existing)
+
+        log(f"{Colors.YELLOW} - Starting build worker {name}{Colors.RESET}")
+        return self.backend.start_worker(name, self.image, self.volumes, self.environment, self.limits)
+
+    def start(self):
+
+        # Adopt the workers left running by a previous run, start the missing ones
+        counts = self.__load_counts()
+
+        for i in range(self.size):
+            name = f"{WORKER_PREFIX}{i}"
+            worker = self.backend.find_worker(name)
+
+            if worker is not None and self.backend.runs_image(worker, self.image) and self.backend.is_healthy(worker):
+                self.workers[name] = (worker, counts.get(name, 0))
+            else:
+                self.workers[name] = (self.__start_worker(name), 0)
+            self.idle.put(name)
+
+    def __checkout(self, name):
+
+        # Health check the worker and recycle it if needed, before giving it a job
+        worker, count = self.workers[name]
+
+        if count >= self.max_jobs:
+            log(f"{Colors.YELLOW} - Recycling build worker {name} after {count} jobs{Colors.RESET}")
+            worker, count = self.__start_worker(name), 0
+        elif not self.backend.runs_image(worker, self.image):
+            log(f"{Colors.YELLOW} - Build worker {name} runs an outdated image, replacing it{Colors.RESET}")
+            worker, count = self.__start_worker(name), 0
+        elif not self.backend.is_healthy(worker):
+            log(f"{Colors.YELLOW} - Build worker {name} is unhealthy, replacing it{Colors.RESET}")
+            worker, count = self.__start_worker(name), 0
+
+        with self.lock:
+            self.workers[name] = (worker, count)
+        return worker
+
+    def __run_job(self, name, job):
+
+        worker = self.__checkout(name)
+        job_dir = f"{JOBS_DIR}/{uuid.uuid4().hex}"
+
+        log(f"{Colors.BLUE} - {job['message']} on {name}{Colors.RESET}")
+
+        try:
+            with tracing.span('copy', worker=name, direction='in'):
+                self.backend.put_directory(worker, job['source'], job_dir)
+
+            with tracing.span('container.exec', worker=name) as span:
+                exit_code, output = self.backend.exec(worker, ["pelato-build"], job_dir, job['environment'], job.get('on_log'))
+                span.set_attribute('exit_code', exit_code)
+
+            # Bring the built artifacts back next to the sources
+            if exit_code == 0:
+                build_dir = os.path.join(job['source'], 'build')
+                shutil.rmtree(build_dir, ignore_errors=True)
+                with tracing.span('copy', worker=name, direction='out'):
+                    self.backend.get_directory(worker, f"{job_dir}/build", build_dir)
+
+        finally:
+            self.backend.exec(worker, ["rm", "-rf", job_dir])
+            with self.lock:
+                worker, count = self.workers[name]
+                self.workers[name] = (worker, count + 1)
+
+        return exit_code, output
+
+    def run_one(self, job):
+
+        # Run the job on the first idle worker, returns its exit code
+        if not self.workers:
+            with self.lock:
+                if not self.workers:
+                    self.start()
+
+        name = self.idle.get()
+        with tracing.span('worker.job', component=job.get('component', job['name']), worker=name) as span:
+            try:
+                exit_code, output = self.__run_job(name, job)
+            except Exception as e:
+                exit_code, output = None, str(e)
+            finally:
+                self.idle.put(name)
+                with self.lock:
+                    self.__save_counts()
+
+            span.set_attribute('exit_code', exit_code)
+            if exit_code != 0:
+                span.set_error(f"exit code {exit_code}")
+
+            # Same hook as for the scheduler, there is no container to inspect here
+            if 'on_exit' in job:
+                job['on_exit'](None, exit_code)
+
+        if exit_code == 0:
+            log(f"{Colors.GREEN} - Build successful for {job['name']}{Colors.RESET}")
+        elif 'on_log' in job:
+            log(f"{Colors.RED} - Build failed for {job['name']} (exit code: {exit_code}){Colors.RESET}")
+        else:
+            tail = '\n'.join(output.strip().splitlines()[-10:])
+            log(f"{Colors.RED} - Build failed for {job['name']} (exit code: {exit_code}){Colors.RESET}\n{tail}")
+
+        return exit_code
+
+    def run(self, jobs, fail_fast=False):
+
+        # Dispatch the jobs to the workers, returns {job name: exit code}. With fail_fast the
+        # jobs not started yet are skipped (None) after the first failure
+        log(f'{Colors.BLUE}Running {len(jobs)} builds on {self.size} workers{Colors.RESET}')
+
+        # The jobs run in pool threads, parent their spans to the caller's one
+        parent = tracing.current_span()
+        failed = threading.Event()
+
+        def run_one(job):
+            if failed.is_set():
+                log(f"{Colors.YELLOW} - Skipping {job['name']}, an earlier build failed{Colors.RESET}")
+                return None
+            with tracing.span('build.component', parent, component=job.get('component', job['name'])):
+                exit_code = self.run_one(job)
+            if exit_code != 0 and fail_fast:
+                failed.set()
+            return exit_code
+
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            exit_codes = list(executor.map(run_one, jobs))
+
+        return {job['name']: exit_code for job, exit_code in zip(jobs, exit_codes)}
+
+    def shutdown(self):
+
+        for name, (worker, _) in self.workers.items():
+            self.backend.remove_worker(worker)
+        self.workers = {}
+        self.idle = queue.Queue()
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import yaml
+import src.utils as ut
+from .wasm_builder.build import BUILD_MANIFEST
+from .colors import Colors
+
+# `pelato watch`: polls workflow.yaml and tasks/, and regenerates, rebuilds and redeploys
+# only the components affected by the edits. Edits closer than `debounce` seconds are
+# handled together
+
+DEFAULT_INTERVAL = 0.5
+DEFAULT_DEBOUNCE = 1.0
+
+def snapshot(project_dir):
+
+    # {path relative to the project: (mtime, size)} of the files watched
+    files = {}
+    workflow = os.path.join(project_dir, 'workflow.yaml')
+    if os.path.isfile(workflow):
+        stat = os.stat(workflow)
+        files['workflow.yaml'] = (stat.st_mtime_ns, stat.st_size)
+
+    for root, dirs, names in os.walk(os.path.join(project_dir, 'tasks')):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files[os.path.relpath(path, project_dir)] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+def changed_files(old, new):
+    return {path for path in set(old) | set(new) if old.get(path) != new.get(path)}
+
+def load_tasks(project_dir):
+
+    # {component name: task}, None if the workflow can't be read
+    try:
+        with open(os.path.join(project_dir, 'workflow.yaml'), 'r') as file:
+            config = ut.load_yaml(file)
+        return {task['component_name']: task for task in config['tasks']}
+    except (OSError, yaml.YAMLError, KeyError, TypeError) as e:
+        print(f"{Colors.RED} - Could not read workflow.yaml: {e}{Colors.RESET}")
+        return None
+
+def affected_components(changed, old_tasks, new_tasks):
+
+    # Components to regenerate: the tasks changed or added in the workflow and the ones
+    # using a changed task file (a file can be shared by several tasks)
+    affected = set()
+    if 'workflow.yaml' in changed:
+        for name, task in new_tasks.items():
+            previous = old_tasks.get(name)
+            if previous is None or json.dumps(previous, sort_keys=True, default=str) != json.dumps(task, sort_keys=True, default=str):
+                affected.add(name)
+
+    code_files = {os.path.relpath(path, 'tasks') for path in changed if path != 'workflow.yaml'}
+    affected |= {name for name, task in new_tasks.items() if task.get('code') in code_files}
+
+    removed = set(old_tasks) - set(new_tasks)
+    return affected, removed
+
+
+class ProjectWatcher:
+
+    def __init__(self, pelato, project_dir, interval=DEFAULT_INTERVAL, debounce=DEFAULT_DEBOUNCE):
+
+        self.pelato = pelato
+        self.project_dir = project_dir
+        self.interval = interval
+        self.debounce = debounce
+        self.files = snapshot(project_dir)
+        self.tasks = load_tasks(project_dir) or {}
+
+    def poll(self, pending):
+
+        # Adds the files changed since the last poll to pending, True if there were any
+        files = snapshot(self.project_dir)
+        changed = changed_files(self.files, files)
+        self.files = files
+        pending |= changed
+        return bool(changed)
+
+    def update(self, changed):
+
+        new_tasks = load_tasks(self.project_dir)
+        if new_tasks is None:
+            return
+
+        affected, removed = affected_components(changed, self.tasks, new_tasks)
+        self.tasks = new_tasks
+
+        if not affected and not removed:
+            print(f"{Colors.CYAN} - {', '.join(sorted(changed))} changed, no component affected{Colors.RESET}")
+            return
+
+        print(f"\n{Colors.MAGENTA}🔁 {', '.join(sorted(changed))} changed: updating {', '.join(sorted(affected)) or 'nothing'}"
+              f"{', removing ' + ', '.join(sorted(removed)) if removed else ''}{Colors.RESET}")
+        start_time = time.time()
+
+        # Gen removes the components dropped from the workflow, deploy removes their applications.
+        # The rebuilt ones keep their image tag, so deploy removes and deploys their applications again
+        self.pelato.generate(self.project_dir, only=affected)
+        rebuilt = set()
+        if affected:
+            built = ut.load_state(self.project_dir, BUILD_MANIFEST, {})
+            self.pelato.build(self.project_dir, only=affected)
+            rebuilt = {task for task, entry in ut.load_state(self.project_dir, BUILD_MANIFEST, {}).items()
+                       if entry.get('built_at') != built.get(task, {}).get('built_at')}
+        self.pelato.deploy(self.project_dir, only=affected, redeploy=rebuilt)
+
+        print(f"{Colors.GREEN}✅ Updated in {time.time() - start_time:.1f}s, watching {self.project_dir}{Colors.RESET}")
+
+    def run(self):
+
+        print(f"{Colors.BLUE}👀 Watching {self.project_dir}/workflow.yaml and {self.project_dir}/tasks (Ctrl+C to stop){Colors.RESET}")
+        pending = set()
+        last_change = 0
+
+        while True:
+            time.sleep(self.interval)
+            if self.poll(pending):
+                last_change = time.time()
+
+            # Wait until the edits settle, then handle all of them at once
+            if pending and time.time() - last_change >= self.debounce:
+                changed, pending = pending, set()
+                self.update(changed)
\ No newline at end of file
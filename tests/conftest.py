@@ -0,0 +1,70 @@
+import os
+import sys
+import shutil
+import threading
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.container_backend import FakeDockerClient
+from src.code_generator import generator
+
+REGISTRY_URL = "localhost:5000"
+
+
+class ScriptedClient(FakeDockerClient):
+
+    # Fake daemon whose containers take the given latency and fail when named in failing,
+    # instead of drawing both at random. The fake containers run in threads named fake-<name>
+    def __init__(self, latencies=None, failing=(), default_latency=0.0):
+
+        super().__init__()
+        self.latencies = latencies or {}
+        self.failing = set(failing)
+        self.default_latency = default_latency
+
+    def __container(self):
+        return threading.current_thread().name[len('fake-'):]
+
+    def latency(self, image):
+        return self.latencies.get(self.__container(), self.default_latency)
+
+    def fails(self):
+        return self.__container() in self.failing
+
+
+@pytest.fixture(autouse=True)
+def repo_cwd(monkeypatch):
+    # Templates and Dockerfiles are looked up relative to the repository
+    monkeypatch.chdir(ROOT)
+
+
+@pytest.fixture
+def project(tmp_path):
+    project_dir = tmp_path / "project"
+    shutil.copytree(os.path.join(ROOT, "example_project"), project_dir)
+    return str(project_dir)
+
+
+@pytest.fixture
+def generated_project(project):
+    generator.generate(project, REGISTRY_URL, {}, False, incremental=True)
+    return project
+
+@pytest.fixture
+def pelato(tmp_path, monkeypatch):
+
+    # Pelato on the fake backend, configured from an empty .env and these variables only
+    dotenv = tmp_path / ".env"
+    dotenv.write_text("")
+    monkeypatch.setenv('PELATO_DOTENV', str(dotenv))
+    for key in ('BUILD_WORKERS', 'BUILD_ENDPOINTS', 'BATCH_BUILD', 'ARTIFACT_STORE', 'DEPLOY_BACKEND', 'PIPELINE', 'FAIL_FAST', 'DEPLOY_CONCURRENCY'):
+        monkeypatch.delenv(key, raising=False)
+    for key, value in {'CONTAINER_BACKEND': 'fake', 'REGISTRY_URL': REGISTRY_URL, 'ENABLE_METRICS': 'False',
+                       'ENABLE_TRACING': 'False', 'INCREMENTAL_GEN': 'True', 'INCREMENTAL_BUILD': 'True',
+                       'INCREMENTAL_DEPLOY': 'True', 'MAX_CONCURRENCY': '4'}.items():
+        monkeypatch.setenv(key, value)
+
+    from src import Pelato
+    return Pelato()
\ No newline at end of file
@@ -0,0 +1,82 @@
+import os
+from src.scheduler import ContainerScheduler
+from src.container_backend import FakeBackend
+from src.wasm_builder import build
+from src.wasm_builder.artifacts import ArtifactStore, source_key
+
+IMAGE = "sha256:build-image"
+
+
+def key(project_dir, component, image=IMAGE):
+    return source_key(f"{project_dir}/gen/{component}", component, image)
+
+
+def append(path, text):
+    with open(path, 'a') as file:
+        file.write(text)
+
+
+def test_identical_sources_share_the_key(generated_project):
+
+    # Same template and code, only the names and the wadm config differ
+    assert key(generated_project, 'data_double_test1') == key(generated_project, 'data_double_test2')
+    assert key(generated_project, 'data_double_test1') != key(generated_project, 'data_double_test1', "sha256:other-image")
+
+
+def test_build_output_and_wadm_config_are_not_part_of_the_key(generated_project):
+
+    before = key(generated_project, 'data_double_test1')
+    task_dir = f"{generated_project}/gen/data_double_test1"
+    os.makedirs(f"{task_dir}/build", exist_ok=True)
+    append(f"{task_dir}/build/data_double_test1.wasm", "\0asm")
+    append(f"{task_dir}/wadm.yaml", "# replicas changed\n")
+
+    assert key(generated_project, 'data_double_test1') == before
+
+
+def test_changed_code_changes_the_key(generated_project):
+
+    append(f"{generated_project}/gen/data_double_test2/double.go", "\n// changed\n")
+    assert key(generated_project, 'data_double_test1') != key(generated_project, 'data_double_test2')
+
+
+def test_changed_toml_settings_change_the_key(generated_project):
+
+    path = f"{generated_project}/gen/data_double_test2/wasmcloud.toml"
+    with open(path) as file:
+        toml = file.read()
+    with open(path, 'w') as file:
+        file.write(toml.replace('wasm32-wasip2', 'wasm32-wasip1'))
+    assert key(generated_project, 'data_double_test1') != key(generated_project, 'data_double_test2')
+
+
+def test_identical_sources_are_built_once(generated_project, tmp_path):
+
+    backend = FakeBackend()
+    created = []
+    create = backend.client.containers.create
+
+    def record(image, command=None, environment=None, volumes=None, name=None, **kwargs):
+        created.append((name, environment))
+        return create(image, command, environment, volumes, name, **kwargs)
+    backend.client.containers.create = record
+
+    store = ArtifactStore(str(tmp_path / "artifacts"), registry_check=False)
+    scheduler = ContainerScheduler(max_concurrency=2)
+
+    def build_all():
+        created.clear()
+        return build.build_project(generated_project, 'user', 'pass', scheduler, {}, False, backend=backend, artifacts=store)
+
+    # One build, the other component gets a copy pushed under its own tag
+    assert build_all()
+    [(built, _), (pushed, environment)] = created
+    assert built.endswith('-build') and pushed.endswith('-push')
+    other = ({'data_double_test1', 'data_double_test2'} - {built[:-len('-build')]}).pop()
+    assert dict(item.split('=', 1) for item in environment)['PELATO_PUSH'] == f"localhost:5000/{other}:1.0.0"
+    for component in ('data_double_test1', 'data_double_test2'):
+        assert os.path.isfile(f"{generated_project}/gen/{component}/build/{component}.wasm")
+
+    # Both modules are in the store and already pushed: nothing to run
+    assert build_all()
+    assert created == []
\ No newline at end of file
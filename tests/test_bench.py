@@ -0,0 +1,38 @@
+import yaml
+from src import Pelato
+from src import bench
+from src.metrics_store import MetricsStore
+
+
+def test_stages_must_start_with_gen(pelato, tmp_path, capsys):
+
+    assert bench.run(Pelato, str(tmp_path), [2], 1, ['deploy']) is None
+    assert "must start with gen" in capsys.readouterr().out
+    assert not (tmp_path / "bench.yaml").exists()
+
+
+def test_successful_repetitions_are_timed(pelato, tmp_path):
+
+    [result] = bench.run(Pelato, str(tmp_path), [2], 2, ['gen', 'build', 'deploy'])
+
+    assert result['repetitions'] == 2
+    assert result['failed'] == 0
+    assert float(result['throughput']) > 0
+    assert sorted(result['stages']) == ['build', 'deploy', 'gen']
+    assert yaml.safe_load((tmp_path / "bench.yaml").read_text())['results'] == [result]
+
+
+def test_failed_repetitions_are_left_out(pelato, tmp_path):
+
+    [result] = bench.run(Pelato, str(tmp_path), [2], 2, ['gen', 'build', 'deploy'], failure_rate=1.0)
+
+    assert result['repetitions'] == 0
+    assert result['failed'] == 2
+    assert result['median'] is None and result['throughput'] is None
+
+    # The runs are stored all the same, with the stage that failed
+    store = MetricsStore.for_project(str(tmp_path))
+    try:
+        assert [run['bench']['failed_stage'] for run in store.runs()] == ['build', 'build']
+    finally:
+        store.close()
\ No newline at end of file
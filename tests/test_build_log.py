@@ -0,0 +1,82 @@
+from src.scheduler import ContainerScheduler
+from src.container_backend import FakeBackend
+from src.wasm_builder import build
+from src.wasm_builder.build_log import BuildLog
+
+
+def feed_lines(build_log, lines):
+    # (seconds, line) pairs, at fixed times
+    for timestamp, text in lines:
+        build_log.line(timestamp, text)
+
+
+def test_phases_between_the_markers():
+
+    build_log = BuildLog('component')
+    feed_lines(build_log, [(0.0, "Setting Go flags..."), (1.0, "Downloading dependencies..."), (3.0, "Tidying modules..."),
+                           (4.0, "Resolving missing dependencies..."), (4.5, "Building WASM component..."),
+                           (10.0, "Build completed successfully!"), (10.0, "Pushing to registry: localhost:5000/c:1.0.0"),
+                           (12.0, "Push completed!"), (12.5, "Setting file permissions..."), (13.0, "All done!")])
+    build_log.finish(0)
+
+    # deps runs twice, the time outside the phases is not counted
+    assert build_log.phases() == {'deps': 2.5, 'tidy': 1.0, 'compile': 5.5, 'push': 2.0}
+    assert build_log.summary() == {'exit_code': 0, 'phases': {'deps': '2.500', 'tidy': '1.000', 'compile': '5.500', 'push': '2.000'}}
+
+
+def test_chunks_split_anywhere():
+
+    build_log = BuildLog('component')
+    for chunk in [b"Downloading depend", b"encies...\r\nTid", "ying modules...\nBuilding WASM", " component..."]:
+        build_log.feed(chunk)
+
+    # The last line has no newline, finish takes it
+    build_log.finish(0)
+    assert [segment[0] for segment in build_log.segments] == ['deps', 'tidy', 'compile']
+    assert build_log.tail().splitlines() == ["Downloading dependencies...", "Tidying modules...", "Building WASM component..."]
+
+
+def test_missing_end_marker_ends_at_the_last_line(capsys):
+
+    build_log = BuildLog('component')
+    feed_lines(build_log, [(0.0, "Building WASM component..."), (2.0, "main.go:3: undefined: exec_task")])
+    build_log.finish(1)
+
+    assert build_log.phases() == {'compile': 2.0}
+    assert build_log.exit_code == 1
+    assert "Build of component failed during compile" in capsys.readouterr().out
+
+
+def test_out_of_order_markers():
+
+    build_log = BuildLog('component')
+    # An end marker with no phase running, then a phase started without the previous one ending
+    feed_lines(build_log, [(0.0, "Push completed!"), (1.0, "Building WASM component..."),
+                           (3.0, "Pushing to registry: localhost:5000/c:1.0.0"), (4.0, "Downloading dependencies..."),
+                           (6.0, "Build completed successfully!"), (7.0, "Build completed successfully!")])
+    build_log.finish(0)
+
+    assert [(phase, start, end) for phase, start, end, _ in build_log.segments] == [('compile', 1.0, 3.0), ('push', 3.0, 4.0), ('deps', 4.0, 6.0)]
+
+
+def test_no_markers():
+
+    build_log = BuildLog('component')
+    build_log.feed("just some output\n")
+    build_log.finish(0)
+    assert build_log.summary() == {'exit_code': 0, 'phases': {}}
+
+
+def test_phases_are_in_the_build_metrics(generated_project):
+
+    metrics = {}
+    backend = FakeBackend(latency=0.05)
+    assert build.build_project(generated_project, 'user', 'pass', ContainerScheduler(max_concurrency=2), metrics, True, backend=backend)
+
+    components = metrics['build']['components']
+    assert sorted(components) == ['data_double_test1', 'data_double_test2']
+    for summary in components.values():
+        assert summary['exit_code'] == 0
+        assert set(summary['phases']) == {'deps', 'tidy', 'compile', 'push'}
+        assert float(summary['phases']['compile']) > 0
+        assert summary['wasm_size'] > 0
\ No newline at end of file
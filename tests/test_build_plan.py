@@ -0,0 +1,65 @@
+import os
+from src.wasm_builder import build
+
+
+def plan(project_dir, manifest, task='data_double_test1', incremental=True):
+    return build.plan_build(project_dir, task, manifest, incremental, 'user', 'pass', None, build.BUILD_IMAGE)
+
+
+def test_built_components_are_skipped(generated_project):
+
+    manifest = {}
+    job = plan(generated_project, manifest)
+    assert job is not None
+    assert job['oci_url'] == "localhost:5000/data_double_test1:1.0.0"
+
+    build.record_build(manifest, job)
+    assert plan(generated_project, manifest) is None
+    # Only when asked to
+    assert plan(generated_project, manifest, incremental=False) is not None
+
+
+def test_sources_rewritten_by_the_build_still_match(generated_project):
+
+    manifest = {}
+    job = plan(generated_project, manifest)
+
+    # go mod tidy rewrites go.sum while building
+    with open(f"{generated_project}/gen/data_double_test1/go.sum", 'a') as file:
+        file.write("example.com/tidy v1.0.0 h1:abc=\n")
+    build.record_build(manifest, job)
+
+    assert plan(generated_project, manifest) is None
+
+
+def test_changed_sources_are_rebuilt(generated_project):
+
+    manifest = {}
+    build.record_build(manifest, plan(generated_project, manifest))
+
+    with open(f"{generated_project}/gen/data_double_test1/double.go", 'a') as file:
+        file.write("\n// changed\n")
+    assert plan(generated_project, manifest) is not None
+
+
+def test_build_output_is_not_part_of_the_key(generated_project):
+
+    manifest = {}
+    build.record_build(manifest, plan(generated_project, manifest))
+
+    os.makedirs(f"{generated_project}/gen/data_double_test1/build", exist_ok=True)
+    with open(f"{generated_project}/gen/data_double_test1/build/data_double_test1.wasm", 'wb') as file:
+        file.write(b'\0asm')
+    assert plan(generated_project, manifest) is None
+
+
+def test_new_image_reference_is_rebuilt(generated_project):
+
+    manifest = {}
+    build.record_build(manifest, plan(generated_project, manifest))
+
+    # Pushed under another tag, e.g. the registry changed
+    manifest['data_double_test1']['image'] = "registry.example.com/data_double_test1:1.0.0"
+    assert plan(generated_project, manifest) is not None
+    # Other components have their own entry
+    assert plan(generated_project, manifest, task='data_double_test2') is not None
\ No newline at end of file
@@ -0,0 +1,42 @@
+import os
+import sys
+import subprocess
+import pytest
+import src.utils as ut
+import pelato as cli
+from conftest import ROOT
+
+
+def pelato(command, project, tmp_path):
+
+    dotenv = tmp_path / ".env"
+    dotenv.write_text("")
+    env = {**os.environ, 'PELATO_DOTENV': str(dotenv), 'CONTAINER_BACKEND': 'fake', 'ENABLE_METRICS': 'False',
+           'ENABLE_TRACING': 'False', 'REGISTRY_URL': "localhost:5000"}
+    return subprocess.run([sys.executable, "pelato.py", command, project], cwd=ROOT, env=env, capture_output=True, text=True)
+
+
+def test_failed_command_exits_with_an_error(project, tmp_path):
+
+    # Nothing generated yet, nothing to deploy
+    result = pelato("deploy", project, tmp_path)
+    assert result.returncode == 1
+    assert "completed successfully" not in result.stdout
+
+
+def test_successful_command_exits_cleanly(project, tmp_path):
+
+    result = pelato("gen", project, tmp_path)
+    assert result.returncode == 0
+    assert "completed successfully" in result.stdout
+
+def test_help_does_not_list_the_templates(monkeypatch, capsys):
+
+    def listing():
+        raise AssertionError("templates listed")
+    monkeypatch.setattr(ut, 'get_available_templates', listing)
+    for argv in (["pelato.py", "--help"], ["pelato.py"]):
+        monkeypatch.setattr(sys, 'argv', argv)
+        with pytest.raises(SystemExit):
+            cli.main()
+    assert "src/code_generator/templates" in capsys.readouterr().out
\ No newline at end of file
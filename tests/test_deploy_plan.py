@@ -0,0 +1,104 @@
+import os
+import shutil
+import yaml
+import src.utils as ut
+from src.scheduler import ContainerScheduler
+from src.container_backend import FakeBackend
+from src.component_deploy import manifests as mf
+from src.component_deploy import deploy as deployer
+from src.component_deploy import remove as remover
+
+
+def actions(plan):
+    return {entry['name']: entry['action'] for entry in plan}
+
+
+def deploy_all(project_dir, state):
+    for entry in mf.plan_deploy(project_dir, state):
+        mf.record_deploy(state, entry)
+
+
+def test_first_deploy_adds_everything(generated_project):
+
+    plan = mf.plan_deploy(generated_project, {})
+    assert actions(plan) == {'data_double_test1': 'add', 'data_double_test2': 'add'}
+    assert {entry['task'] for entry in plan} == {'data_double_test1', 'data_double_test2'}
+
+
+def test_applied_manifests_are_unchanged(generated_project):
+
+    state = {}
+    deploy_all(generated_project, state)
+    assert set(actions(mf.plan_deploy(generated_project, state)).values()) == {'unchanged'}
+    # Everything applied again when not incremental
+    assert set(actions(mf.plan_deploy(generated_project, state, incremental=False)).values()) == {'update'}
+
+
+def test_changed_manifest_is_updated(generated_project):
+
+    state = {}
+    deploy_all(generated_project, state)
+
+    wadm_path = f"{generated_project}/gen/data_double_test1/wadm.yaml"
+    with open(wadm_path) as file:
+        manifest = ut.load_yaml(file)
+    manifest['metadata']['annotations']['version'] = 'v2'
+    with open(wadm_path, 'w') as file:
+        yaml.dump(manifest, file)
+
+    assert actions(mf.plan_deploy(generated_project, state)) == {
+        'data_double_test1': 'update', 'data_double_test2': 'unchanged'}
+
+
+def test_reformatted_manifest_is_unchanged(generated_project):
+
+    state = {}
+    deploy_all(generated_project, state)
+
+    # Same application, different key order and formatting
+    wadm_path = f"{generated_project}/gen/data_double_test1/wadm.yaml"
+    with open(wadm_path) as file:
+        manifest = ut.load_yaml(file)
+    with open(wadm_path, 'w') as file:
+        yaml.dump(manifest, file, sort_keys=True, indent=4)
+
+    assert set(actions(mf.plan_deploy(generated_project, state)).values()) == {'unchanged'}
+
+
+def test_removed_component_is_deleted(generated_project):
+
+    state = {}
+    deploy_all(generated_project, state)
+    shutil.rmtree(f"{generated_project}/gen/data_double_test2")
+
+    plan = mf.plan_deploy(generated_project, state)
+    assert actions(plan) == {'data_double_test1': 'unchanged', 'data_double_test2': 'delete'}
+    # Removed with the last applied manifest
+    deleted = plan[-1]
+    assert deleted['manifest'] == state['data_double_test2']['manifest']
+
+
+def test_only_plans_the_given_components(generated_project):
+
+    state = {}
+    deploy_all(generated_project, state)
+
+    plan = mf.plan_deploy(generated_project, state, incremental=False, only={'data_double_test1'})
+    # The application of the component left out is neither updated nor deleted
+    assert actions(plan) == {'data_double_test1': 'update'}
+
+
+def test_unreadable_manifest_or_state_fails_the_stage(generated_project):
+
+    scheduler = ContainerScheduler(max_concurrency=2)
+    backend = FakeBackend()
+
+    # A deploy state that is valid json but not a state
+    ut.dump_state(generated_project, mf.DEPLOY_STATE, {'data_double_test1': "deployed"})
+    assert deployer.deploy_components(generated_project, None, None, scheduler, {}, False, backend=backend) is False
+    assert remover.remove_components(generated_project, None, None, scheduler, backend=backend) is False
+
+    ut.dump_state(generated_project, mf.DEPLOY_STATE, {})
+    os.remove(f"{generated_project}/gen/data_double_test2/wadm.yaml")
+    assert deployer.deploy_components(generated_project, None, None, scheduler, {}, False, backend=backend) is False
+    assert remover.remove_components(generated_project, None, None, scheduler, backend=backend) is False
\ No newline at end of file
@@ -0,0 +1,176 @@
+import os
+import time
+import shutil
+import threading
+import pytest
+from src.scheduler import ContainerScheduler
+from src.container_backend import FakeBackend
+from src.wasm_builder import build
+from src.wasm_builder.dispatcher import BuildDispatcher, BuildHost, parse_endpoints
+from conftest import ScriptedClient
+
+BUILD_IMAGE = build.BUILD_IMAGE
+
+
+class CountingScheduler(ContainerScheduler):
+
+    # Peak of the builds running at the same time on each daemon
+    def __init__(self):
+        super().__init__(max_concurrency=16)
+        self.running = {}
+        self.peak = {}
+        self.lock = threading.Lock()
+
+    def run_one(self, client, job, action):
+        with self.lock:
+            self.running[client] = self.running.get(client, 0) + 1
+            self.peak[client] = max(self.peak.get(client, 0), self.running[client])
+        try:
+            return super().run_one(client, job, action)
+        finally:
+            with self.lock:
+                self.running[client] -= 1
+
+
+def host(url, capacity, latency=0.0, failing=()):
+    backend = FakeBackend()
+    backend.client = ScriptedClient(default_latency=latency, failing=failing)
+    return BuildHost(url, capacity, backend)
+
+
+def unreachable(build_host):
+
+    # Every container request fails, like a daemon that went away
+    def create(*args, **kwargs):
+        raise ConnectionError(f"{build_host.url} unreachable")
+    build_host.backend.client.containers.create = create
+    return build_host
+
+
+def jobs(project_dir, n):
+
+    # n copies of a generated component, each in its own gen/ folder
+    result = []
+    for i in range(n):
+        task = f"component{i}"
+        if not os.path.isdir(f"{project_dir}/gen/{task}"):
+            shutil.copytree(f"{project_dir}/gen/data_double_test1", f"{project_dir}/gen/{task}")
+        job = build.plan_build(project_dir, task, {}, False, 'user', 'pass', None, BUILD_IMAGE)
+        job['name'] = f"{task}-build"
+        result.append(job)
+    return result
+
+
+def prepare(backend):
+    return BUILD_IMAGE
+
+
+def test_parse_endpoints():
+
+    assert parse_endpoints("unix:///var/run/docker.sock=4, tcp://ci-1:2375=8,fake://x") == [
+        ("unix:///var/run/docker.sock", 4), ("tcp://ci-1:2375", 8), ("fake://x", 1)]
+    with pytest.raises(ValueError):
+        parse_endpoints("tcp://ci-1:2375=many")
+
+
+def test_builds_respect_the_capacity_of_each_endpoint(generated_project):
+
+    scheduler = CountingScheduler()
+    small, large = host('fake://small', 1, latency=0.05), host('fake://large', 3, latency=0.05)
+    dispatcher = BuildDispatcher([small, large], scheduler)
+
+    results = dispatcher.run(jobs(generated_project, 8), prepare)
+
+    assert set(results.values()) == {0}
+    assert scheduler.peak[small.backend.client] <= 1
+    assert scheduler.peak[large.backend.client] <= 3
+    assert small.builds + large.builds == 8
+    # The least loaded endpoint gets the work, the larger one builds more
+    assert large.builds > small.builds
+
+
+def test_remote_builds_bring_the_module_back(generated_project):
+
+    dispatcher = BuildDispatcher([host('fake://remote', 2)], ContainerScheduler(max_concurrency=2))
+    [job] = jobs(generated_project, 1)
+
+    assert dispatcher.run([job], prepare) == {job['name']: 0}
+    assert os.path.isfile(f"{job['source']}/build/{job['component']}.wasm")
+    assert job['build_log'].exit_code == 0
+
+
+def test_failed_endpoint_is_retried_elsewhere(generated_project):
+
+    down = unreachable(host('fake://down', 4))
+    up = host('fake://up', 1)
+    dispatcher = BuildDispatcher([down, up], ContainerScheduler(max_concurrency=4))
+
+    results = dispatcher.run(jobs(generated_project, 3), prepare)
+
+    assert set(results.values()) == {0}
+    assert up.builds == 3
+    assert down.builds == 0
+    # Left alone for a while
+    assert down.down_until > time.time()
+
+
+def test_image_preparation_failure_moves_to_another_endpoint(generated_project):
+
+    broken, working = host('fake://broken', 1), host('fake://working', 1)
+
+    def prepare_on(backend):
+        if backend is broken.backend:
+            raise RuntimeError("no space left on device")
+        return BUILD_IMAGE
+
+    dispatcher = BuildDispatcher([broken, working], ContainerScheduler(max_concurrency=2))
+    results = dispatcher.run(jobs(generated_project, 2), prepare_on)
+
+    assert set(results.values()) == {0}
+    assert working.builds == 2
+
+
+def test_every_endpoint_failing(generated_project):
+
+    dispatcher = BuildDispatcher([unreachable(host('fake://a', 1)), unreachable(host('fake://b', 1))],
+                                 ContainerScheduler(max_concurrency=2), max_attempts=2)
+    [job] = jobs(generated_project, 1)
+
+    assert dispatcher.run([job], prepare) == {job['name']: None}
+
+
+def test_retry_gets_a_fresh_build_log(generated_project):
+
+    # The build runs on the first endpoint, then its daemon fails while the module is copied back
+    flaky, steady = host('fake://flaky', 1), host('fake://steady', 1)
+    create = flaky.backend.client.containers.create
+
+    def create_failing_download(*args, **kwargs):
+        container = create(*args, **kwargs)
+        def get_archive(path):
+            raise ConnectionError("connection reset")
+        container.get_archive = get_archive
+        return container
+    flaky.backend.client.containers.create = create_failing_download
+
+    dispatcher = BuildDispatcher([flaky, steady], ContainerScheduler(max_concurrency=1))
+    [job] = jobs(generated_project, 1)
+    original = job['build_log']
+
+    assert dispatcher.run_one(job, prepare) == 0
+    assert job['build_log'] is not original
+    assert job['build_log'].exit_code == 0
+    # Only the phases of the attempt that succeeded
+    phases = [segment[0] for segment in job['build_log'].segments]
+    assert phases.count('compile') == 1
+
+
+def test_fail_fast_skips_the_remaining_builds(generated_project):
+
+    failing = ScriptedClient(failing={'component0-build'}, default_latency=0.05)
+    only = host('fake://only', 1)
+    only.backend.client = failing
+    dispatcher = BuildDispatcher([only], ContainerScheduler(max_concurrency=1, fail_fast=True))
+
+    results = dispatcher.run(jobs(generated_project, 3), prepare)
+    assert results == {'component0-build': 1, 'component1-build': None, 'component2-build': None}
\ No newline at end of file
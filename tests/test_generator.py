@@ -0,0 +1,90 @@
+import os
+import shutil
+import src.utils as ut
+from src.code_generator import generator, template_registry
+from conftest import REGISTRY_URL
+
+
+def generate(project_dir, **kwargs):
+    return generator.generate(project_dir, REGISTRY_URL, {}, False, incremental=True, **kwargs)
+
+
+def components(project_dir):
+    return ut.load_state(project_dir, generator.GEN_MANIFEST)['components']
+
+
+def test_unchanged_components_are_skipped(generated_project, capsys):
+
+    before = components(generated_project)
+    main_go = f"{generated_project}/gen/data_double_test1/main.go"
+    mtime = os.stat(main_go).st_mtime_ns
+    capsys.readouterr()
+
+    assert generate(generated_project)
+    output = capsys.readouterr().out
+    assert "Task data_double_test1 unchanged" in output
+    assert "Task data_double_test2 unchanged" in output
+    assert components(generated_project) == before
+    assert os.stat(main_go).st_mtime_ns == mtime
+
+
+def test_changed_inputs_are_regenerated(generated_project, capsys):
+
+    before = components(generated_project)
+
+    # The task code is an input of both components
+    with open(f"{generated_project}/tasks/double.go", 'a') as file:
+        file.write("\n// changed\n")
+    capsys.readouterr()
+
+    assert generate(generated_project)
+    output = capsys.readouterr().out
+    assert "Task data_double_test1 generated" in output
+    assert "Task data_double_test2 generated" in output
+    after = components(generated_project)
+    assert after['data_double_test1']['fingerprint'] != before['data_double_test1']['fingerprint']
+    with open(f"{generated_project}/gen/data_double_test1/double.go") as file:
+        assert file.read().endswith("// changed\n")
+
+
+def test_deleted_component_dir_is_regenerated(generated_project, capsys):
+
+    shutil.rmtree(f"{generated_project}/gen/data_double_test2")
+    capsys.readouterr()
+
+    assert generate(generated_project)
+    output = capsys.readouterr().out
+    assert "Task data_double_test1 unchanged" in output
+    assert "Task data_double_test2 generated" in output
+    assert os.path.isfile(f"{generated_project}/gen/data_double_test2/wadm.yaml")
+
+
+def test_render_failure_is_not_recorded(project, monkeypatch):
+
+    class Broken:
+        def render(self, variables):
+            raise ValueError("broken template")
+
+    template = template_registry.get_registry().get('processor_nats')
+    with monkeypatch.context() as patch:
+        patch.setitem(template.templated, 'main.go', Broken())
+        assert generate(project) is False
+        assert components(project) == {}
+
+    # Fixed, the components are generated on the next run
+    assert generate(project)
+    assert sorted(components(project)) == ['data_double_test1', 'data_double_test2']
+
+
+def test_auto_materialization_is_the_default(pelato, project):
+
+    assert pelato.gen_materialize == 'auto'
+    assert pelato.generate(project)
+
+    template = template_registry.get_registry().get('processor_nats')
+    for rel_path in template.copied:
+        generated = f"{project}/gen/data_double_test1/{rel_path}"
+        # Rewritten by the build, never linked to the template
+        assert not os.path.samefile(generated, os.path.join(template.path, rel_path))
+        with open(generated, 'rb') as file, open(os.path.join(template.path, rel_path), 'rb') as original:
+            assert file.read() == original.read()
\ No newline at end of file
@@ -0,0 +1,78 @@
+import os
+import yaml
+from src.metrics_store import MetricsStore
+
+RUNS = [
+    {'n_task': 2, 'time_total': '1.500', 'code_gen': {'gen_time': '0.120', 'unchanged_components': 1}},
+    {'n_task': 4, 'time_total': '3.250', 'build': {'components_build_time': '2.000', 'skipped_components': 3}},
+]
+
+
+def write_metrics(directory, runs):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "metrics.yaml")
+    with open(path, 'w') as file:
+        yaml.dump({'runs': runs}, file)
+    return path
+
+
+def test_columns_are_extracted(tmp_path):
+
+    store = MetricsStore(str(tmp_path / "metrics.db"))
+    store.append(RUNS[0], 'gen', '/project', 100.0)
+
+    row = store.connection.execute("SELECT command, n_task, time_total, gen_time, unchanged_components FROM runs").fetchone()
+    assert row == ('gen', 2, 1.5, 0.12, 1)
+    assert store.runs() == [RUNS[0]]
+    store.close()
+
+
+def test_import_is_idempotent(tmp_path):
+
+    store = MetricsStore(str(tmp_path / "metrics.db"))
+    path = write_metrics(str(tmp_path / "project"), RUNS)
+
+    assert store.import_yaml(path) == 2
+    assert store.import_yaml(path) == 0
+    assert store.count() == 2
+
+    # Runs appended to the file later are the only ones imported
+    write_metrics(str(tmp_path / "project"), RUNS + [{'n_task': 8, 'time_total': '6.000'}])
+    assert store.import_yaml(path) == 1
+    assert store.count() == 3
+    store.close()
+
+
+def test_same_file_through_another_path(tmp_path, monkeypatch):
+
+    store = MetricsStore(str(tmp_path / "metrics.db"))
+    path = write_metrics(str(tmp_path / "project"), RUNS)
+    assert store.import_yaml(path) == 2
+
+    monkeypatch.chdir(tmp_path)
+    assert store.import_yaml(os.path.join("project", "metrics.yaml")) == 0
+    store.close()
+
+
+def test_projects_with_the_same_folder_name(tmp_path):
+
+    store = MetricsStore(str(tmp_path / "metrics.db"))
+    first = write_metrics(str(tmp_path / "a" / "project"), RUNS)
+    second = write_metrics(str(tmp_path / "b" / "project"), RUNS)
+
+    assert store.import_yaml(first) == 2
+    assert store.import_yaml(second) == 2
+    assert store.count() == 4
+    store.close()
+
+
+def test_runs_are_filtered(tmp_path):
+
+    store = MetricsStore(str(tmp_path / "metrics.db"))
+    store.append(RUNS[0], 'gen', '/project', 100.0)
+    store.append(RUNS[1], 'build', '/project', 200.0)
+
+    assert store.runs(command='build') == [RUNS[1]]
+    assert store.runs(n_task=2) == [RUNS[0]]
+    assert store.runs(since=150.0) == [RUNS[1]]
+    store.close()
\ No newline at end of file
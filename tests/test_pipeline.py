@@ -0,0 +1,48 @@
+import os
+import src.utils as ut
+from src.component_deploy import manifests as mf
+
+
+def test_pipeline_succeeds(pelato, project, monkeypatch):
+
+    monkeypatch.setattr(pelato, 'pipeline', True)
+    assert pelato.all(project) is True
+    assert sorted(ut.load_state(project, mf.DEPLOY_STATE)) == ['data_double_test1', 'data_double_test2']
+
+    # Everything up to date the second time
+    assert pelato.all(project) is True
+
+
+def test_pipeline_reports_failed_components(pelato, project, monkeypatch, capsys):
+
+    monkeypatch.setattr(pelato, 'pipeline', True)
+    pelato.get_backend().client.failure_rate = 1.0
+
+    assert pelato.all(project) is False
+    output = capsys.readouterr().out
+    assert "Pipeline failed for 2 components: data_double_test1, data_double_test2" in output
+    assert "completed successfully" not in output
+
+
+def test_pipeline_tolerates_stray_gen_entries(pelato, project, monkeypatch):
+
+    monkeypatch.setattr(pelato, 'pipeline', True)
+    assert pelato.all(project) is True
+
+    # Left in gen/ after generation: a file and a folder without wadm.yaml
+    from src.code_generator import generator
+    generate = generator.generate
+
+    def generate_and_litter(project_dir, *args, **kwargs):
+        result = generate(project_dir, *args, **kwargs)
+        os.makedirs(f"{project_dir}/gen/leftover", exist_ok=True)
+        with open(f"{project_dir}/gen/notes.txt", 'w') as file:
+            file.write("notes")
+        return result
+    monkeypatch.setattr(generator, 'generate', generate_and_litter)
+
+    with open(f"{project}/tasks/double.go", 'a') as file:
+        file.write("\n// changed\n")
+    assert pelato.all(project) is True
+    # The deploy state is still saved, nothing is deleted
+    assert sorted(ut.load_state(project, mf.DEPLOY_STATE)) == ['data_double_test1', 'data_double_test2']
\ No newline at end of file
@@ -0,0 +1,78 @@
+import os
+import yaml
+import src.utils as ut
+import src.project_plan as project_plan
+from src.component_deploy import manifests as mf
+
+
+def wadm_path(project_dir, task='data_double_test1'):
+    return f"{project_dir}/gen/{task}/wadm.yaml"
+
+
+def parsed(project_dir, task='data_double_test1'):
+    with open(wadm_path(project_dir, task)) as file:
+        return yaml.safe_load(file)
+
+
+def rewrite_plan(project_dir):
+    # As gen does, with the fingerprints it recorded
+    plan = project_plan.load_plan(project_dir)
+    with open(f"{project_dir}/workflow.yaml") as file:
+        tasks = yaml.safe_load(file)['tasks']
+    project_plan.write_plan(project_dir, tasks, {name: {'fingerprint': entry['fingerprint']} for name, entry in plan['components'].items()})
+    return project_plan.load_plan(project_dir)
+
+
+def test_gen_compiles_the_manifests(generated_project):
+
+    plan = project_plan.load_plan(generated_project)
+    assert sorted(plan['components']) == ['data_double_test1', 'data_double_test2']
+    entry = plan['components']['data_double_test1']
+    assert entry['image'] == "localhost:5000/data_double_test1:1.0.0"
+    assert project_plan.manifest(f"{generated_project}/gen/data_double_test1") == parsed(generated_project)
+
+
+def test_unchanged_entries_are_reused(generated_project, monkeypatch):
+
+    compiled = []
+    compile_component = project_plan.compile_component
+    monkeypatch.setattr(project_plan, 'compile_component', lambda *args: compiled.append(args[1]['component_name']) or compile_component(*args))
+
+    # Touched without changing: the digest still matches
+    os.utime(wadm_path(generated_project), ns=(1, 1))
+    assert project_plan.manifest(f"{generated_project}/gen/data_double_test1") == parsed(generated_project)
+    rewrite_plan(generated_project)
+    assert compiled == []
+
+
+def test_edited_manifest_is_read_again(generated_project):
+
+    with open(wadm_path(generated_project)) as file:
+        wadm = file.read()
+    with open(wadm_path(generated_project), 'w') as file:
+        file.write(wadm.replace('instances: 1', 'instances: 3'))
+    manifest = parsed(generated_project)
+    assert manifest != project_plan.load_plan(generated_project)['components']['data_double_test1']['manifest']
+
+    # Stale: not served from the plan, the stages parse wadm.yaml
+    assert project_plan.manifest(f"{generated_project}/gen/data_double_test1") is None
+    assert mf.load_manifest(f"{generated_project}/gen/data_double_test1") == manifest
+
+    # Compiled again on the next write, the other component is left as it was
+    plan = rewrite_plan(generated_project)
+    assert plan['components']['data_double_test1']['manifest'] == manifest
+    assert project_plan.manifest(f"{generated_project}/gen/data_double_test1") == manifest
+
+
+def test_missing_or_old_plan(generated_project):
+
+    task_dir = f"{generated_project}/gen/data_double_test1"
+    plan = project_plan.load_plan(generated_project)
+
+    ut.dump_state(generated_project, project_plan.PLAN, {**plan, 'version': project_plan.PLAN_VERSION + 1})
+    assert project_plan.load_plan(generated_project) is None
+    assert project_plan.manifest(task_dir) is None
+
+    os.remove(ut.state_path(generated_project, project_plan.PLAN))
+    assert project_plan.manifest(task_dir) is None
+    assert mf.load_manifest(task_dir) == parsed(generated_project)
\ No newline at end of file
@@ -0,0 +1,114 @@
+import os
+import time
+from src.scheduler import ContainerScheduler, DEFAULT_DEPLOY_CONCURRENCY
+from src.container_backend import FakeContainer
+from conftest import ScriptedClient
+
+
+def job(name, exits):
+    return {
+        'name': name,
+        'image': 'wash-deploy-image:latest',
+        'environment': [],
+        'volumes': {},
+        'message': f"Running {name}",
+        'on_exit': lambda container, exit_code: exits.append((name, exit_code))
+    }
+
+
+def test_results_in_completion_order():
+
+    client = ScriptedClient({'slow': 0.3, 'fast': 0.0, 'medium': 0.1})
+    exits = []
+    results = ContainerScheduler(max_concurrency=3).run(client, [job(n, exits) for n in ('slow', 'fast', 'medium')], 'Deploy')
+
+    assert results == {'slow': 0, 'fast': 0, 'medium': 0}
+    assert [name for name, _ in exits] == ['fast', 'medium', 'slow']
+    # Successful containers are removed
+    assert client.containers.containers == {}
+
+
+def test_exit_codes_come_from_the_events_stream(monkeypatch):
+
+    # No wait() request per container, the die events carry the exit codes
+    def wait(self):
+        raise AssertionError("wait() called")
+    monkeypatch.setattr(FakeContainer, 'wait', wait)
+
+    client = ScriptedClient({'a': 0.05}, failing={'b'})
+    results = ContainerScheduler(max_concurrency=2).run(client, [job('a', []), job('b', [])], 'Deploy')
+
+    assert results == {'a': 0, 'b': 1}
+    # The stream is closed at the end of the run, the failed container is kept
+    assert client.subscribers == []
+    assert list(client.containers.containers) == ['b']
+
+
+def test_falls_back_to_wait_without_events(monkeypatch):
+
+    client = ScriptedClient(failing={'b'})
+
+    def events(*args, **kwargs):
+        raise ConnectionError("no events")
+    monkeypatch.setattr(client, 'events', events)
+
+    results = ContainerScheduler(max_concurrency=2).run(client, [job('a', []), job('b', [])], 'Deploy')
+    assert results == {'a': 0, 'b': 1}
+
+
+def test_concurrency_is_bounded():
+
+    client = ScriptedClient(default_latency=0.1)
+    start = time.time()
+    results = ContainerScheduler(max_concurrency=2).run(client, [job(f"c{i}", []) for i in range(4)], 'Deploy')
+
+    assert set(results.values()) == {0}
+    # Two waves of two containers
+    assert time.time() - start >= 0.2
+
+
+def test_fail_fast_stops_running_and_skips_queued():
+
+    client = ScriptedClient({'bad': 0.05, 'slow': 5.0}, failing={'bad'})
+    exits = []
+    start = time.time()
+    results = ContainerScheduler(max_concurrency=2, fail_fast=True).run(
+        client, [job('bad', exits), job('slow', exits), job('queued-1', exits), job('queued-2', exits)], 'Deploy')
+
+    assert results == {'bad': 1, 'slow': None, 'queued-1': None, 'queued-2': None}
+    assert time.time() - start < 2
+    assert exits == [('bad', 1)]
+    # Only the failed container is kept for debugging
+    assert list(client.containers.containers) == ['bad']
+
+
+def test_without_fail_fast_every_job_runs():
+
+    client = ScriptedClient({'bad': 0.05, 'slow': 0.2}, failing={'bad'})
+    results = ContainerScheduler(max_concurrency=2).run(
+        client, [job('bad', []), job('slow', []), job('queued', [])], 'Deploy')
+
+    assert results == {'bad': 1, 'slow': 0, 'queued': 0}
+
+def test_deploys_are_not_bound_by_the_build_default(monkeypatch):
+
+    # A 1-CPU host: one build at a time, deploys still run together
+    monkeypatch.setattr(os, 'cpu_count', lambda: 1)
+    for key in ('MAX_CONCURRENCY', 'DEPLOY_CONCURRENCY'):
+        monkeypatch.delenv(key, raising=False)
+    scheduler = ContainerScheduler.from_env('True')
+    assert scheduler.max_concurrency == 1
+    assert scheduler.deploy_concurrency == DEFAULT_DEPLOY_CONCURRENCY
+
+    client = ScriptedClient(default_latency=0.2)
+    start = time.time()
+    results = scheduler.run(client, [job(f"c{i}", []) for i in range(4)], 'Deployment', scheduler.deploy_concurrency)
+    assert set(results.values()) == {0}
+    assert time.time() - start < 0.6
+
+    # Set explicitly, the limits apply to every container
+    monkeypatch.setenv('MAX_CONCURRENCY', '2')
+    assert ContainerScheduler.from_env('True').deploy_concurrency == 2
+    monkeypatch.setenv('DEPLOY_CONCURRENCY', '8')
+    assert ContainerScheduler.from_env('True').deploy_concurrency == 8
+    assert ContainerScheduler.from_env('False').deploy_concurrency == 1
\ No newline at end of file
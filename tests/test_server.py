@@ -0,0 +1,42 @@
+from src.server import PelatoServer, Job
+
+
+def run(server, command, project_dir):
+    job = Job(command, project_dir)
+    server.run_job(job)
+    return job
+
+
+def test_jobs_succeed(pelato, project):
+
+    server = PelatoServer(pelato)
+    for command in ('gen', 'build', 'deploy', 'remove'):
+        job = run(server, command, project)
+        assert job.status == 'succeeded', command
+        assert job.error is None
+    assert any("Code generation completed" in chunk for chunk in run(server, 'gen', project).output)
+
+
+def test_invalid_project_fails(pelato, tmp_path):
+
+    server = PelatoServer(pelato)
+    for command in ('gen', 'build', 'deploy', 'remove'):
+        assert run(server, command, str(tmp_path)).status == 'failed', command
+
+
+def test_failed_builds_fail_the_job(pelato, project):
+
+    server = PelatoServer(pelato)
+    assert run(server, 'gen', project).status == 'succeeded'
+
+    pelato.get_backend().client.failure_rate = 1.0
+    job = run(server, 'build', project)
+    assert job.status == 'failed'
+    assert job.error == "build failed, see the job output"
+
+
+def test_brush_reports_failed_stages(pelato, project):
+
+    server = PelatoServer(pelato)
+    pelato.get_backend().client.failure_rate = 1.0
+    assert run(server, 'brush', project).status == 'failed'
\ No newline at end of file
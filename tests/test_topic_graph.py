@@ -0,0 +1,67 @@
+import src.topic_graph as topic_graph
+
+
+def task(name, source=None, dest=None):
+    return {'component_name': name, 'source_topic': source, 'dest_topic': dest}
+
+
+def graph(edges):
+    return {'components': {}, 'edges': edges}
+
+
+def test_edges_follow_the_topics():
+
+    tasks = [task('producer', dest='raw'), task('filter', 'raw', 'clean, alerts'),
+             task('store', 'clean'), task('notify', ['alerts']), task('echo', 'raw', 'raw')]
+    edges = topic_graph.build_graph(tasks)['edges']
+
+    assert edges == {'producer': ['echo', 'filter'], 'filter': ['notify', 'store'],
+                     'store': [], 'notify': [], 'echo': ['filter']}
+
+
+def test_levels_of_a_chain():
+
+    assert topic_graph.levels(graph({'a': ['b'], 'b': ['c'], 'c': []})) == [['a'], ['b'], ['c']]
+    assert topic_graph.levels(graph({'a': ['b', 'c'], 'b': ['d'], 'c': ['d'], 'd': []})) == [['a'], ['b', 'c'], ['d']]
+
+
+def test_deploy_consumers_first_remove_producers_first():
+
+    chain = graph({'producer': ['processor'], 'processor': ['sink'], 'sink': []})
+    assert topic_graph.deploy_order(chain) == [['sink'], ['processor'], ['producer']]
+    assert topic_graph.remove_order(chain) == [['producer'], ['processor'], ['sink']]
+    assert topic_graph.deploy_dependencies(chain) == {'sink': set(), 'processor': {'sink'}, 'producer': {'processor'}}
+
+
+def test_cycle_gets_its_own_level():
+
+    # a -> (b <-> c) -> d -> e: only the cycle shares a level, d and e keep their order
+    levels = topic_graph.levels(graph({'a': ['b'], 'b': ['c'], 'c': ['b', 'd'], 'd': ['e'], 'e': []}))
+    assert levels == [['a'], ['b', 'c'], ['d'], ['e']]
+
+
+def test_independent_and_chained_cycles():
+
+    levels = topic_graph.levels(graph({'x': ['y'], 'y': ['x'], 'p': ['a'], 'a': ['b'], 'b': ['a', 'c'],
+                                       'c': ['d'], 'd': ['c', 'e'], 'e': []}))
+    assert levels == [['p'], ['a', 'b', 'x', 'y'], ['c', 'd'], ['e']]
+
+
+def test_cycle_members_do_not_wait_on_each_other():
+
+    dependencies = topic_graph.deploy_dependencies(graph({'a': ['b'], 'b': ['a', 'c'], 'c': []}))
+    assert dependencies == {'c': set(), 'a': set(), 'b': {'c'}}
+
+
+def test_long_cycle():
+
+    n = 5000
+    edges = {str(i): [str((i + 1) % n)] for i in range(n)}
+    assert [len(level) for level in topic_graph.levels(graph(edges))] == [n]
+
+
+def test_group_entries_by_level():
+
+    order = [['sink'], ['producer']]
+    entries = [{'task': 'producer'}, {'task': 'sink'}, {'task': 'outside'}]
+    assert topic_graph.group_entries(entries, order) == [[{'task': 'outside'}], [{'task': 'sink'}], [{'task': 'producer'}]]
\ No newline at end of file
@@ -0,0 +1,99 @@
+import pytest
+import src.utils as ut
+from src.scheduler import ContainerScheduler
+from src.container_backend import FakeBackend
+from src.component_deploy import deploy as deployer
+from src.component_deploy import remove as remover
+from src.component_deploy import manifests as mf
+from src.component_deploy.wadm_client import WadmSession, FakeNats
+
+
+def manifest(name, replicas=1):
+    return {'apiVersion': 'core.oam.dev/v1beta1', 'kind': 'Application', 'metadata': {'name': name},
+            'spec': {'components': [{'name': name, 'properties': {'image': f"localhost:5000/{name}:1.0.0"},
+                                     'traits': [{'type': 'spreadscaler', 'properties': {'instances': replicas}}]}]}}
+
+
+@pytest.fixture
+def nats():
+    return FakeNats()
+
+
+@pytest.fixture
+def session(nats):
+    session = WadmSession(None, None, connection=nats).start()
+    yield session
+    session.close()
+
+
+def test_apply_puts_and_deploys(session, nats):
+
+    result = session.apply(manifest('app'))
+    assert result['status'] == 'deployed'
+    assert nats.models['app']['deployed'] == 'v1'
+
+    # Same manifest, same version. A new one is deployed as the next version
+    assert session.apply(manifest('app'))['status'] == 'deployed'
+    assert len(nats.models['app']['versions']) == 1
+    session.apply(manifest('app', replicas=3))
+    assert nats.models['app']['deployed'] == 'v2'
+
+
+def test_apply_all_over_one_connection(session, nats):
+
+    results = session.apply_all([manifest(f"app{i}") for i in range(10)])
+
+    assert {result['status'] for result in results.values()} == {'deployed'}
+    assert sorted(nats.models) == sorted(f"app{i}" for i in range(10))
+    # put and deploy for each application
+    assert nats.requests == 20
+
+
+def test_remove(session, nats):
+
+    session.apply(manifest('app'))
+    assert session.remove(manifest('app'))['status'] == 'removed'
+    assert nats.models == {}
+    # Removing an application that is not there is not an error
+    assert session.remove(manifest('app'))['status'] == 'removed'
+
+
+def test_failures_are_reported():
+
+    session = WadmSession(None, None, connection=FakeNats(failure_rate=1.0)).start()
+    try:
+        result = session.apply(manifest('app'))
+        assert result['status'] == 'failed'
+        assert result['message'] == 'Simulated failure'
+        assert session.remove_all([manifest('app')])['app']['status'] == 'failed'
+    finally:
+        session.close()
+
+
+def test_close_closes_the_connection(nats):
+
+    session = WadmSession(None, None, connection=nats).start()
+    session.close()
+    assert nats.closed
+    # Closing twice is harmless
+    session.close()
+
+
+def test_deploy_and_remove_a_project(generated_project, session, nats):
+
+    scheduler = ContainerScheduler(max_concurrency=2)
+    backend = FakeBackend()
+
+    assert deployer.deploy_components(generated_project, None, None, scheduler, {}, False, session, True, None, backend)
+    assert sorted(nats.models) == ['data_double_test1', 'data_double_test2']
+    state = ut.load_state(generated_project, mf.DEPLOY_STATE)
+    assert sorted(state) == ['data_double_test1', 'data_double_test2']
+
+    # Nothing changed, nothing is sent to wadm
+    requests = nats.requests
+    assert deployer.deploy_components(generated_project, None, None, scheduler, {}, False, session, True, None, backend)
+    assert nats.requests == requests
+
+    assert remover.remove_components(generated_project, None, None, scheduler, session, backend)
+    assert nats.models == {}
+    assert ut.load_state(generated_project, mf.DEPLOY_STATE) == {}
\ No newline at end of file
@@ -0,0 +1,83 @@
+import os
+import yaml
+from src.watcher import ProjectWatcher, affected_components, load_tasks
+from src.component_deploy.wadm_client import WadmSession, FakeNats
+
+
+class RecordingNats(FakeNats):
+
+    # wadm operations received, as (operation, application)
+    def __init__(self):
+        super().__init__()
+        self.operations = []
+
+    async def request(self, subject, payload, timeout=None):
+        parts = subject.split('.')
+        self.operations.append((parts[4], '.'.join(parts[5:]) or None))
+        return await super().request(subject, payload, timeout)
+
+
+def edit_workflow(project_dir, edit):
+    path = os.path.join(project_dir, 'workflow.yaml')
+    with open(path) as file:
+        workflow = yaml.safe_load(file)
+    edit(workflow)
+    with open(path, 'w') as file:
+        yaml.safe_dump(workflow, file, sort_keys=False)
+
+
+def edit_task(workflow, name, **fields):
+    next(task for task in workflow['tasks'] if task['component_name'] == name).update(fields)
+
+
+def test_workflow_edit_affects_the_changed_tasks(project):
+
+    old = load_tasks(project)
+    edit_workflow(project, lambda workflow: edit_task(workflow, 'data_double_test2', dest_topic='other'))
+
+    assert affected_components({'workflow.yaml'}, old, load_tasks(project)) == ({'data_double_test2'}, set())
+
+
+def test_added_and_removed_tasks(project):
+
+    old = load_tasks(project)
+
+    def edit(workflow):
+        added = dict(workflow['tasks'][0], component_name='data_double_test3')
+        workflow['tasks'] = [workflow['tasks'][0], added]
+    edit_workflow(project, edit)
+
+    assert affected_components({'workflow.yaml'}, old, load_tasks(project)) == ({'data_double_test3'}, {'data_double_test2'})
+
+
+def test_shared_code_affects_every_task_using_it(project):
+
+    tasks = load_tasks(project)
+    assert affected_components({os.path.join('tasks', 'double.go')}, tasks, tasks) == ({'data_double_test1', 'data_double_test2'}, set())
+    # Files no task uses, and an unchanged workflow, affect nothing
+    assert affected_components({os.path.join('tasks', 'notes.md'), 'workflow.yaml'}, tasks, tasks) == (set(), set())
+
+
+def test_rebuilt_components_are_deployed_again(pelato, project):
+
+    nats = RecordingNats()
+    pelato.wadm_session = WadmSession(None, None, connection=nats).start()
+    assert pelato.generate(project) and pelato.build(project) and pelato.deploy(project)
+    watcher = ProjectWatcher(pelato, project)
+
+    # Same manifests, new modules under the same tags: removed from wadm, then put and deployed again
+    with open(os.path.join(project, 'tasks', 'double.go'), 'a') as file:
+        file.write("\n// edited\n")
+    nats.operations = []
+    watcher.update({os.path.join('tasks', 'double.go')})
+
+    for name in ('data_double_test1', 'data_double_test2'):
+        operations = [operation for operation, application in nats.operations if application in (name, None)]
+        assert operations.index('del') < operations.index('deploy')
+    assert {model['deployed'] for model in nats.models.values()} == {'v1'}
+
+    # Nothing rebuilt, nothing removed
+    nats.operations = []
+    watcher.update({os.path.join('tasks', 'notes.md')})
+    assert nats.operations == []
+    pelato.close()
\ No newline at end of file
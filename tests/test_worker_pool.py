@@ -0,0 +1,93 @@
+import os
+import shutil
+from src.container_backend import FakeBackend
+from src.wasm_builder import build
+from src.wasm_builder.worker_pool import WorkerPool, WORKER_PREFIX
+
+
+def jobs(project_dir, n):
+
+    # n copies of a generated component, each in its own gen/ folder
+    result = []
+    for i in range(n):
+        task = f"component{i}"
+        if not os.path.isdir(f"{project_dir}/gen/{task}"):
+            shutil.copytree(f"{project_dir}/gen/data_double_test1", f"{project_dir}/gen/{task}")
+        job = build.plan_build(project_dir, task, {}, False, 'user', 'pass', None, build.BUILD_IMAGE)
+        job['name'] = f"{task}-build"
+        result.append(job)
+    return result
+
+
+def test_jobs_run_on_long_lived_workers(generated_project):
+
+    backend = FakeBackend()
+    pool = WorkerPool(backend, 2)
+    build_jobs = jobs(generated_project, 5)
+
+    results = pool.run(build_jobs)
+
+    assert set(results.values()) == {0}
+    assert backend.started == 2
+    for job in build_jobs:
+        assert os.path.isfile(f"{job['source']}/build/data_double_test1.wasm")
+        assert job['build_log'].exit_code == 0
+    # The job directories are removed from the workers
+    for worker in backend.workers.values():
+        assert os.listdir(worker.path('/jobs')) == []
+
+
+def test_workers_are_recycled_after_max_jobs(generated_project):
+
+    backend = FakeBackend()
+    pool = WorkerPool(backend, 1, max_jobs=2)
+
+    assert set(pool.run(jobs(generated_project, 5)).values()) == {0}
+    # Started once, then replaced before the third and the fifth job
+    assert backend.started == 3
+
+
+def test_unhealthy_worker_is_replaced(generated_project):
+
+    backend = FakeBackend()
+    pool = WorkerPool(backend, 1)
+    first, second = jobs(generated_project, 2)
+
+    assert pool.run_one(first) == 0
+    backend.workers[f"{WORKER_PREFIX}0"].status = 'exited'
+    assert pool.run_one(second) == 0
+    assert backend.started == 2
+
+
+def test_workers_are_adopted_by_the_next_run(generated_project, tmp_path):
+
+    backend = FakeBackend()
+    state_file = str(tmp_path / "workers.json")
+    build_jobs = jobs(generated_project, 2)
+
+    WorkerPool(backend, 1, max_jobs=3, state_file=state_file).run(build_jobs)
+    assert backend.started == 1
+
+    # Same worker, and its job count carries over: recycled on the fourth job overall
+    pool = WorkerPool(backend, 1, max_jobs=3, state_file=state_file)
+    pool.run(build_jobs)
+    assert backend.started == 2
+
+
+def test_fail_fast_skips_the_remaining_jobs(generated_project):
+
+    backend = FakeBackend(failure_rate=1.0)
+    pool = WorkerPool(backend, 1)
+
+    results = pool.run(jobs(generated_project, 3), fail_fast=True)
+    assert results == {'component0-build': 1, 'component1-build': None, 'component2-build': None}
+
+
+def test_shutdown_removes_the_workers(generated_project):
+
+    backend = FakeBackend()
+    pool = WorkerPool(backend, 2)
+    pool.run(jobs(generated_project, 2))
+
+    pool.shutdown()
+    assert backend.workers == {}
\ No newline at end of file
@@ -4,6 +4,7 @@ import yaml
 import pandas as pd
 import numpy as np
 import os
+import sys
 
 # Function to read and parse the file
 def read_metrics(file_path):
@@ -12,7 +13,7 @@ def read_metrics(file_path):
     return data['runs']
 
 # Read metrics from the file
-file_path = 'res/metrics-parallel.yaml'  # Replace with your file path
+file_path = sys.argv[1] if len(sys.argv) > 1 else 'res/metrics-parallel.yaml'  # metrics.yaml or `pelato metrics export` output
 runs = read_metrics(file_path)
 
 # Flatten data into a list of dictionaries
@@ -0,0 +1,73 @@
+import os
+import re
+import sys
+import shutil
+import statistics
+import subprocess
+import tempfile
+
+# Startup cost of the CLI, from python -X importtime. Fails (exit code 1) when a command
+# imports a module it should not need, or when its import time goes over the budget.
+# Run from the repository root: python3 utils/startup_time.py [repetitions]
+
+# Command -> (arguments, modules it must not import, import time budget in ms)
+CASES = {
+    'help': (['--help'], ['docker', 'jinja2', 'yaml', 'dotenv', 'nats', 'sqlite3', 'asyncio'], 60),
+    'gen': (['gen', '{project}'], ['docker', 'nats', 'sqlite3', 'asyncio'], 250),
+}
+
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+def import_times(args, project_dir):
+
+    # {module: cumulative µs} and the total of the top-level imports. The .env of the
+    # repository is replaced by an empty one, it would override the settings below
+    dotenv = os.path.join(project_dir, '.env.empty')
+    open(dotenv, 'w').close()
+    env = dict(os.environ, ENABLE_METRICS='False', ENABLE_TRACING='False', PELATO_DOTENV=dotenv)
+    command = [sys.executable, '-X', 'importtime', 'pelato.py'] + [arg.format(project=project_dir) for arg in args]
+    result = subprocess.run(command, capture_output=True, text=True, env=env)
+
+    modules = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            _, cumulative, indent, module = match.groups()
+            modules[module] = int(cumulative)
+            if len(indent) == 1:
+                total += int(cumulative)
+    return modules, total
+
+def main():
+
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    project_dir = tempfile.mkdtemp(prefix='pelato-startup-')
+    shutil.copytree('example_project', project_dir, dirs_exist_ok=True)
+
+    failed = False
+    try:
+        for name, (args, forbidden, budget) in CASES.items():
+            totals = []
+            for _ in range(repetitions):
+                modules, total = import_times(args, project_dir)
+                totals.append(total / 1000)
+
+            # site and its .pth files are imported before pelato, they are not ours
+            median = statistics.median(totals) - modules.get('site', 0) / 1000
+            loaded = [module for module in forbidden if module in modules]
+
+            status = 'ok'
+            if loaded or median > budget:
+                status = 'FAIL'
+                failed = True
+            print(f"{name:<6} {median:8.1f} ms (budget {budget} ms) {status}")
+            if loaded:
+                print(f"       imports {', '.join(loaded)}")
+    finally:
+        shutil.rmtree(project_dir, ignore_errors=True)
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file